@@ -0,0 +1,482 @@
+"""
+Run a fixed set of benchmark scenarios and report throughput and latency
+percentiles, optionally saving the results as JSON and comparing them
+against a saved baseline.
+
+Unlike benchmark_simple.py and benchmark_udp.py (which print counts every
+second until interrupted), each scenario runs for a fixed duration after
+a warmup period, so runs are repeatable and can be compared automatically.
+
+Scenarios:
+
+* get_id: Node.get_id(), in-process.
+* reserve: Node.reserve(batch_size), in-process.
+* udp: one id per request, to a one-process UDP server.
+* udp_batch: batch_size ids per request, to a one-process UDP server.
+* udp_multiprocess: one id per request, from processes client processes
+  to a processes-worker server (global_id_serve.Supervisor).
+
+The default Node generates at most 2 ** 17 ids per second, so most
+calls would get OutOfIds errors, and the results would depend on
+how the warmup lines up with the second boundaries. Instead, all the
+scenarios use BenchmarkNode, whose 27-bit sequence is enough for
+~134M ids per second; errors should stay at 0, and calls/s measures
+the successful path. calls/s counts both successful and failed calls,
+ids/s only the former. The warmup must be longer than a second,
+since new nodes refuse to generate ids for their first second.
+
+Latency is measured for one in SAMPLE_EVERY calls for in-process
+scenarios (to keep the clock overhead low), and for every call for UDP
+scenarios. Percentiles are the upper bound of a histogram bucket,
+so they are overestimated by at most ~4.5%.
+
+Usage::
+
+    python benchmark_suite.py [--duration S] [--warmup S] [--processes N] \\
+        [--batch-size N] [--port PORT] [--engine ENGINE] \\
+        [--output FILE] [--baseline FILE] [--threshold FRACTION] \\
+        [SCENARIO ...]
+
+With --baseline, calls/s, p50 and p99 latency are compared with those in
+FILE (the --output of a previous run); the exit status is 1 if any of them
+is worse by more than the threshold (default 0.1, i.e. 10%).
+
+"""
+
+import sys
+import json
+import time
+import socket
+import bisect
+import argparse
+import platform
+import threading
+import multiprocessing
+
+from global_id import Node, Histogram, GlobalIdError
+from global_id_udp import get_id, get_ids, ENGINES
+from global_id_serve import Supervisor
+
+
+# latency histogram bucket upper bounds, in ns: 16 buckets per power of 2,
+# from 16 ns to ~17 s
+LATENCY_BUCKETS = tuple(round(2 ** (i / 16)) for i in range(4 * 16, 34 * 16 + 1))
+
+SAMPLE_EVERY = 16
+
+PERCENTILES = (("p50", 0.5), ("p99", 0.99), ("p999", 0.999))
+
+if hasattr(time, "perf_counter_ns"):
+    perf_counter_ns = time.perf_counter_ns
+else:  # pragma: no cover
+    # Python 3.6
+    def perf_counter_ns():
+        return int(time.perf_counter() * 1e9)
+
+
+def measure(call, duration, sample_every=1):
+    """Call call() repeatedly for duration seconds.
+
+    Args:
+        call (callable): Returns the number of ids it got; 0 or raising
+            GlobalIdError means an error.
+        duration (float): How long to run, in seconds.
+        sample_every (int): Measure the latency of one in sample_every calls.
+
+    Returns:
+        dict: calls, errors, ids, seconds, latency_counts, latency_max
+        (see result()).
+
+    """
+    buckets = LATENCY_BUCKETS
+    counts = [0] * (len(buckets) + 1)
+    calls = errors = ids = latency_max = 0
+    untimed = range(sample_every - 1)
+    clock = perf_counter_ns
+
+    start = now = clock()
+    end = start + int(duration * 1e9)
+    while now < end:
+        for _ in untimed:
+            try:
+                n = call()
+            except GlobalIdError:
+                n = 0
+            ids += n
+            errors += not n
+
+        before = clock()
+        try:
+            n = call()
+        except GlobalIdError:
+            n = 0
+        now = clock()
+
+        ids += n
+        errors += not n
+        calls += sample_every
+
+        latency = now - before
+        counts[bisect.bisect_left(buckets, latency)] += 1
+        if latency > latency_max:
+            latency_max = latency
+
+    return dict(
+        calls=calls,
+        errors=errors,
+        ids=ids,
+        seconds=(now - start) / 1e9,
+        latency_counts=counts,
+        latency_max=latency_max,
+    )
+
+
+def measure_with_warmup(call, warmup, duration, sample_every=1):
+    """Like measure(), but call call() for warmup seconds first."""
+    measure(call, warmup, sample_every)
+    return measure(call, duration, sample_every)
+
+
+def percentile(histogram, q, max_value):
+    """Return the q quantile of the values in a Histogram, as the upper bound
+    of its bucket (max_value for the overflow bucket); None if empty."""
+    if not histogram.count:
+        return None
+    rank = q * histogram.count
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        if cumulative >= rank:
+            return min(bound, max_value)
+    return max_value
+
+
+def result(measurements):
+    """Combine the measure() results of one or more (concurrent) processes.
+
+    Returns:
+        dict: A JSON-serializable dict with the keys processes, calls,
+        errors, ids, seconds, calls_per_second, ids_per_second,
+        and latency_ns (a dict with the keys p50, p99, p999, max).
+
+    """
+    histogram = Histogram(LATENCY_BUCKETS)
+    for m in measurements:
+        counts = zip(histogram.counts, m["latency_counts"])
+        histogram.counts = [a + b for a, b in counts]
+    histogram.count = sum(histogram.counts)
+    latency_max = max(m["latency_max"] for m in measurements)
+
+    latency = {
+        name: percentile(histogram, q, latency_max) for name, q in PERCENTILES
+    }
+    latency["max"] = latency_max
+
+    return dict(
+        processes=len(measurements),
+        calls=sum(m["calls"] for m in measurements),
+        errors=sum(m["errors"] for m in measurements),
+        ids=sum(m["ids"] for m in measurements),
+        seconds=max(m["seconds"] for m in measurements),
+        # the processes may not run for exactly the same time
+        calls_per_second=sum(m["calls"] / m["seconds"] for m in measurements),
+        ids_per_second=sum(m["ids"] / m["seconds"] for m in measurements),
+        latency_ns=latency,
+    )
+
+
+class BenchmarkNode(Node):
+
+    """A Node that doesn't run out of ids during the benchmarks;
+    the ids are still 64 bits, but there can only be 16 nodes."""
+
+    time_part_bits = 33
+    sequence_bits = 27
+    node_id_bits = 4
+
+
+def run_get_id(config):
+    node = BenchmarkNode(0)
+
+    def call():
+        node.get_id()
+        return 1
+
+    return result(
+        [
+            measure_with_warmup(
+                call, config["warmup"], config["duration"], SAMPLE_EVERY
+            )
+        ]
+    )
+
+
+def run_reserve(config):
+    node = BenchmarkNode(0)
+    batch_size = config["batch_size"]
+
+    def call():
+        return len(node.reserve(batch_size))
+
+    return result(
+        [
+            measure_with_warmup(
+                call, config["warmup"], config["duration"], SAMPLE_EVERY
+            )
+        ]
+    )
+
+
+def wait_for_server(sock, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return get_id(sock)
+        except (ConnectionRefusedError, socket.timeout):
+            if time.monotonic() > deadline:
+                raise RuntimeError("server did not start")
+            time.sleep(0.01)
+
+
+def udp_client(addr, batch_size, warmup, duration):
+    """Request ids from the server at addr; the UDP scenario client."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(1)
+        sock.connect(addr)
+        wait_for_server(sock)
+
+        if batch_size is None:
+
+            def call():
+                try:
+                    status, _ = get_id(sock)
+                except socket.timeout:
+                    return 0
+                return 1 if status == 0 else 0
+
+        else:
+
+            def call():
+                try:
+                    status, ids = get_ids(sock, batch_size)
+                except socket.timeout:
+                    return 0
+                return len(ids) if status == 0 else 0
+
+        return measure_with_warmup(call, warmup, duration)
+
+
+def run_udp_scenario(config, processes, batch_size):
+    addr = ("127.0.0.1", config["port"])
+    supervisor = Supervisor(
+        addr,
+        0,
+        workers=processes,
+        engine=config["engine"],
+        node_cls=BenchmarkNode,
+        stop_timeout=1,
+    )
+    thread = threading.Thread(target=supervisor.run)
+    thread.start()
+
+    args = (addr, batch_size, config["warmup"], config["duration"])
+    try:
+        if processes == 1:
+            measurements = [udp_client(*args)]
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                measurements = pool.starmap(udp_client, [args] * processes)
+    finally:
+        supervisor.stop()
+        thread.join()
+
+    return result(measurements)
+
+
+def run_udp(config):
+    return run_udp_scenario(config, 1, None)
+
+
+def run_udp_batch(config):
+    return run_udp_scenario(config, 1, config["batch_size"])
+
+
+def run_udp_multiprocess(config):
+    return run_udp_scenario(config, config["processes"], None)
+
+
+SCENARIOS = {
+    "get_id": run_get_id,
+    "reserve": run_reserve,
+    "udp": run_udp,
+    "udp_batch": run_udp_batch,
+    "udp_multiprocess": run_udp_multiprocess,
+}
+
+
+def environment():
+    """Return information about the environment the benchmarks ran in."""
+    return dict(
+        python_implementation=platform.python_implementation(),
+        python_version=platform.python_version(),
+        platform=platform.platform(),
+        cpu_count=multiprocessing.cpu_count(),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    )
+
+
+def run(scenarios, config, report=None):
+    """Run a number of scenarios.
+
+    Args:
+        scenarios (list(str)): Keys of SCENARIOS.
+        config (dict): duration, warmup, processes, batch_size, port, engine.
+        report (callable or None): Called with (name, result) after
+            each scenario.
+
+    Returns:
+        dict: A JSON-serializable dict with the keys environment, config,
+        and results (scenario name -> result(), see result()).
+
+    """
+    results = {}
+    for name in scenarios:
+        results[name] = SCENARIOS[name](config)
+        if report:
+            report(name, results[name])
+    return dict(environment=environment(), config=config, results=results)
+
+
+def format_ns(value):
+    return "-" if value is None else f"{value / 1000:.2f}"
+
+
+def print_result(name, result):
+    latency = result["latency_ns"]
+    print(
+        f"{name:<16} {result['calls_per_second']:>12.0f} "
+        f"{result['ids_per_second']:>12.0f} {result['errors']:>10} "
+        + " ".join(f"{format_ns(latency[p]):>9}" for p in ("p50", "p99", "p999")),
+        flush=True,
+    )
+
+
+def print_header():
+    print(
+        f"{'scenario':<16} {'calls/s':>12} {'ids/s':>12} {'errors':>10} "
+        + " ".join(f"{p + ' us':>9}" for p in ("p50", "p99", "p999"))
+    )
+
+
+# (description, function to get the value, True if higher is better)
+COMPARED_METRICS = (
+    ("calls/s", lambda r: r["calls_per_second"], True),
+    ("p50", lambda r: r["latency_ns"]["p50"], False),
+    ("p99", lambda r: r["latency_ns"]["p99"], False),
+)
+
+
+def compare(baseline, current, threshold=0.1):
+    """Compare two run() results.
+
+    Args:
+        baseline (dict): The reference run() result.
+        current (dict): The run() result to check.
+        threshold (float): The largest acceptable relative change
+            for the worse.
+
+    Returns:
+        list(tuple(str, str, float, float, float, bool)):
+        (scenario, metric, baseline value, current value, relative change,
+        regression) tuples, for the scenarios in both results.
+
+    """
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for metric, get, higher_is_better in COMPARED_METRICS:
+            base_value, value = get(base), get(result)
+            if not base_value or value is None:
+                continue
+            change = (value - base_value) / base_value
+            worse_by = -change if higher_is_better else change
+            rows.append((name, metric, base_value, value, change, worse_by > threshold))
+    return rows
+
+
+def print_comparison(rows):
+    print(f"{'scenario':<16} {'metric':<8} {'baseline':>12} {'current':>12} change")
+    for name, metric, base_value, value, change, regression in rows:
+        print(
+            f"{name:<16} {metric:<8} {base_value:>12.0f} {value:>12.0f} "
+            f"{change:+7.1%}{'  REGRESSION' if regression else ''}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run benchmark scenarios, and compare them to a baseline."
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="SCENARIO",
+        help=f"one of {', '.join(SCENARIOS)}; default: all",
+    )
+    parser.add_argument("--duration", type=float, default=5, help="seconds")
+    parser.add_argument("--warmup", type=float, default=1.5, help="seconds")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="for udp_multiprocess; default: the CPU count",
+    )
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="blocking")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this file")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario: {name}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    else:
+        baseline = None
+
+    config = dict(
+        duration=args.duration,
+        warmup=args.warmup,
+        processes=args.processes,
+        batch_size=args.batch_size,
+        port=args.port,
+        engine=args.engine,
+    )
+
+    print_header()
+    results = run(args.scenarios or list(SCENARIOS), config, print_result)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if baseline is None:
+        return 0
+
+    if baseline["config"] != config:
+        print("warning: the baseline was run with a different config", file=sys.stderr)
+    print()
+    rows = compare(baseline, results, args.threshold)
+    print_comparison(rows)
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
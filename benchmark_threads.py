@@ -0,0 +1,70 @@
+"""
+Measure the lock contention cost of sharing a ThreadSafeNode between threads.
+
+For 1 .. N threads, call node.get_id() as fast as possible from all
+the threads for a fixed duration, and print the number of calls / second
+(both successful and OutOfIds, since a node runs out of ids for a second
+long before the lock becomes a bottleneck).
+
+A plain (non-thread-safe) Node with a single thread is used as a baseline.
+
+With the GIL, the threads do not run in parallel anyway, so the numbers
+mostly show the lock overhead; on free-threaded CPython, they show
+the contention cost too.
+
+"""
+import time
+import threading
+
+from global_id import Node, ThreadSafeNode, GlobalIdError
+
+
+def do_requests(node, duration, counts, index):
+    """Call node.get_id() as fast as possible for duration seconds,
+    and store the number of calls in counts[index]."""
+    count = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        try:
+            node.get_id()
+        except GlobalIdError:
+            pass
+        count += 1
+    counts[index] = count
+
+
+def do_benchmark_threads(node, thread_count, duration):
+    counts = [0] * thread_count
+    threads = [
+        threading.Thread(target=do_requests, args=(node, duration, counts, i))
+        for i in range(thread_count)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / duration
+
+
+def do_benchmark(max_thread_count, duration):
+    calls = do_benchmark_threads(Node(0), 1, duration)
+    print(f"Node, threads: 1, calls/s: {calls:.0f}")
+
+    for thread_count in range(1, max_thread_count + 1):
+        calls = do_benchmark_threads(ThreadSafeNode(0), thread_count, duration)
+        print(f"ThreadSafeNode, threads: {thread_count}, calls/s: {calls:.0f}")
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    if len(sys.argv) > 1:
+        max_thread_count = int(sys.argv[1])
+    else:
+        max_thread_count = os.cpu_count()
+
+    try:
+        do_benchmark(max_thread_count, 2)
+    except KeyboardInterrupt:
+        print("interrupted", file=sys.stderr)
@@ -13,14 +13,28 @@ We are using multiple processes for the following reasons:
 We are using processes and not threads to work around the GIL;
 https://docs.python.org/3/glossary.html#term-global-interpreter-lock
 
+Usage::
+
+    python benchmark_udp.py [process_count [engine [shared]]]
+
+engine is one of global_id_udp.ENGINES; if "shared" is given, the server
+processes share the full sequence of the node (global_id.SharedNode),
+leasing blocks of LEASE_SIZE sequences from it as needed, instead of each
+being a separate subnode with a fixed share of the sequence.
+
 """
 import socket
 import time
 import multiprocessing
 
+from global_id import SharedNode, SharedState
 from global_id_udp import run_server, get_id
 
 
+# sequences leased at a time by each process in shared mode
+LEASE_SIZE = 256
+
+
 def do_requests(addr):
     """Make as many id requests as possible to addr, forever.
 
@@ -36,7 +50,7 @@ def do_requests(addr):
         ok_error_counts = [0, 0]
         while True:
             status, *_ = get_id(sock)
-            ok_error_counts[status] += 1
+            ok_error_counts[status != 0] += 1
 
             end = time.monotonic()
             if end - start > 1:
@@ -80,8 +94,12 @@ def start_in_processes(process_count, func, *args):
     return processes
 
 
-def run_server_wrapper(process_id, process_count, addr, node_id):
-    run_server(addr, node_id, process_id, process_count)
+def run_server_wrapper(process_id, process_count, addr, node_id, engine):
+    run_server(addr, node_id, process_id, process_count, engine=engine)
+
+
+def run_shared_server_wrapper(process_id, process_count, addr, node_id, engine, state):
+    run_server(addr, node_id, state, LEASE_SIZE, engine=engine, node_cls=SharedNode)
 
 
 def consume_response_stats(process_id, process_count, addr, queue):
@@ -89,8 +107,13 @@ def consume_response_stats(process_id, process_count, addr, queue):
         queue.put(stats)
 
 
-def do_benchmark(addr, process_count):
-    start_in_processes(process_count, run_server_wrapper, addr, 0)
+def do_benchmark(addr, process_count, engine="blocking", shared=False):
+    if shared:
+        start_in_processes(
+            process_count, run_shared_server_wrapper, addr, 0, engine, SharedState()
+        )
+    else:
+        start_in_processes(process_count, run_server_wrapper, addr, 0, engine)
 
     queue = multiprocessing.Queue()
     start_in_processes(process_count, consume_response_stats, addr, queue)
@@ -118,7 +141,14 @@ if __name__ == "__main__":
     else:
         process_count = multiprocessing.cpu_count()
 
+    if len(sys.argv) > 2:
+        engine = sys.argv[2]
+    else:
+        engine = "blocking"
+
+    shared = len(sys.argv) > 3 and sys.argv[3] == "shared"
+
     try:
-        do_benchmark(addr, process_count)
+        do_benchmark(addr, process_count, engine, shared)
     except KeyboardInterrupt:
         print("interrupted", file=sys.stderr)
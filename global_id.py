@@ -28,6 +28,22 @@ The sequence makes ids generated within the same second unique.
 This allows for a maximum of 2**17 = ~131K ids / second / node.
 Once the possible ids for a second are exhausted, an exception is raised.
 
+Ids can also be allocated in batches with :meth:`Node.reserve` (as a range)
+or :meth:`Node.get_ids` (as a list); all the ids in a batch have the same
+time part, so if the current second does not have enough ids left,
+a smaller batch is returned.
+
+Instead of raising an exception when the ids for the current time part are
+exhausted, the ``*_wait()`` / ``*_async()`` Node methods can wait for
+the next time part (up to a timeout).
+
+Alternatively, setting the max_lead Node attribute allows the node to
+"borrow" ids from future time parts once the current one is exhausted,
+as long as its (logical) time part is at most max_lead time parts ahead of
+the clock; after that, ids are generated again only once the clock catches
+up. The logical time part never goes backwards, so the ids stay unique.
+:attr:`Node.lead` shows how far ahead of the clock a node is.
+
 The node id makes ids generated by different nodes unique. There can be
 up to 1024 nodes. It is assumed that the node id does not change for a
 running node, and that no more than 1 node with a specific id exists
@@ -39,6 +55,14 @@ length of the generated ids can be adjusted by changing the
 changing time_part_bits to 34 and sequence_bits to 20 gives ids for
 ~544 years at maximum ~1M ids / second / node.
 
+The time part resolution can be changed with the ticks_per_second
+Node attribute; the time part then represents ticks (instead of seconds)
+since the epoch, and everything described here for seconds applies to
+ticks. For example, with ticks_per_second = 1000, time_part_bits = 41,
+sequence_bits = 12 (like Snowflake), there can be at most 4096 ids / ms,
+so a burst cannot use up the ids for a whole second, and the time during
+which no ids are generated after startup (see below) is only 1 ms.
+
 Subnodes
 --------
 
@@ -50,6 +74,14 @@ the following is true for each subnode i (0 .. n-1) out of n subnodes::
 
     sequence(subnode.get_id()) % n == i
 
+Node instances are not thread-safe; to share a single (sub)node between
+threads, use :class:`ThreadSafeNode` instead.
+
+Because the split is fixed, a subnode can run out of ids while the others
+still have some left (e.g. if the load is not spread evenly between them).
+Alternatively, multiple processes can allocate from the full sequence of
+a single node by sharing its state; see :class:`SharedNode`.
+
 Assumptions
 -----------
 
@@ -64,6 +96,20 @@ It is still possible for a node to generate some ids, die, get started again,
 and generate some more ids, all in the same second (time part interval).
 We avoid having to pass the last sequence between nodes with the same node id
 by refusing to generate ids for the first second.
+If max_lead is set, the previous node may have generated ids for up to
+max_lead time parts ahead of the first second, so they are refused too
+(but a node can still borrow from the time parts after them right away).
+
+Alternatively, a node can record a high-water mark of the ids it may have
+generated in a :class:`StateFile`; a node started later with the same file
+resumes right after the mark, without refusing the first second.
+The mark is reserved ahead in batches of sequences, so the file is written
+(and flushed to disk) once per batch, not once per id.
+With a short time part (e.g. ticks_per_second = 1000), the mark instead
+reserves whole time parts up to a window (StateFile window, 0.1 seconds
+by default) ahead, so the file is written at most once per window,
+not once per time part; a node started later resumes after the window,
+so it may refuse ids for up to window seconds.
 
 Between nodes with the same node id, implicit synchronization happens via
 the system clock (Node.time()).
@@ -72,6 +118,9 @@ For the duration lifetime of a single node, the only problem that can arise
 is the system clock going backwards (being non-monotonic).
 We avoid this by recording the last time an id was generated, and refusing
 to generate another one if the clock went backwards.
+To avoid refusing ids during small clock adjustments, a node can use
+a :class:`MonotonicClock` as its time source; it advances with the monotonic
+clock, and follows the system clock gradually.
 
 A problem can arise when a node gets started on a different system.
 If the clock on the new machine is behind the clock on the old one,
@@ -81,14 +130,15 @@ according to their clocks (which can lead to duplicate ids).
 To prevent this, the system clocks between machines should be kept in sync
 using NTP.
 
-A watchdog could be implemented that checks the system clock hasn't drifted
-more than some amount from a reference source, and kills the node if it
-did (with some head room for the actual checking, killing etc.); this
-is acceptable, since we prefer reduced availability (on a node) to duplicate
-ids. Then, when a node starts, we wait more than the maximum drift period::
+A watchdog (:class:`ClockWatchdog`) checks the system clock hasn't drifted
+more than max_drift from a reference source, and makes the node refuse
+to generate ids while it did (with some head room for the actual checking);
+this is acceptable, since we prefer reduced availability (on a node)
+to duplicate ids. Also, when a node with max_drift starts, it refuses
+to generate ids for max_drift * 2 seconds::
 
-    node = Node(node_id)
-    time.sleep(max_drift * 2)
+    node = Node(node_id, max_drift=max_drift)
+    ClockWatchdog(node, reference_time).start()
     serve_ids(node)
 
 If system dies and the clock synchronization source (NTP servers) dies too,
@@ -97,10 +147,20 @@ did not go backwards.
 
 """
 
+import os
+import mmap
 import time
 import math
+import bisect
+import socket
+import struct
+import asyncio
 import datetime
-from typing import Tuple, ClassVar, TYPE_CHECKING
+import threading
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, ClassVar
+from typing import Sequence
+from typing import TYPE_CHECKING
 
 # Final appears in the typing module only in Python 3.8, and we don't want
 # to force people to install typing_extensions (mypy always depends on it).
@@ -110,12 +170,27 @@ else:
     Final = "Final"
 
 
+_T = TypeVar("_T")
+
+
 class GlobalIdError(Exception):
     pass
 
 
 class OutOfIds(GlobalIdError):
-    pass
+
+    """No ids are left for now.
+
+    Args:
+        message (str): The error message.
+        retry_after (float or None): How many seconds until the node
+            can generate ids again, if known.
+
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 
 class OutOfSeconds(GlobalIdError):
@@ -126,6 +201,30 @@ class ClockError(GlobalIdError):
     pass
 
 
+class Histogram:
+
+    """A histogram of observed values, with fixed buckets
+    (like a Prometheus histogram).
+
+    Args:
+        buckets (sequence(float)): The (sorted) bucket upper bounds;
+            values larger than the last one go in an extra bucket.
+
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets: Final = tuple(buckets)
+        # per bucket, not cumulative; the last one is for values > buckets[-1]
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
 class Node:
 
     """
@@ -137,21 +236,51 @@ class Node:
         node_id (int): The node id, in range(1024).
         subnode_id (int): The subnode id, in range(subnode_count).
         subnode_count (int): The subnode count, must be positive.
+        state_file (StateFile or None): If given, persist a high-water mark
+            of the generated ids, and resume from it on startup.
+        max_drift (float): The maximum clock drift (in seconds) compared
+            to a reference source (see ClockWatchdog); if not 0, refuse
+            to generate ids for the first max_drift * 2 seconds.
+        clock (callable or None): If given, use it instead of the time()
+            method as the time source (e.g. a MonotonicClock).
 
     """
 
-    # TODO: account for some desync (make max_drift part of the API)
-
-    time_part_bits: ClassVar = 37
-    sequence_bits: ClassVar = 17
-    node_id_bits: ClassVar = 10
+    time_part_bits: ClassVar[int] = 37
+    sequence_bits: ClassVar[int] = 17
+    node_id_bits: ClassVar[int] = 10
+
+    # the time part resolution; must be a positive integer
+    ticks_per_second: ClassVar[int] = 1
+
+    # how many time parts ahead of the clock a node can borrow ids from
+    max_lead: ClassVar[int] = 0
+
+    # the sequence_utilization histogram buckets
+    utilization_buckets: ClassVar[Tuple[float, ...]] = (
+        0.01,
+        0.1,
+        0.25,
+        0.5,
+        0.75,
+        0.9,
+        0.99,
+        1,
+    )
 
-    time_part_epoch: ClassVar = int(
+    time_part_epoch: ClassVar[int] = int(
         datetime.datetime(2020, 1, 1).replace(tzinfo=datetime.timezone.utc).timestamp()
     )
 
     def __init__(
-        self, node_id: int, subnode_id: int = 0, subnode_count: int = 1,
+        self,
+        node_id: int,
+        subnode_id: int = 0,
+        subnode_count: int = 1,
+        *,
+        state_file: Optional["StateFile"] = None,
+        max_drift: float = 0,
+        clock: Optional[Callable[[], float]] = None,
     ):
         if node_id < 0 or node_id.bit_length() > self.node_id_bits:
             raise ValueError(
@@ -173,24 +302,223 @@ class Node:
         self._subnode_id: Final = subnode_id
         self._subnode_count: Final = subnode_count
 
+        if clock is not None:
+            # an instance attribute, so get_id() calls it directly
+            self.time = clock  # type: ignore
+
         # we don't want to emit any ids for the current second,
         # since we don't know the sequence for it, so we consider it exhausted
+        # (same for the ones a previous node may have borrowed)
         self._last_now = self.time()
-        self._last_sequence = 2 ** self.sequence_bits
+        self._last_time_part = self._time_part_for(self._last_now) + self.max_lead
+        self._last_sequence: int = 2 ** self.sequence_bits
+
+        self._max_sequence: Final[int] = 2 ** self.sequence_bits - 1
+
+        # the highest sequence that can be used without writing the state file
+        # for the time part of the last id (checked by the get_id() fast path)
+        self._sequence_limit = self._max_sequence
+
+        if max_drift < 0:
+            raise ValueError(
+                f"max_drift must be a non-negative number, got: {max_drift}"
+            )
+        self.max_drift: Final = max_drift
+        self._not_before = self._last_now + max_drift * 2
+        # if not None, the reason ids are refused (see suspend())
+        self._suspended: Optional[str] = None
+
+        self._state_file: Final = state_file
+        # the (time_part, sequence) high-water mark in the state file
+        self._reserved = (-1, -1)
+        # how many time parts after the current one the mark reserves
+        self._reserved_ahead = 0
+        if state_file is not None:
+            self._reserved_ahead = round(state_file.window * self.ticks_per_second)
+            mark = state_file.read()
+            if mark is not None:
+                # a previous node may have generated ids up to the mark
+                self._last_time_part, self._last_sequence = mark
+                self._reserved = mark
+
+        # statistics; the get_id() fast path does not update them, the slow
+        # paths account for its ids afterwards (see _count_ids())
+        self._issued_ids = 0
+        self._fast_path_start: int = self._last_sequence
+        self._stats_time_part: int = self._last_time_part
+        self._stats_time_part_ids = 0
+        # exception class name -> count
+        self.error_counts: Dict[str, int] = {}
+        # the fraction of the sequences used in each time part
+        # (out of those available to the subnode) that had ids generated
+        self.sequence_utilization: Final = Histogram(self.utilization_buckets)
+
+        # state that depends only on the time part of the last id, so get_id()
+        # does not have to recompute it for every id (see _set_time_part());
+        # the initial values make sure the get_id() fast path is not used
+        self._time_part = -1
+        self._time_part_end = -math.inf
+        self._time_prefix = 0
 
     @staticmethod
     def time() -> float:
         """Return the time since the Unix epoch."""
         return time.time()
 
+    @staticmethod
+    def sleep(seconds: float) -> None:
+        """Wait for a number of seconds (used by the *_wait() methods)."""
+        time.sleep(seconds)
+
     def get_id(self) -> int:
         """Return a new id.
 
         Raises:
             GlobalIdError
         """
+        now = self.time()
+
+        # fast path: same time part as the last id, and the clock did not move
+        # backwards; equivalent to _next(), but with (almost) no float math
+        # (at tick boundaries, _time_part_end and _time_part_for() may
+        # disagree due to rounding, which is fine, since both are monotonic)
+        if self._last_now <= now < self._time_part_end:
+            sequence = self._last_sequence + self._subnode_count
+            if sequence > self._sequence_limit:
+                if sequence <= self._max_sequence or self.max_lead:
+                    return self._pack_id(*self._get_id())
+                error = OutOfIds(
+                    f"ran out of ids for time part: {self._time_part}",
+                    self._time_part_end - now,
+                )
+                self._count_error(error)
+                raise error
+            self._last_now = now
+            self._last_sequence = sequence
+            return self._time_prefix | sequence << self.node_id_bits
+
         return self._pack_id(*self._get_id())
 
+    def suspend(self, reason: str) -> None:
+        """Refuse to generate ids (raise ClockError) until resume() is called.
+
+        Meant to be called from another thread (e.g. by ClockWatchdog);
+        an id being generated concurrently with the call may still be returned,
+        but no ids are generated after that.
+
+        """
+        self._suspended = reason
+        # disable the get_id() fast path, so the slow path can check
+        self._time_part = -1
+        self._time_part_end = -math.inf
+
+    def resume(self) -> None:
+        """Undo suspend()."""
+        self._suspended = None
+
+    @property
+    def node_id(self) -> int:
+        return self._node_id
+
+    @property
+    def subnode_id(self) -> int:
+        return self._subnode_id
+
+    @property
+    def suspended(self) -> Optional[str]:
+        """The reason passed to suspend(), or None if not suspended."""
+        return self._suspended
+
+    @property
+    def issued_ids(self) -> int:
+        """The number of ids generated by the node."""
+        return self._issued_ids + self._fast_path_ids()
+
+    @property
+    def lead(self) -> int:
+        """How many time parts ahead of the clock the node is (see max_lead)."""
+        return max(0, self._last_time_part - self._time_part_for(self.time()))
+
+    def get_ids(self, n: int) -> List[int]:
+        """Return a list of up to n new ids.
+
+        See reserve() for details.
+
+        Raises:
+            GlobalIdError
+        """
+        return list(self.reserve(n))
+
+    def reserve(self, n: int) -> range:
+        """Reserve up to n new ids and return them as a range.
+
+        All the ids have the same time part. If there are fewer than n ids
+        left for the current time part, only those are returned.
+
+        Raises:
+            ValueError: If n is not positive.
+            GlobalIdError: If no ids can be generated.
+        """
+        time_part, sequences, node_id = self._reserve(n)
+        start = self._pack_id(time_part, sequences.start, node_id)
+        step = sequences.step << self.node_id_bits
+        return range(start, start + len(sequences) * step, step)
+
+    def get_id_wait(self, timeout: float) -> int:
+        """Like get_id(), but if there are no ids left for the current
+        time part, wait for the next one, for up to timeout seconds.
+
+        Raises:
+            OutOfIds: If waiting for the next time part would exceed timeout.
+            GlobalIdError
+        """
+        return self._wait(self.get_id, timeout)
+
+    def reserve_wait(self, n: int, timeout: float) -> range:
+        """Like reserve(), but wait like get_id_wait()."""
+        return self._wait(lambda: self.reserve(n), timeout)
+
+    async def get_id_async(self, timeout: float) -> int:
+        """Like get_id_wait(), but wait using asyncio.sleep()."""
+        start = self.time()
+        while True:
+            try:
+                return self.get_id()
+            except OutOfIds as e:
+                delay = self._wait_delay(e, start, timeout)
+            await asyncio.sleep(delay)
+
+    async def reserve_async(self, n: int, timeout: float) -> range:
+        """Like reserve_wait(), but wait using asyncio.sleep()."""
+        start = self.time()
+        while True:
+            try:
+                return self.reserve(n)
+            except OutOfIds as e:
+                delay = self._wait_delay(e, start, timeout)
+            await asyncio.sleep(delay)
+
+    def _wait(self, get: Callable[[], _T], timeout: float) -> _T:
+        start = self.time()
+        while True:
+            try:
+                return get()
+            except OutOfIds as e:
+                delay = self._wait_delay(e, start, timeout)
+            self.sleep(delay)
+
+    def _wait_delay(self, error: OutOfIds, start: float, timeout: float) -> float:
+        """After error, return how long to wait for the next time part,
+        or re-raise error if that would end after start + timeout.
+
+        """
+        now = self.time()
+        delay = self._time_part_to_time(self._time_part_for(now) + 1) - now
+        if now + delay > start + timeout:
+            raise error
+        # because of rounding, we may be at the end of the time part already
+        return max(delay, 0.001 / self.ticks_per_second)
+
     def _get_id(self) -> Tuple[int, int, int]:
         """Return a new id as a (time_part, sequence, node_id) tuple,
         advancing the generator state as needed.
@@ -200,25 +528,158 @@ class Node:
 
         """
         now = self.time()
+        try:
+            self._check_clock(now)
+            time_part, sequence = self._next(
+                now,
+                self._last_now,
+                self._last_time_part,
+                self._last_sequence,
+                self._subnode_id,
+                self._subnode_count,
+            )
+        except GlobalIdError as e:
+            self._count_error(e)
+            raise
 
-        time_part, sequence = self._next(
-            now,
-            self._last_now,
-            self._last_sequence,
-            self._subnode_id,
-            self._subnode_count,
-        )
+        self._persist(time_part, sequence)
+        self._count_ids(time_part, 1, sequence)
 
         self._last_now = now
+        self._last_time_part = time_part
         self._last_sequence = sequence
+        self._set_time_part(time_part)
 
         return time_part, sequence, self._node_id
 
+    def _reserve(self, n: int) -> Tuple[int, range, int]:
+        """Like _get_id(), but return up to n sequences
+        as a (time_part, range(sequence, ...), node_id) tuple.
+
+        """
+        if n <= 0:
+            raise ValueError(f"n must be a positive integer, got: {n}")
+
+        now = self.time()
+        try:
+            self._check_clock(now)
+            time_part, first_sequence, last_sequence = self._next_range(
+                now,
+                self._last_now,
+                self._last_time_part,
+                self._last_sequence,
+                self._subnode_id,
+                self._subnode_count,
+                n,
+            )
+        except GlobalIdError as e:
+            self._count_error(e)
+            raise
+
+        self._persist(time_part, last_sequence)
+        count = (last_sequence - first_sequence) // self._subnode_count + 1
+        self._count_ids(time_part, count, last_sequence)
+
+        self._last_now = now
+        self._last_time_part = time_part
+        self._last_sequence = last_sequence
+        self._set_time_part(time_part)
+
+        sequences = range(first_sequence, last_sequence + 1, self._subnode_count)
+        return time_part, sequences, self._node_id
+
+    def _check_clock(self, now: float) -> None:
+        """Raise ClockError if the clock cannot be trusted (see max_drift)."""
+        if self._suspended is not None:
+            raise ClockError(self._suspended)
+        if now < self._not_before:
+            raise ClockError(f"waiting max_drift * 2 after startup")
+
+    def _persist(self, time_part: int, sequence: int) -> None:
+        """Make sure the state file high-water mark covers (time_part, sequence)
+        before any ids up to it are returned.
+
+        """
+        state_file = self._state_file
+        if state_file is None:
+            return
+
+        if (time_part, sequence) > self._reserved:
+            if self._reserved_ahead:
+                mark = time_part + self._reserved_ahead, self._max_sequence
+            else:
+                batch_size = state_file.batch_size * self._subnode_count
+                mark = time_part, min(sequence + batch_size, self._max_sequence)
+            state_file.write(*mark)
+            self._reserved = mark
+
+        reserved_time_part, reserved_sequence = self._reserved
+        if reserved_time_part == time_part:
+            self._sequence_limit = reserved_sequence
+        else:
+            self._sequence_limit = self._max_sequence
+
+    def _fast_path_ids(self) -> int:
+        """The number of ids generated by the get_id() fast path
+        since the last _count_ids() call."""
+        return (self._last_sequence - self._fast_path_start) // self._subnode_count
+
+    def _count_ids(self, time_part: int, n: int, last_sequence: int) -> None:
+        """Update the statistics for n ids generated by a slow path.
+
+        Must be called before the generator state is updated
+        with the new last_sequence.
+
+        """
+        fast_path_ids = self._fast_path_ids()
+        self._fast_path_start = last_sequence
+        self._issued_ids += fast_path_ids + n
+
+        if time_part == self._stats_time_part:
+            self._stats_time_part_ids += fast_path_ids + n
+            return
+
+        time_part_ids = self._stats_time_part_ids + fast_path_ids
+        if time_part_ids:
+            sequences = (self._max_sequence - self._subnode_id) // self._subnode_count
+            self.sequence_utilization.observe(time_part_ids / (sequences + 1))
+        self._stats_time_part = time_part
+        self._stats_time_part_ids = n
+
+    def _count_error(self, error: GlobalIdError) -> None:
+        name = type(error).__name__
+        self.error_counts[name] = self.error_counts.get(name, 0) + 1
+
+    def _set_time_part(self, time_part: int) -> None:
+        """Update the cached state for the time part of the last id."""
+        if time_part != self._time_part:
+            self._time_part = time_part
+            self._time_part_end = self._time_part_to_time(time_part + 1)
+            self._time_prefix = self._pack_id(time_part, 0, self._node_id)
+
+        # suspend() may have been called after _check_clock();
+        # make sure the get_id() fast path does not bypass it
+        if self._suspended is not None:
+            self._time_part = -1
+            self._time_part_end = -math.inf
+
+    @classmethod
+    def _time_part_for(cls, now: float) -> int:
+        """Return the time part for a time since the Unix epoch."""
+        ticks = cls.ticks_per_second
+        return math.floor(now * ticks) - cls.time_part_epoch * ticks
+
+    @classmethod
+    def _time_part_to_time(cls, time_part: int) -> float:
+        """Return the time since the Unix epoch where a time part starts."""
+        return cls.time_part_epoch + time_part / cls.ticks_per_second
+
     @classmethod
     def _next(
         cls,
         now: float,
         last_now: float,
+        last_time_part: int,
         last_sequence: int,
         subnode_id: int,
         subnode_count: int,
@@ -230,21 +691,57 @@ class Node:
         if now < cls.time_part_epoch:
             raise ClockError(f"current time behind node epoch")
 
-        second = math.floor(now) - cls.time_part_epoch
-        if second.bit_length() > cls.time_part_bits:
-            raise OutOfSeconds(f"maximum seconds since epoch exceeded: {second}")
+        clock_time_part = cls._time_part_for(now)
 
-        last_second = math.floor(last_now) - cls.time_part_epoch
-
-        if last_second != second:
+        if clock_time_part > last_time_part:
+            time_part = clock_time_part
             sequence = subnode_id
         else:
+            # same time part, or the node is ahead of the clock
+            time_part = last_time_part
             sequence = last_sequence + subnode_count
 
+            if sequence.bit_length() > cls.sequence_bits:
+                if time_part + 1 - clock_time_part <= cls.max_lead:
+                    time_part += 1
+                    sequence = subnode_id
+
+        if time_part.bit_length() > cls.time_part_bits:
+            raise OutOfSeconds(f"maximum time part exceeded: {time_part}")
         if sequence.bit_length() > cls.sequence_bits:
-            raise OutOfIds(f"ran out of ids for this second: {second}")
+            # there are ids again once the clock reaches this time part
+            # (the next one, if max_lead is 0)
+            retry_after = cls._time_part_to_time(time_part + 1 - cls.max_lead) - now
+            raise OutOfIds(
+                f"ran out of ids for time part: {time_part}", max(retry_after, 0)
+            )
+
+        return time_part, sequence
+
+    @classmethod
+    def _next_range(
+        cls,
+        now: float,
+        last_now: float,
+        last_time_part: int,
+        last_sequence: int,
+        subnode_id: int,
+        subnode_count: int,
+        n: int,
+    ) -> Tuple[int, int, int]:
+        """Like _next(), but return (time_part, first_sequence, last_sequence)
+        for up to n sequences, all in the same time part.
 
-        return second, sequence
+        """
+        time_part, first_sequence = cls._next(
+            now, last_now, last_time_part, last_sequence, subnode_id, subnode_count
+        )
+
+        max_sequence = 2 ** cls.sequence_bits - 1
+        available = (max_sequence - first_sequence) // subnode_count + 1
+        last_sequence = first_sequence + (min(n, available) - 1) * subnode_count
+
+        return time_part, first_sequence, last_sequence
 
     @classmethod
     def _pack_id(cls, time_part: int, sequence: int, node_id: int) -> int:
@@ -255,3 +752,448 @@ class Node:
         id <<= cls.node_id_bits
         id |= node_id
         return id
+
+    @classmethod
+    def unpack_id(cls, id: int) -> Tuple[int, int, int]:
+        """Unpack an id into a (time_part, sequence, node_id) tuple.
+
+        To unpack many ids at once, see global_id_numpy.unpack_ids().
+
+        """
+        node_id = id & (2 ** cls.node_id_bits - 1)
+        id >>= cls.node_id_bits
+        sequence = id & (2 ** cls.sequence_bits - 1)
+        id >>= cls.sequence_bits
+        return id, sequence, node_id
+
+
+class StateFile:
+
+    """A file recording a (time_part, sequence) high-water mark
+    of the ids generated by a (sub)node; see Node.
+
+    Each subnode must have its own file.
+
+    Args:
+        path (str): The file path; created if it does not exist.
+        batch_size (int): How many sequences to reserve ahead
+            each time the file is written.
+        window (float): How many seconds worth of time parts to reserve
+            ahead each time the file is written (rounded to whole time parts);
+            if this is at least one time part, the whole sequence of each
+            is reserved, and batch_size is not used. The default only
+            applies to time parts shorter than 0.2 seconds.
+
+    """
+
+    # version (0 if the file was never written), time_part, sequence
+    _format: ClassVar = "<qqq"
+
+    def __init__(self, path: str, batch_size: int = 4096, window: float = 0.1):
+        if batch_size <= 0:
+            raise ValueError(
+                f"batch_size must be a positive integer, got: {batch_size}"
+            )
+        if window < 0:
+            raise ValueError(f"window must be a non-negative number, got: {window}")
+        self.batch_size: Final = batch_size
+        self.window: Final = window
+
+        size = struct.calcsize(self._format)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def read(self) -> Optional[Tuple[int, int]]:
+        """Return the (time_part, sequence) mark, or None if there isn't one."""
+        version, time_part, sequence = struct.unpack_from(self._format, self._mmap)
+        if version == 0:
+            return None
+        return time_part, sequence
+
+    def write(self, time_part: int, sequence: int) -> None:
+        """Record a new mark, and wait for it to be written to disk."""
+        struct.pack_into(self._format, self._mmap, 0, 1, time_part, sequence)
+        self._mmap.flush()
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+class ThreadSafeNode(Node):
+
+    """A Node that can be shared between multiple threads.
+
+    All the state changes happen while holding a (reentrant) lock,
+    so it is safe to use without the GIL as well.
+
+    If lock contention becomes an issue, split the node into subnodes
+    and use one (non-thread-safe) subnode per thread instead.
+
+    """
+
+    def __init__(
+        self,
+        node_id: int,
+        subnode_id: int = 0,
+        subnode_count: int = 1,
+        *,
+        state_file: Optional["StateFile"] = None,
+        max_drift: float = 0,
+        clock: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(
+            node_id,
+            subnode_id,
+            subnode_count,
+            state_file=state_file,
+            max_drift=max_drift,
+            clock=clock,
+        )
+        self._lock: Final = threading.RLock()
+
+    def get_id(self) -> int:
+        with self._lock:
+            return super().get_id()
+
+    def _get_id(self) -> Tuple[int, int, int]:
+        with self._lock:
+            return super()._get_id()
+
+    def _reserve(self, n: int) -> Tuple[int, range, int]:
+        with self._lock:
+            return super()._reserve(n)
+
+    def suspend(self, reason: str) -> None:
+        with self._lock:
+            super().suspend(reason)
+
+    def resume(self) -> None:
+        with self._lock:
+            super().resume()
+
+
+class SharedState:
+
+    """Generator state shared between the processes of a single node.
+
+    Create it before starting the processes, pass it to them
+    (e.g. as a multiprocessing.Process argument), and use it with
+    :class:`SharedNode`.
+
+    """
+
+    def __init__(self) -> None:
+        self.lock: Any = multiprocessing.Lock()
+        self.initialized: Any = multiprocessing.RawValue("b", False)
+        self.last_now: Any = multiprocessing.RawValue("d", 0)
+        self.last_time_part: Any = multiprocessing.RawValue("q", 0)
+        self.last_sequence: Any = multiprocessing.RawValue("q", 0)
+
+
+class SharedNode(Node):
+
+    """A Node whose state is shared between multiple processes.
+
+    All the processes allocate ids from the full sequence of the node,
+    regardless of how the load is spread between them.
+
+    Updating the shared state is atomic (the lock is held while reading
+    the time and updating the state), so the clock going backwards and
+    the first second after the first SharedNode for a state is created
+    are handled like for Node.
+
+    To reduce lock contention, each process can lease a contiguous block
+    of lease_size sequences at a time, and serve ids from it without
+    touching the shared state. Leases never overlap, and a lease is only
+    valid until the clock moves past the time part it was made for; whatever
+    is left of it then is wasted (at most lease_size - 1 ids / process / tick).
+    If reserve() asks for more ids than are left in the lease, a new lease
+    is made; if it does not continue the current one, the rest of the current
+    one is wasted too.
+
+    Args:
+        node_id (int): The node id, in range(1024).
+        state (SharedState): The state; must be the same for all
+            the processes of a node.
+        lease_size (int): How many sequences to lease at a time.
+        max_drift (float): See Node.
+        clock (callable or None): See Node; the clocks of all the processes
+            must agree, since the shared state is checked against them.
+
+    The state_file Node argument is not supported.
+
+    """
+
+    def __init__(
+        self,
+        node_id: int,
+        state: SharedState,
+        lease_size: int = 1,
+        *,
+        max_drift: float = 0,
+        clock: Optional[Callable[[], float]] = None,
+    ):
+        super().__init__(node_id, max_drift=max_drift, clock=clock)
+
+        if lease_size <= 0:
+            raise ValueError(
+                f"lease_size must be a positive integer, got: {lease_size}"
+            )
+
+        self._state: Final = state
+        self._lease_size: Final = lease_size
+        self._lease_time_part = -1
+        self._lease = range(0)
+
+        with state.lock:
+            if not state.initialized.value:
+                state.last_now.value = self._last_now
+                state.last_time_part.value = self._last_time_part
+                state.last_sequence.value = self._last_sequence
+                state.initialized.value = True
+
+    def _get_id(self) -> Tuple[int, int, int]:
+        time_part, sequences, node_id = self._reserve(1)
+        return time_part, sequences[0], node_id
+
+    def _reserve(self, n: int) -> Tuple[int, range, int]:
+        if n <= 0:
+            raise ValueError(f"n must be a positive integer, got: {n}")
+
+        now = self.time()
+        try:
+            if now < self._last_now:
+                raise ClockError(f"clock moved backwards")
+            self._check_clock(now)
+
+            # leases for time parts ahead of the clock (see max_lead) are valid
+            if self._time_part_for(now) > self._lease_time_part:
+                self._lease = range(0)
+            if len(self._lease) < n:
+                time_part, lease = self._new_lease(max(n, self._lease_size))
+                # extend the current lease if possible, otherwise drop it
+                if (
+                    self._lease
+                    and time_part == self._lease_time_part
+                    and lease.start == self._lease.stop
+                ):
+                    lease = range(self._lease.start, lease.stop)
+                self._lease_time_part, self._lease = time_part, lease
+        except GlobalIdError as e:
+            self._count_error(e)
+            raise
+
+        sequences = self._lease[:n]
+        self._lease = self._lease[n:]
+        self._last_now = now
+        # the fast path is never used, so _last_sequence can stay the same
+        self._count_ids(self._lease_time_part, len(sequences), self._last_sequence)
+
+        return self._lease_time_part, sequences, self._node_id
+
+    def _new_lease(self, n: int) -> Tuple[int, range]:
+        """Lease up to n sequences from the shared state."""
+        state = self._state
+        with state.lock:
+            now = self.time()
+            time_part, first_sequence, last_sequence = self._next_range(
+                now,
+                state.last_now.value,
+                state.last_time_part.value,
+                state.last_sequence.value,
+                0,
+                1,
+                n,
+            )
+            state.last_now.value = now
+            state.last_time_part.value = time_part
+            state.last_sequence.value = last_sequence
+
+        return time_part, range(first_sequence, last_sequence + 1)
+
+
+def _monotonic_ns() -> int:
+    """time.monotonic_ns() for Python 3.6."""
+    return int(time.monotonic() * 1e9)
+
+
+class MonotonicClock:
+
+    """A time source that is anchored to the wall clock at startup,
+    and advances with the monotonic clock.
+
+    Unlike time.time(), it never goes backwards, so small wall clock
+    adjustments (e.g. NTP steps) do not make a node raise ClockError.
+
+    To avoid drifting away from the wall clock, it re-syncs gradually:
+    every resync_interval seconds, it changes its rate so the difference
+    would be corrected by the next re-sync, but by at most max_slew
+    seconds per second. Differences larger than max_step are corrected
+    right away if the wall clock is ahead (jumping forward does not cause
+    duplicate ids); if it is behind, they are still corrected gradually.
+
+    Use it with a node as Node(..., clock=MonotonicClock()).
+
+    Args:
+        resync_interval (float): How often to compare with the wall clock,
+            in seconds.
+        max_slew (float): The maximum rate adjustment, in seconds per second;
+            must be in [0, 1).
+        max_step (float): The difference (in seconds) above which
+            to jump forward instead of slewing.
+        wall (callable): Returns the wall clock time since the Unix epoch.
+        monotonic_ns (callable or None): Returns the monotonic clock,
+            in nanoseconds; defaults to time.monotonic_ns()
+            (or an equivalent, on Python 3.6).
+
+    """
+
+    def __init__(
+        self,
+        resync_interval: float = 1,
+        max_slew: float = 0.0005,
+        max_step: float = 1,
+        wall: Callable[[], float] = time.time,
+        monotonic_ns: Optional[Callable[[], int]] = None,
+    ):
+        if not (0 <= max_slew < 1):
+            raise ValueError(f"max_slew must be in [0, 1), got: {max_slew}")
+        if monotonic_ns is None:
+            monotonic_ns = getattr(time, "monotonic_ns", _monotonic_ns)
+        self.resync_interval: Final = resync_interval
+        self.max_slew: Final = max_slew
+        self.max_step: Final = max_step
+        self._wall: Final = wall
+        self._monotonic_ns: Final = monotonic_ns
+
+        # (base, monotonic_base, rate, next_resync), replaced as a whole,
+        # so __call__() does not need a lock; time is computed as
+        # base + (monotonic_ns - monotonic_base) * rate
+        monotonic = monotonic_ns()
+        self._state = (wall(), monotonic, 1e-9, self._resync_at(monotonic))
+        self._lock: Final = threading.Lock()
+
+    def __call__(self) -> float:
+        """Return the time since the Unix epoch."""
+        monotonic = self._monotonic_ns()
+        base, monotonic_base, rate, next_resync = self._state
+        if monotonic >= next_resync:
+            base, monotonic_base, rate = self._resync(monotonic)
+        return base + (monotonic - monotonic_base) * rate
+
+    def _resync_at(self, monotonic: int) -> int:
+        return monotonic + int(self.resync_interval * 1e9)
+
+    def _resync(self, monotonic: int) -> Tuple[float, int, float]:
+        with self._lock:
+            base, monotonic_base, rate, next_resync = self._state
+            if monotonic < next_resync:
+                # another thread re-synced in the meantime
+                return base, monotonic_base, rate
+
+            # start from the current time, so the time is continuous
+            now = base + (monotonic - monotonic_base) * rate
+            offset = self._wall() - now
+
+            if offset > self.max_step:
+                now += offset
+                slew = 0.0
+            else:
+                slew = offset / self.resync_interval
+                slew = max(-self.max_slew, min(self.max_slew, slew))
+
+            rate = (1 + slew) * 1e-9
+            self._state = (now, monotonic, rate, self._resync_at(monotonic))
+            return now, monotonic, rate
+
+    @property
+    def offset(self) -> float:
+        """The difference between the wall clock and this clock, in seconds
+        (positive if the wall clock is ahead)."""
+        return self._wall() - self()
+
+
+class ClockWatchdog:
+
+    """Check periodically that the clock of a node has not drifted more than
+    node.max_drift from a reference source, and suspend the node while it has.
+
+    The checks run in a background thread, so they don't slow down get_id().
+
+    Args:
+        node (Node): The node; its max_drift should leave some head room
+            for the time between checks.
+        reference (callable): Returns the reference time since the Unix
+            epoch (e.g. sntp_time()); if it raises an exception,
+            the drift is considered too large.
+        interval (float): How often to check, in seconds.
+
+    """
+
+    def __init__(
+        self, node: Node, reference: Callable[[], float], interval: float = 1,
+    ):
+        self.node: Final = node
+        self.reference: Final = reference
+        self.interval: Final = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self) -> bool:
+        """Check the drift once, and suspend / resume the node accordingly.
+
+        Returns:
+            bool: True if the drift is within max_drift.
+
+        """
+        try:
+            drift = abs(self.node.time() - self.reference())
+        except Exception as e:
+            self.node.suspend(f"could not check the clock drift: {e!r}")
+            return False
+
+        if drift > self.node.max_drift:
+            self.node.suspend(f"clock drift exceeds max_drift: {drift}")
+            return False
+
+        self.node.resume()
+        return True
+
+    def _run(self) -> None:
+        while True:
+            self.check()
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self) -> None:
+        """Start checking in a background thread."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def sntp_time(host: str, port: int = 123, timeout: float = 1) -> float:
+    """Return the time since the Unix epoch according to an (S)NTP server.
+
+    Does not account for the network delay; max_drift should.
+
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        # LI = 0, version = 3, mode = 3 (client)
+        sock.sendto(b"\x1b" + 47 * b"\0", (host, port))
+        data, _ = sock.recvfrom(1024)
+
+    seconds, fraction = struct.unpack_from("!II", data, 40)
+    # the NTP epoch is 1900-01-01
+    return float(seconds - 2208988800 + fraction / 2 ** 32)
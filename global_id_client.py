@@ -0,0 +1,388 @@
+"""
+Client-side helpers for consuming ids from global_id servers.
+
+:class:`PrefetchBuffer` keeps a local buffer of ids fetched in batches
+(e.g. with global_id_udp.get_ids()), and refills it in the background,
+so most ids are served from memory instead of with a network round trip.
+
+Ids are ordered by time part. Buffering them means an id can be handed out
+a while after it was generated, so an id obtained later can be smaller than
+one generated (elsewhere) earlier. To keep this bounded, buffered ids are
+discarded once their time part is older than max_age seconds.
+
+:class:`MultiNodeClient` gets ids from any of a number of global_id_udp
+servers (nodes), spreading the requests between them and failing over
+to other nodes when one is slow, lost packets, or returned an error.
+
+"""
+
+import time
+import random
+import socket
+import threading
+import collections
+
+from global_id import Node, OutOfIds
+import global_id_udp
+
+
+class PrefetchBuffer:
+
+    """A local buffer of ids, refilled in batches in the background.
+
+    Args:
+        fetch (callable): Called as fetch(batch_size) to get more ids;
+            must return a range of ids with the same time part
+            (like Node.reserve()), and raise an exception on failure.
+        batch_size (int): How many ids to request at a time.
+        low_water (int or None): Refill the buffer when it has fewer ids
+            than this; defaults to batch_size.
+        max_age (float): Discard ids whose time part ended more than
+            this many seconds ago.
+        node_cls (type): The Node class that generated the ids
+            (used to decode their time part).
+        retry_delay (float): How long the background refill waits
+            after fetch() raises an exception (unless the exception
+            has a retry_after attribute, like OutOfIds).
+
+    """
+
+    def __init__(
+        self,
+        fetch,
+        batch_size=1000,
+        low_water=None,
+        max_age=1.0,
+        node_cls=Node,
+        retry_delay=0.1,
+    ):
+        self.fetch = fetch
+        self.batch_size = batch_size
+        self.low_water = low_water if low_water is not None else batch_size
+        self.max_age = max_age
+        self.node_cls = node_cls
+        self.retry_delay = retry_delay
+
+        # (expires, ids) tuples; the first one is the one in use
+        self._batches = collections.deque()
+        # index of the next id in the first batch
+        self._index = 0
+        self._count = 0
+
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+        # after a failed refill, don't refill again before this
+        # (time.monotonic()), even if next_id() asks for it
+        self._retry_at = 0.0
+
+    @staticmethod
+    def time():
+        """Return the time since the Unix epoch."""
+        return time.time()
+
+    def _expires(self, ids):
+        time_part, _, _ = self.node_cls.unpack_id(ids[0])
+        return self.node_cls._time_part_to_time(time_part + 1) + self.max_age
+
+    def _discard_expired(self):
+        now = self.time()
+        while self._batches and self._batches[0][0] <= now:
+            _, ids = self._batches.popleft()
+            self._count -= len(ids) - self._index
+            self._index = 0
+
+    def __len__(self):
+        """Return the number of buffered ids (including expired ones)."""
+        return self._count
+
+    def refill(self):
+        """Fetch a batch of ids and add it to the buffer.
+
+        Called by the background thread; can also be called directly,
+        e.g. to warm up the buffer.
+
+        """
+        ids = self.fetch(self.batch_size)
+        if not ids:
+            return
+        expires = self._expires(ids)
+        with self._condition:
+            self._batches.append((expires, ids))
+            self._count += len(ids)
+            self._condition.notify_all()
+
+    def next_id(self, timeout=None):
+        """Return an id from the buffer.
+
+        If the buffer is empty, wait up to timeout seconds
+        (forever if None) for the background refill.
+
+        Raises:
+            OutOfIds: If no id became available in time.
+
+        """
+        with self._condition:
+            deadline = None
+            while True:
+                self._discard_expired()
+
+                if self._count < self.low_water:
+                    self._condition.notify_all()
+
+                if self._batches:
+                    break
+
+                if deadline is None and timeout is not None:
+                    deadline = time.monotonic() + timeout
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if self._closed or (remaining is not None and remaining <= 0):
+                    raise OutOfIds("no buffered ids available")
+                self._condition.wait(remaining)
+
+            _, ids = self._batches[0]
+            id = ids[self._index]
+            self._index += 1
+            self._count -= 1
+            if self._index == len(ids):
+                self._batches.popleft()
+                self._index = 0
+
+            return id
+
+    def _refill_forever(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+                    delay = self._retry_at - time.monotonic()
+                    if delay > 0:
+                        self._condition.wait(delay)
+                    elif self._count >= self.low_water:
+                        self._condition.wait()
+                    else:
+                        break
+
+            try:
+                self.refill()
+            except Exception as e:
+                # retried after a delay; next_id() callers time out meanwhile;
+                # if the server said when it will have ids, wait until then
+                delay = getattr(e, "retry_after", None) or self.retry_delay
+                with self._condition:
+                    self._retry_at = time.monotonic() + delay
+
+    def start(self):
+        """Start the background refill thread."""
+        self._thread = threading.Thread(target=self._refill_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the background refill thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def udp_fetch(addr, timeout=1.0, retries=3):
+    """Return a fetch(count) function suitable for PrefetchBuffer
+    that gets ids from the global_id_udp server at addr.
+
+    Requests are tagged (see global_id_udp.get_ids_tagged()), so duplicated
+    or late responses to previous requests are ignored, and the same ids
+    are never returned twice.
+
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    sock.connect(addr)
+
+    def fetch(count):
+        status, result = global_id_udp.get_ids_tagged(sock, count, retries)
+        if status != 0:
+            raise global_id_udp.response_error(status, result)
+        return result
+
+    return fetch
+
+
+class _Endpoint:
+    def __init__(self, addr, timeout):
+        self.addr = addr
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(addr)
+        # moving averages; new endpoints look good, so they get tried
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.last_used = 0.0
+        # don't send requests before this (time.monotonic())
+        self.unavailable_until = 0.0
+
+
+class MultiNodeClient:
+
+    """Get ids from multiple global_id_udp servers.
+
+    Each request goes to the better of two randomly chosen available
+    nodes ("power of two choices"), based on their recent latency
+    and error rate; this spreads the load while avoiding slow nodes,
+    without having to track which node is the best at any given time.
+    The score of a node decays while it is not used (halving every
+    half_life seconds), so nodes that were slow are tried again eventually.
+
+    If a node does not respond within timeout, or returns an error,
+    the request is retried on another node. Nodes that are out of ids
+    are avoided for as long as they say (retry after), and unreachable
+    nodes or nodes with other errors (see global_id_udp.FAILOVER_STATUSES)
+    for down_time.
+
+    Each node has its own (connected) socket, kept open between requests.
+    Requests are tagged, so late responses to earlier requests are ignored.
+    Not thread-safe.
+
+    Args:
+        addrs (list(tuple(str, int))): The node addresses.
+        timeout (float): How long to wait for a response, in seconds.
+        attempts (int): How many nodes to try for a request.
+        down_time (float): How long to avoid a node after an error.
+        decay (float): Weight of a new sample in the moving averages.
+        half_life (float): How fast the score of an unused node decays.
+
+    """
+
+    def __init__(
+        self,
+        addrs,
+        timeout=0.1,
+        attempts=3,
+        down_time=1.0,
+        decay=0.2,
+        half_life=1.0,
+    ):
+        if not addrs:
+            raise ValueError("at least one address is required")
+        if attempts < 1:
+            raise ValueError(f"attempts must be a positive integer, got: {attempts}")
+        self.timeout = timeout
+        self.attempts = attempts
+        self.down_time = down_time
+        self.decay = decay
+        self.half_life = half_life
+        self.endpoints = [_Endpoint(addr, timeout) for addr in addrs]
+        self._random = random.Random()
+
+    @staticmethod
+    def time():
+        return time.monotonic()
+
+    def _score(self, endpoint, now):
+        # a timeout counts as timeout seconds of latency
+        score = endpoint.latency + endpoint.error_rate * self.timeout
+        return score * 0.5 ** ((now - endpoint.last_used) / self.half_life)
+
+    def _choose(self, exclude):
+        now = self.time()
+        candidates = [
+            e
+            for e in self.endpoints
+            if e not in exclude and e.unavailable_until <= now
+        ]
+        if not candidates:
+            # all the nodes are unavailable; try the one available the soonest
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            return min(candidates, key=lambda e: e.unavailable_until)
+        if len(candidates) == 1:
+            return candidates[0]
+        return min(
+            self._random.sample(candidates, 2), key=lambda e: self._score(e, now)
+        )
+
+    def _record(self, endpoint, latency, error):
+        decay = self.decay
+        endpoint.latency += decay * (latency - endpoint.latency)
+        endpoint.error_rate += decay * (error - endpoint.error_rate)
+        endpoint.last_used = self.time()
+
+    def get_ids(self, count):
+        """Return up to count ids, as a range.
+
+        Raises:
+            socket.timeout: If the last node tried did not respond.
+            GlobalIdError: If the last node tried returned an error
+                (see global_id_udp.response_error()).
+
+        """
+        tried = []
+        error = None
+        for _ in range(self.attempts):
+            endpoint = self._choose(tried)
+            if endpoint is None:
+                break
+            tried.append(endpoint)
+
+            start = time.perf_counter()
+            try:
+                status, result = global_id_udp.get_ids_tagged(
+                    endpoint.sock, count, retries=0
+                )
+            except socket.timeout as e:
+                # maybe just a lost packet; the error rate takes care of it
+                self._record(endpoint, self.timeout, 1)
+                error = e
+                continue
+            except OSError as e:
+                # e.g. ConnectionRefusedError, if nothing listens on addr
+                self._record(endpoint, self.timeout, 1)
+                endpoint.unavailable_until = self.time() + self.down_time
+                error = e
+                continue
+
+            latency = time.perf_counter() - start
+            self._record(endpoint, latency, status != 0)
+            if status == 0:
+                return result
+
+            error = global_id_udp.response_error(status, result)
+            if status == global_id_udp.STATUS_OUT_OF_IDS:
+                delay = result if result is not None else self.timeout
+                endpoint.unavailable_until = self.time() + delay
+            elif status in global_id_udp.FAILOVER_STATUSES:
+                endpoint.unavailable_until = self.time() + self.down_time
+            else:
+                # bad request; another node would not do better
+                break
+
+        raise error
+
+    def get_id(self):
+        """Return an id.
+
+        Raises:
+            socket.timeout
+            GlobalIdError
+
+        """
+        return self.get_ids(1)[0]
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,251 @@
+"""
+Binary logs of issued ids, e.g. for auditing.
+
+:class:`IdLogWriter` appends ids to files as raw little-endian uint64 values,
+buffering them and writing them in batches; a new file is started for each
+rotate_every seconds worth of time parts, so files stay bounded.
+Pass one to global_id_udp.RequestHandler (or run_server(log_dir=...))
+to record every id the server issues.
+
+:class:`IdLogReader` memory-maps a log file, and exposes the ids without
+copying them, as a memoryview or as a NumPy array (for use with
+global_id_numpy).
+
+"""
+
+import os
+import re
+import sys
+import mmap
+import array
+import struct
+
+from global_id import Node
+
+
+ID_SIZE = 8
+
+
+class IdLogWriter:
+
+    """Append ids to log files in a directory, in batches.
+
+    Files are named {prefix}-{time_part}.ids, where time_part is the first
+    time part of the rotation period. Writers that may run at the same time
+    (e.g. the processes of a server) must use different prefixes.
+
+    If a file exists already, it is appended to (after discarding any
+    incomplete id at its end, e.g. from a crash mid-write).
+
+    Buffered ids are written when there are buffer_size of them,
+    on rotation, and on flush() / close(); ids still buffered when
+    the process dies are lost.
+
+    Args:
+        directory (str): The directory; must exist.
+        prefix (str): The file name prefix.
+        rotate_every (int): How many seconds of time parts each file covers.
+        node_cls (type): The Node class that generated the ids
+            (used to decode their time part).
+        buffer_size (int): How many ids to buffer before writing them.
+
+    """
+
+    def __init__(
+        self,
+        directory,
+        prefix="ids",
+        rotate_every=3600,
+        node_cls=Node,
+        buffer_size=8192,
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.node_cls = node_cls
+        self.buffer_size = buffer_size
+
+        self._time_part_shift = node_cls.sequence_bits + node_cls.node_id_bits
+        self._period = rotate_every * node_cls.ticks_per_second
+        # time parts in [start, end) go to the current file
+        self._period_start = self._period_end = 0
+
+        self._file = None
+        self._buffer = array.array("Q")
+        assert self._buffer.itemsize == ID_SIZE
+
+    def path_for(self, time_part):
+        """Return the path of the file for ids with a time part."""
+        start = time_part - time_part % self._period
+        return os.path.join(self.directory, f"{self.prefix}-{start:012d}.ids")
+
+    def _check_rotate(self, id):
+        time_part = id >> self._time_part_shift
+        if self._period_start <= time_part < self._period_end:
+            return
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+
+        self._period_start = time_part - time_part % self._period
+        self._period_end = self._period_start + self._period
+        self._file = open(self.path_for(time_part), "ab")
+        size = self._file.tell()
+        if size % ID_SIZE:
+            self._file.truncate(size - size % ID_SIZE)
+
+    def write_id(self, id):
+        """Log an id."""
+        self._check_rotate(id)
+        self._buffer.append(id)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_ids(self, ids):
+        """Log a batch of ids (e.g. a range returned by Node.reserve()).
+
+        All the ids in a batch go to the file of the first one,
+        so they should have the same time part.
+
+        """
+        if not ids:
+            return
+        self._check_rotate(ids[0])
+        self._buffer.extend(ids)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered ids to the current file."""
+        if not self._buffer:
+            return
+        write_chunk(self._file, self._buffer)
+        self._file.flush()
+        self._buffer = array.array("Q")
+
+    def close(self):
+        """Write the buffered ids and close the current file."""
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._period_start = self._period_end = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def log_paths(directory, prefix=None):
+    """Return the paths of the IdLogWriter files in directory,
+    ordered by time part.
+
+    If prefix is None, return the files for all prefixes.
+
+    """
+    prefix_pattern = ".+" if prefix is None else re.escape(prefix)
+    pattern = re.compile(prefix_pattern + r"-(\d+)\.ids$")
+    matches = filter(None, map(pattern.match, os.listdir(directory)))
+    return [
+        os.path.join(directory, match.group(0))
+        for match in sorted(matches, key=lambda m: (int(m.group(1)), m.group(0)))
+    ]
+
+
+def read_chunks(path, chunk_size=1 << 20):
+    """Read an id log file in chunks, without memory-mapping it.
+
+    An incomplete id at the end of the file is ignored.
+
+    Yields:
+        array.array: Up to chunk_size ids (as an array of type "Q").
+
+    """
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(chunk_size * ID_SIZE)
+            data = data[: len(data) - len(data) % ID_SIZE]
+            if not data:
+                return
+            chunk = array.array("Q")
+            chunk.frombytes(data)
+            if sys.byteorder != "little":  # pragma: no cover
+                chunk.byteswap()
+            yield chunk
+
+
+def write_chunk(file, chunk):
+    """Write an array of type "Q" of ids to a binary file, in the id log
+    format (e.g. to a file later read with read_chunks())."""
+    if sys.byteorder != "little":  # pragma: no cover
+        chunk = array.array("Q", chunk)
+        chunk.byteswap()
+    chunk.tofile(file)
+
+
+class IdLogReader:
+
+    """Read-only, memory-mapped view of an id log file.
+
+    An incomplete id at the end of the file (e.g. from a crash mid-write)
+    is ignored.
+
+    The views returned by view() and array() must be released before
+    calling close() (mmap raises BufferError otherwise).
+
+    Args:
+        path (str): The file path.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            # empty files cannot be memory-mapped
+            if size >= ID_SIZE:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._mmap = None
+        self._size = size - size % ID_SIZE
+
+    def __len__(self):
+        """Return the number of ids in the file."""
+        return self._size // ID_SIZE
+
+    def _bytes(self):
+        if self._mmap is None:
+            return memoryview(b"")
+        return memoryview(self._mmap)[: self._size]
+
+    def view(self):
+        """Return the ids as a memoryview of (native) uint64 values.
+
+        Only available on little-endian platforms; use array() otherwise.
+
+        """
+        if sys.byteorder != "little":  # pragma: no cover
+            raise NotImplementedError("view() requires a little-endian platform")
+        return self._bytes().cast("Q")
+
+    def array(self):
+        """Return the ids as a NumPy uint64 array; requires NumPy."""
+        import global_id_numpy
+
+        return global_id_numpy.as_id_array(self._bytes())
+
+    def __iter__(self):
+        """Iterate over the ids (as ints)."""
+        for (id,) in struct.iter_unpack("<Q", self._bytes()):
+            yield id
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
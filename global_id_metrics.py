@@ -0,0 +1,205 @@
+"""
+Prometheus-style metrics for nodes and id servers.
+
+Nodes keep their own statistics (issued_ids, error_counts,
+sequence_utilization); :class:`RequestMetrics` keeps request statistics
+for a global_id_udp.RequestHandler. Both are updated with plain attribute
+increments, and are only formatted when scraped, so they are cheap
+enough to keep on all the time.
+
+:func:`render_metrics` formats them in the Prometheus text format,
+and :func:`serve_metrics` serves them over HTTP (in a background thread)::
+
+    node = Node(node_id)
+    metrics = RequestMetrics()
+    handler = RequestHandler(node, metrics=metrics)
+    serve_metrics(('127.0.0.1', 9100), lambda: render_metrics(node, metrics))
+
+"""
+
+import time
+import threading
+import http.server
+
+from global_id import Histogram
+
+
+class RequestMetrics:
+
+    """Request statistics for a RequestHandler.
+
+    The counters are updated by the handler directly (method calls would
+    add too much overhead per request). Latency is measured only for one
+    in sample_every requests, to avoid reading the clock twice for every
+    request.
+
+    Args:
+        sample_every (int): How often to measure the latency.
+        buckets (sequence(float)): The latency histogram buckets, in seconds.
+
+    """
+
+    def __init__(
+        self,
+        sample_every=16,
+        buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.1),
+    ):
+        self.sample_every = sample_every
+        self.requests = 0
+        self.error_responses = 0
+        self.bad_requests = 0
+        self.latency = Histogram(buckets)
+
+    def timed(self, handle, request_data, addr):
+        """Call handle(request_data, addr) and record its latency."""
+        start = time.perf_counter()
+        response_data = handle(request_data, addr)
+        self.latency.observe(time.perf_counter() - start)
+        return response_data
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def _format_metric(lines, name, type, help, samples):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {type}")
+    for suffix, labels, value in samples:
+        lines.append(f"{name}{suffix}{_format_labels(labels)} {value}")
+
+
+def _histogram_samples(histogram, labels):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+        cumulative += count
+        yield "_bucket", dict(labels, le=bound), cumulative
+    yield "_sum", labels, histogram.sum
+    yield "_count", labels, histogram.count
+
+
+def render_metrics(node=None, request_metrics=None, prefix="global_id"):
+    """Return the statistics of a node and/or a RequestMetrics
+    in the Prometheus text format.
+
+    The node metrics are labeled with the node and subnode id.
+
+    """
+    lines = []
+
+    if node is not None:
+        labels = {"node_id": node.node_id, "subnode_id": node.subnode_id}
+        _format_metric(
+            lines,
+            f"{prefix}_issued_ids_total",
+            "counter",
+            "Ids generated by the node.",
+            [("", labels, node.issued_ids)],
+        )
+        _format_metric(
+            lines,
+            f"{prefix}_errors_total",
+            "counter",
+            "Errors raised by the node, by type.",
+            [
+                ("", dict(labels, error=name), count)
+                # copy first, the node may add errors concurrently
+                for name, count in sorted(dict(node.error_counts).items())
+            ],
+        )
+        _format_metric(
+            lines,
+            f"{prefix}_sequence_utilization",
+            "histogram",
+            "Fraction of the sequences used in each time part with ids.",
+            _histogram_samples(node.sequence_utilization, labels),
+        )
+        _format_metric(
+            lines,
+            f"{prefix}_lead",
+            "gauge",
+            "How many time parts ahead of the clock the node is.",
+            [("", labels, node.lead)],
+        )
+        _format_metric(
+            lines,
+            f"{prefix}_suspended",
+            "gauge",
+            "Whether the node is suspended (refusing to generate ids).",
+            [("", labels, int(node.suspended is not None))],
+        )
+
+    if request_metrics is not None:
+        _format_metric(
+            lines,
+            f"{prefix}_requests_total",
+            "counter",
+            "Requests handled.",
+            [("", {}, request_metrics.requests)],
+        )
+        _format_metric(
+            lines,
+            f"{prefix}_error_responses_total",
+            "counter",
+            "Requests that got an error response.",
+            [("", {}, request_metrics.error_responses)],
+        )
+        _format_metric(
+            lines,
+            f"{prefix}_bad_requests_total",
+            "counter",
+            "Malformed or invalid requests.",
+            [("", {}, request_metrics.bad_requests)],
+        )
+        _format_metric(
+            lines,
+            f"{prefix}_request_duration_seconds",
+            "histogram",
+            "Time to handle a request (sampled).",
+            _histogram_samples(request_metrics.latency, {}),
+        )
+
+    lines.append("")
+    return "\n".join(lines)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    render = None
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = self.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(addr, render):
+    """Serve the output of render() at /metrics on addr over HTTP,
+    in a background thread.
+
+    Args:
+        addr (tuple(str, int)): The (host, port) to listen on.
+        render (callable): Returns the metrics text, e.g. render_metrics().
+
+    Returns:
+        http.server.HTTPServer: The server; call its shutdown() method
+        to stop it.
+
+    """
+    handler_cls = type("MetricsHandler", (_MetricsHandler,), {})
+    handler_cls.render = staticmethod(render)
+    server = http.server.HTTPServer(addr, handler_cls)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,120 @@
+"""
+Vectorized decoding and analysis of large numbers of ids, using NumPy.
+
+NumPy is not a dependency of global_id; this module requires it.
+
+All the functions take the ids as anything :func:`as_id_array` accepts
+(NumPy arrays, sequences of ints, or buffers of little-endian uint64 values,
+e.g. a memory-mapped file), and a node_cls argument (a Node subclass)
+that determines the bit layout of the ids (Node by default).
+
+For example, to check a file of ids for duplicates::
+
+    with open('ids.bin', 'rb') as f:
+        ids = as_id_array(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    duplicates = find_duplicates(ids)
+
+"""
+
+import mmap
+
+import numpy as np
+
+from global_id import Node
+
+
+def as_id_array(ids):
+    """Return ids as a 1-dimensional uint64 NumPy array.
+
+    Buffers (bytes, bytearray, memoryview, mmap) are interpreted as
+    little-endian uint64 values, and are not copied.
+
+    """
+    if isinstance(ids, np.ndarray):
+        return ids.astype(np.uint64, copy=False).reshape(-1)
+    if isinstance(ids, (bytes, bytearray, memoryview, mmap.mmap)):
+        return np.frombuffer(ids, dtype="<u8")
+    return np.asarray(ids, dtype=np.uint64).reshape(-1)
+
+
+def _check_layout(node_cls):
+    bits = node_cls.time_part_bits + node_cls.sequence_bits + node_cls.node_id_bits
+    if bits > 64:
+        raise ValueError(f"ids of {node_cls.__name__} do not fit in 64 bits: {bits}")
+
+
+def _mask(bits):
+    return np.uint64(2 ** bits - 1)
+
+
+def unpack_ids(ids, node_cls=Node):
+    """Unpack ids into (time_parts, sequences, node_ids) uint64 arrays.
+
+    The vectorized equivalent of Node.unpack_id().
+
+    """
+    _check_layout(node_cls)
+    ids = as_id_array(ids)
+    node_id_bits = np.uint64(node_cls.node_id_bits)
+    time_part_shift = np.uint64(node_cls.sequence_bits + node_cls.node_id_bits)
+
+    node_ids = ids & _mask(node_cls.node_id_bits)
+    sequences = (ids >> node_id_bits) & _mask(node_cls.sequence_bits)
+    time_parts = ids >> time_part_shift
+    return time_parts, sequences, node_ids
+
+
+def time_parts_to_times(time_parts, node_cls=Node):
+    """Convert time parts to times since the Unix epoch (as float64)."""
+    time_parts = np.asarray(time_parts, dtype=np.float64)
+    return node_cls.time_part_epoch + time_parts / node_cls.ticks_per_second
+
+
+def count_by_time_part(ids, node_cls=Node):
+    """Count the ids for each time part.
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray): The sorted unique time parts,
+        and the number of ids for each of them.
+
+    """
+    time_parts, _, _ = unpack_ids(ids, node_cls)
+    return np.unique(time_parts, return_counts=True)
+
+
+def count_by_node(ids, node_cls=Node):
+    """Count the ids for each node id.
+
+    Returns:
+        numpy.ndarray: counts[node_id] is the number of ids for node_id,
+        for all the possible node ids.
+
+    """
+    _, _, node_ids = unpack_ids(ids, node_cls)
+    # bincount() does not accept uint64
+    return np.bincount(node_ids.astype(np.intp), minlength=2 ** node_cls.node_id_bits)
+
+
+def count_by_node_and_time_part(ids, node_cls=Node):
+    """Count the ids for each (node id, time part) pair that has ids
+    (e.g. to get per-node rates).
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray): The node ids,
+        time parts, and the number of ids for each pair,
+        sorted by node id, then by time part.
+
+    """
+    time_parts, _, node_ids = unpack_ids(ids, node_cls)
+    # pack the pairs into a single key, so np.unique() can be used on it
+    time_part_bits = np.uint64(node_cls.time_part_bits)
+    keys = (node_ids << time_part_bits) | time_parts
+    keys, counts = np.unique(keys, return_counts=True)
+    return keys >> time_part_bits, keys & _mask(node_cls.time_part_bits), counts
+
+
+def find_duplicates(ids):
+    """Return the sorted unique ids that appear more than once."""
+    ids = np.sort(as_id_array(ids))
+    duplicates = ids[1:][ids[1:] == ids[:-1]]
+    return np.unique(duplicates)
@@ -0,0 +1,268 @@
+"""
+Serve ids over UDP from multiple worker processes, under a supervisor.
+
+Each worker runs global_id_udp.run_server() for one subnode of the node
+(worker i of n is subnode i of n), on the same port (SO_REUSEPORT),
+and is pinned to a CPU, so workers don't compete for the same CPU.
+
+The supervisor restarts workers that die. A restarted worker is a new
+subnode instance, so it refuses to generate ids for its first second
+(see the global_id docstring); it is only started after the previous
+process for the same subnode has exited. Workers that keep dying soon
+after being started are restarted with an exponential backoff.
+
+On SIGTERM or SIGINT, the supervisor sends SIGTERM to the workers,
+which stop serving between requests, answer the requests already queued
+on their socket, close their id log (if any), and exit.
+
+Usage::
+
+    python global_id_serve.py NODE_ID [--host HOST] [--port PORT] \\
+        [--workers N] [--cpus CPUS] [--engine ENGINE] \\
+        [--log-dir DIR] [--metrics-port PORT]
+
+CPUS is a list of CPUs like 0,2,4-7; by default, all the CPUs
+the process can run on. The number of workers defaults to the CPU count.
+
+"""
+
+import os
+import time
+import signal
+import argparse
+import threading
+import multiprocessing
+import multiprocessing.connection
+
+from global_id import Node
+from global_id_udp import run_server, ENGINES
+
+
+def available_cpus():
+    """Return the (sorted) CPUs the current process can run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))  # pragma: no cover
+
+
+def parse_cpus(text):
+    """Parse a CPU list like "0,2,4-7" into a sorted list of ints."""
+    cpus = set()
+    for part in text.split(","):
+        first, sep, last = part.strip().partition("-")
+        if sep:
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(first))
+    return sorted(cpus)
+
+
+def run_worker(worker_id, worker_count, addr, node_id, cpu, engine, **kwargs):
+    """Run a server for a subnode; the target of the worker processes.
+
+    Args:
+        worker_id (int): The subnode id.
+        worker_count (int): The subnode count.
+        addr (tuple(str, int)): The address to serve on.
+        node_id (int): The node id.
+        cpu (int or None): The CPU to run on.
+        engine (str): One of global_id_udp.ENGINES.
+        **kwargs: Passed to global_id_udp.run_server().
+
+    """
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+
+    # only set a flag, so a request (or an id log write) is never interrupted;
+    # run_server() returns after answering the queued requests
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    # on Ctrl-C, the whole process group gets SIGINT; the supervisor
+    # stops the workers instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    run_server(
+        addr, node_id, worker_id, worker_count, engine=engine, stop=stop, **kwargs
+    )
+
+
+class Supervisor:
+
+    """Run a number of worker processes (see run_worker()),
+    restarting them when they die.
+
+    Args:
+        addr (tuple(str, int)): The address to serve on.
+        node_id (int): The node id.
+        workers (int or None): The number of workers; defaults to
+            the number of CPUs.
+        cpus (list(int) or None): The CPUs to pin the workers to
+            (worker i gets cpus[i % len(cpus)]); defaults to available_cpus().
+            If empty, the workers are not pinned.
+        engine (str): One of global_id_udp.ENGINES.
+        node_cls (type): Passed to run_server().
+        log_dir (str or None): Passed to run_server().
+        metrics_port (int or None): If given, worker i serves metrics
+            on metrics_port + i (on the same host as addr).
+        restart_delay (float): How long to wait before restarting a worker
+            that ran for less than min_uptime seconds; doubled for every
+            such consecutive restart, up to max_restart_delay.
+        min_uptime (float): See restart_delay.
+        max_restart_delay (float): See restart_delay.
+        stop_timeout (float): How long to wait for the workers to exit
+            on stop, before killing them.
+
+    """
+
+    def __init__(
+        self,
+        addr,
+        node_id,
+        workers=None,
+        cpus=None,
+        engine="blocking",
+        node_cls=Node,
+        log_dir=None,
+        metrics_port=None,
+        restart_delay=0.1,
+        min_uptime=10,
+        max_restart_delay=30,
+        stop_timeout=5,
+    ):
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {sorted(ENGINES)}, got: {engine}")
+        self.addr = addr
+        self.node_id = node_id
+        self.cpus = available_cpus() if cpus is None else list(cpus)
+        self.worker_count = workers or len(self.cpus) or 1
+        self.engine = engine
+        self.node_cls = node_cls
+        self.log_dir = log_dir
+        self.metrics_port = metrics_port
+        self.restart_delay = restart_delay
+        self.min_uptime = min_uptime
+        self.max_restart_delay = max_restart_delay
+        self.stop_timeout = stop_timeout
+
+        self.processes = [None] * self.worker_count
+        self.restart_counts = [0] * self.worker_count
+        self._started_at = [0.0] * self.worker_count
+        self._delays = [0.0] * self.worker_count
+        self._stop = threading.Event()
+
+    @staticmethod
+    def time():
+        return time.monotonic()
+
+    def _start(self, i):
+        kwargs = dict(node_cls=self.node_cls, log_dir=self.log_dir)
+        if self.metrics_port is not None:
+            kwargs.update(metrics_addr=(self.addr[0], self.metrics_port + i))
+        cpu = self.cpus[i % len(self.cpus)] if self.cpus else None
+
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(i, self.worker_count, self.addr, self.node_id, cpu, self.engine),
+            kwargs=kwargs,
+            name=f"global_id worker {i}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[i] = process
+        self._started_at[i] = self.time()
+
+    def _restart_delay(self, i):
+        if self.time() - self._started_at[i] >= self.min_uptime:
+            self._delays[i] = 0.0
+        elif not self._delays[i]:
+            self._delays[i] = self.restart_delay
+        else:
+            self._delays[i] = min(self._delays[i] * 2, self.max_restart_delay)
+        return self._delays[i]
+
+    def run(self):
+        """Start the workers and supervise them until stop() is called,
+        then stop the workers."""
+        # worker index -> when to restart it
+        restarts = {}
+        try:
+            for i in range(self.worker_count):
+                self._start(i)
+
+            while not self._stop.is_set():
+                now = self.time()
+                for i, when in list(restarts.items()):
+                    if when <= now:
+                        del restarts[i]
+                        self.restart_counts[i] += 1
+                        self._start(i)
+
+                alive = {
+                    p.sentinel: i
+                    for i, p in enumerate(self.processes)
+                    if i not in restarts
+                }
+                timeout = min(restarts.values(), default=now + 0.1) - now
+                ready = multiprocessing.connection.wait(alive, max(timeout, 0))
+                for sentinel in ready:
+                    i = alive[sentinel]
+                    # the old process must be gone before its subnode restarts
+                    self.processes[i].join()
+                    restarts[i] = self.time() + self._restart_delay(i)
+        finally:
+            self._stop_workers()
+
+    def _stop_workers(self):
+        processes = [p for p in self.processes if p is not None and p.is_alive()]
+        for process in processes:
+            process.terminate()
+        deadline = self.time() + self.stop_timeout
+        for process in processes:
+            process.join(max(deadline - self.time(), 0))
+            if process.is_alive():
+                # Process.kill() is Python 3.7+
+                os.kill(process.pid, signal.SIGKILL)
+                process.join()
+
+    def stop(self):
+        """Make run() stop the workers and return; can be called
+        from another thread or from a signal handler."""
+        self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve ids over UDP from multiple worker processes."
+    )
+    parser.add_argument("node_id", type=int)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--workers", type=int, help="default: the CPU count")
+    parser.add_argument(
+        "--cpus", type=parse_cpus, help="CPUs to pin the workers to, e.g. 0,2,4-7"
+    )
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="blocking")
+    parser.add_argument("--log-dir", help="log the issued ids in this directory")
+    parser.add_argument(
+        "--metrics-port", type=int, help="serve metrics for worker i on this + i"
+    )
+    args = parser.parse_args(argv)
+
+    supervisor = Supervisor(
+        (args.host, args.port),
+        args.node_id,
+        workers=args.workers,
+        cpus=args.cpus,
+        engine=args.engine,
+        log_dir=args.log_dir,
+        metrics_port=args.metrics_port,
+    )
+
+    for signum in signal.SIGTERM, signal.SIGINT:
+        signal.signal(signum, lambda *_: supervisor.stop())
+
+    supervisor.run()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -0,0 +1,246 @@
+"""
+TCP request-response server wrapper over global_id.Node.
+
+Unlike the UDP server (see global_id_udp), requests and responses cannot be
+lost or duplicated, so a client always gets the ids it asked for.
+
+A connection is persistent, and can be used for any number of requests.
+Requests can be pipelined: a client can send many requests without waiting
+for the responses; the responses are sent back in the same order.
+
+Each request and response is framed by prefixing it with its length::
+
+    | length (16 bits) | payload (length bytes) |
+
+The payloads are the same as the UDP requests / responses
+(see the global_id_udp docstring for details), including batch requests.
+
+"""
+
+import queue
+import socket
+import struct
+import asyncio
+import contextlib
+
+from global_id import Node
+from global_id_udp import RequestHandler, pack_request, unpack_response
+from global_id_udp import new_event_loop
+
+
+def pack_frame(data):
+    return struct.pack("!H", len(data)) + data
+
+
+async def read_frame(reader):
+    """Read a frame from an asyncio stream and return its payload.
+
+    Raises:
+        asyncio.IncompleteReadError: On EOF.
+
+    """
+    (length,) = struct.unpack("!H", await reader.readexactly(2))
+    return await reader.readexactly(length)
+
+
+async def handle_connection(handler, reader, writer):
+    """Serve the requests on a connection until the client closes it."""
+    addr = writer.get_extra_info("peername")
+    try:
+        while True:
+            try:
+                request_data = await read_frame(reader)
+            except asyncio.IncompleteReadError:
+                break
+            writer.write(pack_frame(handler(request_data, addr)))
+            # only waits if the client is not reading fast enough
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_async(addrs, handler, stop=None):
+    """Serve requests on multiple addresses with the same handler,
+    until stop is set (forever if stop is None).
+
+    The listening sockets have the SO_REUSEPORT option,
+    so multiple servers can serve requests on the same port.
+
+    Args:
+        addrs (list(tuple(str, int))): (host, port) tuples to listen on.
+        handler (global_id_udp.RequestHandler): The request handler.
+        stop (asyncio.Event or None): Event to stop serving on.
+
+    """
+    if stop is None:
+        stop = asyncio.Event()
+
+    def client_connected(reader, writer):
+        return handle_connection(handler, reader, writer)
+
+    servers = []
+    try:
+        for host, port in addrs:
+            server = await asyncio.start_server(
+                client_connected, host, port, reuse_port=True
+            )
+            servers.append(server)
+        await stop.wait()
+    finally:
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+
+
+def run_server(addr, *args):
+    """Listen on addr and serve id requests forever.
+
+    Args:
+        addr: A (host, port) tuple.
+        *args: Passed to Node(*args).
+
+    """
+    handler = RequestHandler(Node(*args))
+
+    loop = new_event_loop()
+    try:
+        loop.run_until_complete(serve_async([addr], handler))
+    finally:
+        loop.close()
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("connection closed by server")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_frame(sock):
+    (length,) = struct.unpack("!H", recv_exactly(sock, 2))
+    return recv_exactly(sock, length)
+
+
+def get_id(sock):
+    """Given a socket connected to a TCP server, request an id and return it.
+
+    Args:
+        sock: A connected socket.
+
+    Returns:
+        tuple(int, int): (0, id) on success, (status, retry after)
+        on error (see global_id_udp.unpack_response()).
+
+    """
+    sock.sendall(pack_frame(pack_request()))
+    return unpack_response(recv_frame(sock))
+
+
+def get_ids(sock, count):
+    """Like get_id(), but request up to count ids; see global_id_udp.get_ids().
+
+    Returns:
+        tuple(int, range): (0, ids) on success, (status, retry after)
+        on error (see global_id_udp.unpack_response()).
+
+    """
+    sock.sendall(pack_frame(pack_request(count)))
+    return unpack_response(recv_frame(sock))
+
+
+def get_many(sock, counts):
+    """Pipeline multiple requests on a connected socket.
+
+    All the requests are sent before reading any response.
+
+    Args:
+        sock: A connected socket.
+        counts (list(int or None)): The count for each request;
+            None requests a single id.
+
+    Returns:
+        list: The results, in the same format as get_id() / get_ids().
+
+    """
+    sock.sendall(b"".join(pack_frame(pack_request(count)) for count in counts))
+    return [unpack_response(recv_frame(sock)) for _ in counts]
+
+
+class ConnectionPool:
+
+    """A thread-safe pool of connections to a TCP server.
+
+    Args:
+        addr: The server (host, port).
+        size (int): The maximum number of idle connections to keep.
+        timeout (float or None): Passed to socket.create_connection().
+
+    """
+
+    def __init__(self, addr, size=8, timeout=None):
+        self.addr = addr
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(size)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Context manager that returns a connected socket.
+
+        The socket is returned to the pool on exit, unless an error happened.
+
+        """
+        try:
+            sock = self._idle.get_nowait()
+        except queue.Empty:
+            sock = socket.create_connection(self.addr, self.timeout)
+
+        try:
+            yield sock
+        except BaseException:
+            sock.close()
+            raise
+
+        try:
+            self._idle.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+
+    def get_id(self):
+        """Like get_id(sock), but using a pooled connection."""
+        with self.connection() as sock:
+            return get_id(sock)
+
+    def get_ids(self, count):
+        """Like get_ids(sock, count), but using a pooled connection."""
+        with self.connection() as sock:
+            return get_ids(sock, count)
+
+    def close(self):
+        """Close all the idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+if __name__ == "__main__":
+    import time
+    import threading
+
+    addr = ("127.0.0.1", 9999)
+
+    threading.Thread(target=run_server, args=(addr, 0), daemon=True).start()
+    time.sleep(0.1)
+
+    pool = ConnectionPool(addr)
+    print(pool.get_id())
+    time.sleep(1)
+    print(pool.get_id())
+    print(pool.get_ids(3))
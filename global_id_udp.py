@@ -6,11 +6,11 @@ the real world.
 It is *not* production ready in any way, and has at least the following issues:
 
 * two different clients can get the same id because of duplicate UDP packets
-  (possible fix: tag requests/responses in some way so the client can check
-  it got the response it was waiting for)
+  (mitigated by tagged requests, see below)
 
 * a client may not get the id it was waiting for due to lost UDP packets
-  (possible fixes: use a connection-oriented protocol, client retries)
+  (mitigated by tagged requests, which can be retried safely;
+  also see global_id_tcp)
 
 * the generated ids can be sniffed; may not necessarily be an issue, 
   since anyone that knows how id generation works can guess ids 
@@ -19,55 +19,554 @@ It is *not* production ready in any way, and has at least the following issues:
 * going further, an attacker could send clients duplicate ids on purpose
   (possible fix: sign the response)
 
-Requests look like::
+Requests for a single id look like::
 
     | 0 (8 bits) |
-    
-Successful responses look like::
+
+Successful responses to them look like::
 
     | 0 (8 bits) | id (64 bits) |
-    
+
+Requests for a batch of ids look like::
+
+    | 1 (8 bits) | count (16 bits) |
+
+Successful responses to them look like::
+
+    | 0 (8 bits) | first id (64 bits) | step (64 bits) | count (16 bits) |
+
+that is, the ids are range(first id, first id + step * count, step);
+count is at least 1, and may be smaller than the requested count
+(see global_id.Node.reserve() for details).
+
 Error responses look like::
 
-    | 1 (8 bits) |
+    | status (8 bits) | retry after (16 bits) |
+
+where status is one of the STATUS_* constants other than STATUS_OK
+(mapped from the global_id.GlobalIdError subclasses), and retry after
+is how many milliseconds until the server can generate ids again,
+or 0 if unknown (it is only set for STATUS_OUT_OF_IDS).
+A client should retry STATUS_OUT_OF_IDS errors after the suggested time,
+and try other nodes on STATUS_CLOCK_ERROR / STATUS_OUT_OF_SECONDS errors
+(the node is likely to keep failing for a while).
+Older servers send error responses without the retry after field,
+and only with status 1.
+
+Tagged requests for a batch of ids look like::
+
+    | 2 (8 bits) | tag (32 bits) | count (16 bits) |
+
+The tag is chosen by the client, and is echoed in the response,
+so the client can check it got the response it was waiting for.
+Successful responses to them look like::
+
+    | 0 (8 bits) | tag (32 bits) | first id (64 bits) | step (64 bits) | count (16 bits) |
+
+Error responses to them look like::
+
+    | status (8 bits) | tag (32 bits) | retry after (16 bits) |
+
+Error responses to malformed requests do not have a tag.
+
+The server remembers recent successful responses to tagged requests
+by (client address, tag), and sends the same response to a retried request
+instead of generating new ids (see RecentResponses for details).
 
 """
 
+import os
+import math
+import time
+import random
 import socket
 import struct
+import asyncio
+import selectors
+import threading
+import collections
+
+from global_id import Node, GlobalIdError, OutOfIds, ClockError, OutOfSeconds
+from global_id_log import IdLogWriter
+from global_id_metrics import RequestMetrics, render_metrics, serve_metrics
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover
+    uvloop = None
+
+
+REQUEST_ID = 0
+REQUEST_IDS = 1
+REQUEST_IDS_TAGGED = 2
 
-from global_id import Node, GlobalIdError
+MAX_COUNT = 2 ** 16 - 1
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_BAD_REQUEST = 2
+STATUS_OUT_OF_IDS = 3
+STATUS_CLOCK_ERROR = 4
+STATUS_OUT_OF_SECONDS = 5
+
+# the first matching exception type gives the status
+ERROR_STATUSES = [
+    (OutOfIds, STATUS_OUT_OF_IDS),
+    (ClockError, STATUS_CLOCK_ERROR),
+    (OutOfSeconds, STATUS_OUT_OF_SECONDS),
+]
+
+# statuses for which a client should try another node
+FAILOVER_STATUSES = {STATUS_ERROR, STATUS_CLOCK_ERROR, STATUS_OUT_OF_SECONDS}
+
+
+def _unpack_retry_after(data, offset):
+    if len(data) < offset + struct.calcsize("!H"):
+        return None
+    (retry_after,) = struct.unpack_from("!H", data, offset)
+    return retry_after / 1000 if retry_after else None
 
 
 def unpack_response(data):
+    """Return a response as (status, result).
+
+    result is an id or a range of ids on success,
+    and the retry after in seconds (or None) on error.
+
+    """
+    (status,) = struct.unpack_from("!B", data)
+    if status != 0:
+        return status, _unpack_retry_after(data, struct.calcsize("!B"))
+    if len(data) == struct.calcsize("!BQ"):
+        (id,) = struct.unpack_from("!Q", data, struct.calcsize("!B"))
+        return status, id
+    start, step, count = struct.unpack_from("!QQH", data, struct.calcsize("!B"))
+    return status, range(start, start + step * count, step)
+
+
+def unpack_tagged_response(data):
+    """Return the (tag, response) of a response to a tagged request,
+    with response as returned by unpack_response().
+
+    tag is None for error responses to malformed requests.
+
+    """
     (status,) = struct.unpack_from("!B", data)
+    if len(data) in (struct.calcsize("!B"), struct.calcsize("!BH")):
+        return None, (status, _unpack_retry_after(data, struct.calcsize("!B")))
+    (tag,) = struct.unpack_from("!I", data, struct.calcsize("!B"))
     if status != 0:
-        return (status,)
-    (id,) = struct.unpack("!Q", data[struct.calcsize("!B") :])
-    return status, id
+        return tag, (status, _unpack_retry_after(data, struct.calcsize("!BI")))
+    start, step, count = struct.unpack_from("!QQH", data, struct.calcsize("!BI"))
+    return tag, (status, range(start, start + step * count, step))
 
 
 def pack_response_ok(id):
     return struct.pack("!BQ", 0, id)
 
 
-def pack_response_error():
-    return struct.pack("!B", 1)
+def pack_response_ids(ids, tag=None):
+    if tag is None:
+        return struct.pack("!BQQH", 0, ids.start, ids.step, len(ids))
+    return struct.pack("!BIQQH", 0, tag, ids.start, ids.step, len(ids))
+
+
+def pack_response_error(tag=None, status=STATUS_ERROR, retry_after=None):
+    if retry_after is None:
+        retry_after_ms = 0
+    else:
+        # round up, and 0 means unknown
+        retry_after_ms = max(1, min(math.ceil(retry_after * 1000), 2 ** 16 - 1))
+    if tag is None:
+        return struct.pack("!BH", status, retry_after_ms)
+    return struct.pack("!BIH", status, tag, retry_after_ms)
+
+
+def pack_response_exception(error, tag=None):
+    """Return the error response for a GlobalIdError."""
+    for cls, status in ERROR_STATUSES:
+        if isinstance(error, cls):
+            break
+    else:
+        status = STATUS_ERROR
+    return pack_response_error(tag, status, getattr(error, "retry_after", None))
 
 
 def unpack_request(data):
-    (request,) = struct.unpack("!B", data)
-    if request != 0:
+    """Return the (request, tag, count) of a request.
+
+    tag is None for untagged requests, count is None for REQUEST_ID.
+    count is not validated (Node.reserve() raises ValueError if it is 0).
+
+    """
+    (request,) = struct.unpack_from("!B", data)
+    if request == REQUEST_ID and len(data) == struct.calcsize("!B"):
+        return request, None, None
+    if request == REQUEST_IDS:
+        _, count = struct.unpack("!BH", data)
+        tag = None
+    elif request == REQUEST_IDS_TAGGED:
+        _, tag, count = struct.unpack("!BIH", data)
+    else:
         raise ValueError("bad request")
-    return request
+    return request, tag, count
+
+
+def pack_request(count=None, tag=None):
+    if tag is not None:
+        if count is None:
+            count = 1
+        return struct.pack("!BIH", REQUEST_IDS_TAGGED, tag, count)
+    if count is None:
+        return struct.pack("!B", REQUEST_ID)
+    return struct.pack("!BH", REQUEST_IDS, count)
+
+
+class RecentResponses:
+
+    """Cache of recent responses, keyed by (client address, tag).
+
+    Entries are evicted after max_age seconds, or oldest first
+    when there are more than size entries.
+
+    Args:
+        size (int): The maximum number of entries.
+        max_age (float): The maximum entry age, in seconds.
+
+    """
+
+    def __init__(self, size=4096, max_age=1.0):
+        self.size = size
+        self.max_age = max_age
+        # key -> (expires, response_data), oldest first
+        self._responses = collections.OrderedDict()
+
+    @staticmethod
+    def time():
+        return time.monotonic()
+
+    def _evict(self, now):
+        responses = self._responses
+        while responses:
+            key, (expires, _) = next(iter(responses.items()))
+            if expires > now and len(responses) <= self.size:
+                break
+            del responses[key]
+
+    def get(self, key):
+        """Return the response for key, or None if there isn't one."""
+        self._evict(self.time())
+        entry = self._responses.get(key)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def put(self, key, response_data):
+        now = self.time()
+        self._responses[key] = now + self.max_age, response_data
+        self._evict(now)
+
+    def __len__(self):
+        return len(self._responses)
+
+
+class RequestHandler:
+
+    """Callable that generates ids from a node for a request,
+    and returns the response.
+
+    Args:
+        node (Node): The node.
+        cache (RecentResponses or None): If given, responses to tagged
+            requests are cached, so retried requests get the same ids.
+        log (global_id_log.IdLogWriter or None): If given, all the issued
+            ids are written to it.
+        metrics (global_id_metrics.RequestMetrics or None): If given,
+            request statistics are recorded in it.
+
+    """
+
+    def __init__(self, node, cache=None, log=None, metrics=None):
+        self.node = node
+        self.cache = cache
+        self.log = log
+        self.metrics = metrics
+
+    def __call__(self, request_data, addr=None):
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.requests += 1
+            if not metrics.requests % metrics.sample_every:
+                return metrics.timed(self._handle, request_data, addr)
+        return self._handle(request_data, addr)
+
+    def _handle(self, request_data, addr):
+        tag = None
+        try:
+            _, tag, count = unpack_request(request_data)
+
+            if tag is not None:
+                return self._handle_tagged(addr, tag, count)
+            if count is None:
+                return pack_response_ok(self._get_id())
+            return pack_response_ids(self._reserve(count))
+
+        except (ValueError, struct.error) as e:
+            if self.metrics is not None:
+                self.metrics.bad_requests += 1
+                self.metrics.error_responses += 1
+            return pack_response_error(tag, STATUS_BAD_REQUEST)
+        except GlobalIdError as e:
+            if self.metrics is not None:
+                self.metrics.error_responses += 1
+            return pack_response_exception(e, tag)
+
+    def _get_id(self):
+        id = self.node.get_id()
+        if self.log is not None:
+            self.log.write_id(id)
+        return id
+
+    def _reserve(self, count):
+        ids = self.node.reserve(count)
+        if self.log is not None:
+            self.log.write_ids(ids)
+        return ids
+
+    def _handle_tagged(self, addr, tag, count):
+        if self.cache is None:
+            return pack_response_ids(self._reserve(count), tag)
+
+        key = addr, tag
+        response_data = self.cache.get(key)
+        if response_data is None:
+            response_data = pack_response_ids(self._reserve(count), tag)
+            self.cache.put(key, response_data)
+        return response_data
+
+
+# how often the serve_*() functions check their stop event while idle
+STOP_CHECK_INTERVAL = 0.1
+
+# how long to keep answering queued requests after stop is set
+DRAIN_TIME = 0.1
+
+
+def _drain(sock, handler):
+    """Answer the requests already queued on sock, without blocking
+    (for at most DRAIN_TIME seconds, since other clients may keep
+    sending requests until the socket is closed)."""
+    sock.setblocking(False)
+    deadline = time.monotonic() + DRAIN_TIME
+    while time.monotonic() < deadline:
+        try:
+            request_data, addr = sock.recvfrom(1024)
+        except BlockingIOError:
+            return
+        try:
+            sock.sendto(handler(request_data, addr), addr)
+        except BlockingIOError:
+            # the send buffer is full; same as losing the packet
+            pass
+
+
+def serve_blocking(sock, handler, stop=None):
+    """Serve requests one datagram at a time,
+    until stop is set (forever if stop is None).
+
+    stop is checked between requests, and at least every STOP_CHECK_INTERVAL
+    seconds while idle; once it is set, the requests already queued
+    on the socket are answered before returning (see _drain()).
+    Setting it is safe from a signal handler.
+
+    Args:
+        sock (socket.socket): A bound UDP socket.
+        handler (RequestHandler): The request handler.
+        stop (threading.Event or None): Event to stop serving on.
+
+    """
+    if stop is None:
+        stop = threading.Event()
+    else:
+        # a receive timeout makes recvfrom() raise BlockingIOError when idle,
+        # without the extra system call per request of sock.settimeout()
+        timeval = struct.pack("ll", 0, int(STOP_CHECK_INTERVAL * 1e6))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, timeval)
+
+    while not stop.is_set():
+        try:
+            request_data, addr = sock.recvfrom(1024)
+        except BlockingIOError:
+            continue
+        sock.sendto(handler(request_data, addr), addr)
+
+    _drain(sock, handler)
+
+
+def serve_bulk(sock, handler, buffer_count=64, stop=None):
+    """Serve requests in bulk, until stop is set (forever if stop is None).
+
+    Once the socket becomes readable, drain all the pending datagrams
+    (up to buffer_count) into a pool of preallocated buffers, handle them,
+    and only then send all the responses. Compared to serve_blocking(),
+    this avoids allocating a bytes object for each request,
+    and one select() call is amortized over many datagrams.
+
+    Python does not expose recvmmsg() / sendmmsg(), so there is still
+    one system call per datagram sent or received.
+
+    See serve_blocking() for details on stop.
+
+    """
+    if stop is None:
+        stop = threading.Event()
+        timeout = None
+    else:
+        timeout = STOP_CHECK_INTERVAL
+
+    sock.setblocking(False)
+    views = [memoryview(bytearray(1024)) for _ in range(buffer_count)]
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(sock, selectors.EVENT_READ)
+
+        while not stop.is_set():
+            selector.select(timeout)
+
+            requests = []
+            for view in views:
+                try:
+                    size, addr = sock.recvfrom_into(view)
+                except BlockingIOError:
+                    break
+                requests.append((view[:size], addr))
+
+            responses = [(handler(data, addr), addr) for data, addr in requests]
+
+            for response_data, addr in responses:
+                try:
+                    sock.sendto(response_data, addr)
+                except BlockingIOError:
+                    # the send buffer is full; same as losing the packet
+                    pass
+
+    _drain(sock, handler)
+
+
+class NodeProtocol(asyncio.DatagramProtocol):
+
+    """asyncio protocol serving id requests with a RequestHandler."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.transport = None
 
+    def connection_made(self, transport):
+        self.transport = transport
 
-def pack_request():
-    return struct.pack("!B", 0)
+    def datagram_received(self, data, addr):
+        self.transport.sendto(self.handler(data, addr), addr)
+
+
+async def serve_async(socks, handler, stop=None):
+    """Serve requests on multiple bound sockets with the same handler,
+    until stop is set (forever if stop is None).
+
+    This allows serving ids in the same event loop as other things
+    (health checks, metrics etc.). Once stop is set, the requests already
+    queued on the sockets are answered (see _drain()), and the transports
+    are closed.
+
+    Args:
+        socks (list(socket.socket)): Bound UDP sockets.
+        handler (RequestHandler): The request handler.
+        stop (asyncio.Event or None): Event to stop serving on.
+
+    """
+    loop = asyncio.get_event_loop()
+    if stop is None:
+        stop = asyncio.Event()
+
+    transports = []
+    try:
+        for sock in socks:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: NodeProtocol(handler), sock=sock
+            )
+            transports.append(transport)
+        await stop.wait()
+        for sock in socks:
+            _drain(sock, handler)
+    finally:
+        for transport in transports:
+            transport.close()
+
+
+def new_event_loop():
+    """Return a new uvloop event loop if uvloop is installed,
+    or a new default asyncio event loop otherwise."""
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def serve_asyncio(sock, handler, stop=None):
+    """Serve requests using an asyncio event loop (see serve_async()),
+    until stop is set (forever if stop is None).
+
+    uvloop is used if installed. See serve_blocking() for details on stop.
+
+    """
+
+    async def serve():
+        async_stop = asyncio.Event()
+
+        async def watch_stop():
+            while not stop.is_set():
+                await asyncio.sleep(STOP_CHECK_INTERVAL)
+            async_stop.set()
+
+        if stop is not None:
+            watcher = asyncio.ensure_future(watch_stop())
+        try:
+            await serve_async([sock], handler, async_stop)
+        finally:
+            if stop is not None:
+                watcher.cancel()
+
+    loop = new_event_loop()
+    try:
+        loop.run_until_complete(serve())
+    finally:
+        loop.close()
+
+
+ENGINES = {
+    "blocking": serve_blocking,
+    "bulk": serve_bulk,
+    "asyncio": serve_asyncio,
+}
+
+
+def bind_socket(addr):
+    """Return an UDP socket with the SO_REUSEPORT option bound to addr."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, True)
+    sock.bind(addr)
+    return sock
 
 
-def run_server(addr, *args):
-    """Bind to addr and serve id requests forever.
+def run_server(
+    addr,
+    *args,
+    engine="blocking",
+    node_cls=Node,
+    log_dir=None,
+    metrics_addr=None,
+    stop=None,
+):
+    """Bind to addr and serve id requests, until stop is set
+    (forever if stop is None).
 
     The socket has the SO_REUSEPORT option, so multiple servers can serve
     requests on the same port. On Linux, each server should get a separate
@@ -79,27 +578,41 @@ def run_server(addr, *args):
 
     Args:
         addr: Passed to socket.bind(addr).
-        *args: Passed to Node(*args).
+        *args: Passed to node_cls(*args).
+        engine (str): The server loop to use, one of ENGINES
+            (see the serve_* functions for details).
+        node_cls (type): The Node (sub)class to use, e.g. SharedNode.
+        log_dir (str or None): If given, log the issued ids to files
+            in this directory (see global_id_log.IdLogWriter);
+            the files are prefixed with the process id.
+        metrics_addr (tuple(str, int) or None): If given, serve metrics
+            over HTTP on this address (see global_id_metrics).
+        stop (threading.Event or None): Event to stop serving on; the requests
+            already queued are answered, and the id log is closed, before
+            returning (see serve_blocking()). Setting it is safe
+            from a signal handler.
 
     """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, True)
-    sock.bind(addr)
-
-    node = Node(*args)
+    serve = ENGINES[engine]
+    sock = bind_socket(addr)
 
-    while True:
-        request_data, addr = sock.recvfrom(1024)
+    log = None
+    if log_dir is not None:
+        log = IdLogWriter(log_dir, prefix=f"ids-{os.getpid()}", node_cls=node_cls)
 
-        try:
-            unpack_request(request_data)
-            response_data = pack_response_ok(node.get_id())
-        except (ValueError, struct.error) as e:
-            response_data = pack_response_error()
-        except GlobalIdError as e:
-            response_data = pack_response_error()
+    node = node_cls(*args)
+    metrics = None
+    if metrics_addr is not None:
+        metrics = RequestMetrics()
+        serve_metrics(metrics_addr, lambda: render_metrics(node, metrics))
 
-        sock.sendto(response_data, addr)
+    handler = RequestHandler(node, RecentResponses(), log, metrics)
+    try:
+        serve(sock, handler, stop=stop)
+    finally:
+        sock.close()
+        if log is not None:
+            log.close()
 
 
 def get_id(sock):
@@ -109,15 +622,108 @@ def get_id(sock):
         sock: A connected socket.
 
     Returns:
-        tuple(int) or tuple(int, int): (0, id) on success, (1, ) on error.
+        tuple(int, int): (0, id) on success, (status, retry after)
+        on error (see unpack_response()).
 
     """
     sock.send(pack_request())
     return unpack_response(sock.recv(1024))
 
 
+def get_ids(sock, count):
+    """Given a socket connected to an UDP server, request up to count ids
+    (all in one datagram) and return them.
+
+    Args:
+        sock: A connected socket.
+        count (int): The maximum number of ids, in range(1, MAX_COUNT + 1).
+
+    Returns:
+        tuple(int, range): (0, ids) on success, (status, retry after)
+        on error (see unpack_response()).
+
+    """
+    sock.send(pack_request(count))
+    return unpack_response(sock.recv(1024))
+
+
+def get_ids_tagged(sock, count, retries=3, tag=None):
+    """Like get_ids(), but use a tagged request, retrying on timeout.
+
+    Responses with a different tag (e.g. duplicated or late responses
+    to previous requests) are ignored. Because the server caches responses
+    to tagged requests, a retried request gets the same ids as the original.
+
+    Args:
+        sock: A connected socket; it should have a timeout.
+        count (int): The maximum number of ids, in range(1, MAX_COUNT + 1).
+        retries (int): How many times to retry on timeout.
+        tag (int or None): The request tag; a random one is used if None.
+
+    Returns:
+        tuple(int, range): (0, ids) on success, (status, retry after)
+        on error (see unpack_response()).
+
+    Raises:
+        socket.timeout: If there was no response after all the retries.
+
+    """
+    if tag is None:
+        tag = random.getrandbits(32)
+    request_data = pack_request(count, tag)
+
+    for attempt in range(retries + 1):
+        sock.send(request_data)
+        try:
+            while True:
+                response_tag, response = unpack_tagged_response(sock.recv(1024))
+                if response_tag == tag:
+                    return response
+        except socket.timeout:
+            if attempt == retries:
+                raise
+
+
+def get_ids_wait(sock, count, timeout, retries=3):
+    """Like get_ids_tagged(), but while the server is out of ids,
+    wait as long as it suggests and try again, for up to timeout seconds.
+
+    Other errors are returned right away; for FAILOVER_STATUSES,
+    the caller should try another node instead of retrying.
+
+    Returns:
+        tuple(int, range): Like get_ids_tagged().
+
+    Raises:
+        socket.timeout: If there was no response after all the retries.
+
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        status, result = get_ids_tagged(sock, count, retries)
+        if status != STATUS_OUT_OF_IDS:
+            return status, result
+        # older servers don't send a retry after
+        delay = result if result is not None else 0.001
+        if time.monotonic() + delay > deadline:
+            return status, result
+        time.sleep(delay)
+
+
+def response_error(status, retry_after=None):
+    """Return an exception corresponding to an error response."""
+    if status == STATUS_OUT_OF_IDS:
+        return OutOfIds("server ran out of ids", retry_after)
+    if status == STATUS_CLOCK_ERROR:
+        return ClockError("server clock error")
+    if status == STATUS_OUT_OF_SECONDS:
+        return OutOfSeconds("server ran out of time parts")
+    if status == STATUS_BAD_REQUEST:
+        return ValueError("bad request")
+    return GlobalIdError(f"server returned an error: {status}")
+
+
 if __name__ == "__main__":
-    import time
     import threading
 
     addr = ("127.0.0.1", 9999)
@@ -130,3 +736,4 @@ if __name__ == "__main__":
         print(get_id(sock))
         time.sleep(1)
         print(get_id(sock))
+        print(get_ids(sock, 3))
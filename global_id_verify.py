@@ -0,0 +1,312 @@
+"""
+Offline verification of large sets of ids, e.g. global_id_log files
+written by multiple nodes, across restarts and clock jumps.
+
+It checks that:
+
+* all the ids are unique (across all the files)
+* in each file, the ids of each node id are strictly increasing
+
+Memory use is bounded (about chunk_size ids per worker process) regardless
+of the input size, by using an external sort:
+
+1. The input files are scanned in parallel, one file per task.
+   Each task checks monotonicity, and splits the ids into shards by
+   time part (so equal ids end up in the same shard), appending them
+   to temporary files.
+2. The shards are checked in parallel, one shard per task.
+   Each task sorts chunk_size ids at a time into sorted runs
+   (temporary files), then merges the runs and compares adjacent ids.
+   At most MERGE_FAN_IN runs are merged at a time (so the open files
+   and read buffers are bounded too); if there are more, they are merged
+   into longer runs first, in multiple passes.
+
+Usage::
+
+    python global_id_verify.py [--workers N] [--shards N] \\
+        [--chunk-size N] [--tmp-dir DIR] FILE ...
+
+"""
+
+import os
+import sys
+import time
+import heapq
+import array
+import argparse
+import tempfile
+import itertools
+import collections
+import concurrent.futures
+
+from global_id import Node
+from global_id_log import read_chunks, write_chunk
+
+
+# how many sorted runs to merge at a time
+MERGE_FAN_IN = 64
+
+
+Report = collections.namedtuple(
+    "Report",
+    "count duplicate_count duplicates non_monotonic_count non_monotonic seconds",
+)
+Report.__doc__ = """The result of verify().
+
+Attributes:
+    count (int): The number of ids checked.
+    duplicate_count (int): The number of ids that appear more than once
+        (each counted once).
+    duplicates (list(int)): Up to max_examples of the duplicate ids.
+    non_monotonic_count (int): The number of ids not greater than
+        the previous id of the same node id in the same file.
+    non_monotonic (list(tuple(str, int, int))): Up to max_examples
+        of (path, previous id, id) tuples.
+    seconds (float): How long the verification took.
+
+"""
+
+
+def _shard_path(tmp_dir, file_index, shard):
+    return os.path.join(tmp_dir, f"shard-{shard}-{file_index}.tmp")
+
+
+def _scan(args):
+    path, file_index, tmp_dir, shards, chunk_size, node_cls, max_examples = args
+
+    time_part_shift = node_cls.sequence_bits + node_cls.node_id_bits
+    node_id_mask = 2 ** node_cls.node_id_bits - 1
+
+    count = 0
+    non_monotonic_count = 0
+    non_monotonic = []
+    # node id -> last id
+    last_ids = {}
+
+    files = [open(_shard_path(tmp_dir, file_index, s), "wb") for s in range(shards)]
+    try:
+        for chunk in read_chunks(path, chunk_size):
+            count += len(chunk)
+            parts = [array.array("Q") for _ in range(shards)]
+
+            for id in chunk:
+                node_id = id & node_id_mask
+                last_id = last_ids.get(node_id, -1)
+                if id <= last_id:
+                    non_monotonic_count += 1
+                    if len(non_monotonic) < max_examples:
+                        non_monotonic.append((path, last_id, id))
+                last_ids[node_id] = id
+                parts[(id >> time_part_shift) % shards].append(id)
+
+            for file, part in zip(files, parts):
+                write_chunk(file, part)
+    finally:
+        for file in files:
+            file.close()
+
+    return count, non_monotonic_count, non_monotonic
+
+
+def _check_shard(args):
+    shard, file_count, tmp_dir, chunk_size, max_examples = args
+
+    # 1. sorted runs of up to chunk_size ids
+    chunks = itertools.chain.from_iterable(
+        read_chunks(_shard_path(tmp_dir, i, shard), chunk_size)
+        for i in range(file_count)
+    )
+    run_paths = []
+    buffer = array.array("Q")
+
+    def write_run():
+        run_path = os.path.join(tmp_dir, f"run-{shard}-{len(run_paths)}.tmp")
+        with open(run_path, "wb") as file:
+            write_chunk(file, array.array("Q", sorted(buffer)))
+        run_paths.append(run_path)
+        del buffer[:]
+
+    for chunk in chunks:
+        buffer.extend(chunk)
+        if len(buffer) >= chunk_size:
+            write_run()
+    if buffer:
+        write_run()
+
+    for i in range(file_count):
+        os.remove(_shard_path(tmp_dir, i, shard))
+
+    # 2. merge the runs, reading a small part of each at a time;
+    # if there are too many, merge them into longer runs first
+    read_size = max(1, chunk_size // MERGE_FAN_IN)
+    merge_pass = 0
+    while len(run_paths) > MERGE_FAN_IN:
+        merged_paths = []
+        for i in range(0, len(run_paths), MERGE_FAN_IN):
+            merged_path = os.path.join(tmp_dir, f"merge-{shard}-{merge_pass}-{i}.tmp")
+            _merge_runs(run_paths[i : i + MERGE_FAN_IN], merged_path, read_size)
+            merged_paths.append(merged_path)
+        run_paths = merged_paths
+        merge_pass += 1
+
+    runs = [_read_run(run_path, read_size) for run_path in run_paths]
+
+    duplicate_count = 0
+    duplicates = []
+    previous = last_duplicate = None
+    for id in heapq.merge(*runs):
+        # count each duplicate id only once
+        if id == previous and id != last_duplicate:
+            duplicate_count += 1
+            if len(duplicates) < max_examples:
+                duplicates.append(id)
+            last_duplicate = id
+        previous = id
+
+    for run_path in run_paths:
+        os.remove(run_path)
+
+    return duplicate_count, duplicates
+
+
+def _read_run(path, read_size):
+    return itertools.chain.from_iterable(read_chunks(path, read_size))
+
+
+def _merge_runs(run_paths, merged_path, read_size):
+    """Merge sorted runs into a single one, and remove them."""
+    runs = [_read_run(run_path, read_size) for run_path in run_paths]
+    buffer = array.array("Q")
+    with open(merged_path, "wb") as file:
+        for id in heapq.merge(*runs):
+            buffer.append(id)
+            if len(buffer) >= read_size:
+                write_chunk(file, buffer)
+                buffer = array.array("Q")
+        write_chunk(file, buffer)
+
+    for run_path in run_paths:
+        os.remove(run_path)
+
+
+def verify(
+    paths,
+    node_cls=Node,
+    workers=None,
+    shards=None,
+    chunk_size=1 << 20,
+    tmp_dir=None,
+    max_examples=10,
+):
+    """Check that the ids in a number of id log files are unique,
+    and that the ids of each node id in each file are strictly increasing.
+
+    See the module docstring for details.
+
+    Args:
+        paths (list(str)): The id log files.
+        node_cls (type): The Node class that generated the ids
+            (used to decode their time part and node id).
+        workers (int or None): The number of worker processes;
+            defaults to os.cpu_count(); if 1, run everything
+            in the current process.
+        shards (int or None): The number of shards; defaults to workers.
+        chunk_size (int): How many ids each worker keeps in memory.
+        tmp_dir (str or None): Where to create the temporary files
+            (they take about as much space as the input files).
+        max_examples (int): How many duplicate / non-monotonic ids to report.
+
+    Returns:
+        Report: The result.
+
+    """
+    start = time.monotonic()
+    workers = workers or os.cpu_count() or 1
+    shards = shards or workers
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        if workers == 1:
+            executor = None
+            map_ = map
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor(workers)
+            map_ = executor.map
+
+        try:
+            scan_results = list(
+                map_(
+                    _scan,
+                    [
+                        (path, i, tmp, shards, chunk_size, node_cls, max_examples)
+                        for i, path in enumerate(paths)
+                    ],
+                )
+            )
+            shard_results = list(
+                map_(
+                    _check_shard,
+                    [
+                        (shard, len(paths), tmp, chunk_size, max_examples)
+                        for shard in range(shards)
+                    ],
+                )
+            )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    count = sum(r[0] for r in scan_results)
+    non_monotonic_count = sum(r[1] for r in scan_results)
+    non_monotonic = list(itertools.chain.from_iterable(r[2] for r in scan_results))
+    duplicate_count = sum(r[0] for r in shard_results)
+    duplicates = sorted(itertools.chain.from_iterable(r[1] for r in shard_results))
+
+    return Report(
+        count,
+        duplicate_count,
+        duplicates[:max_examples],
+        non_monotonic_count,
+        non_monotonic[:max_examples],
+        time.monotonic() - start,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check that the ids in id log files are unique, "
+        "and that the ids of each node in a file are increasing."
+    )
+    parser.add_argument("paths", nargs="+", metavar="FILE", help="id log file")
+    parser.add_argument("--workers", type=int, help="default: the CPU count")
+    parser.add_argument("--shards", type=int, help="default: the worker count")
+    parser.add_argument("--chunk-size", type=int, default=1 << 20)
+    parser.add_argument("--tmp-dir")
+    args = parser.parse_args(argv)
+
+    report = verify(
+        args.paths,
+        workers=args.workers,
+        shards=args.shards,
+        chunk_size=args.chunk_size,
+        tmp_dir=args.tmp_dir,
+    )
+
+    rate = report.count / report.seconds if report.seconds else 0
+    print(
+        f"checked {report.count} ids from {len(args.paths)} files "
+        f"in {report.seconds:.3f} s ({rate:.0f} ids/s)"
+    )
+    print(f"duplicate ids: {report.duplicate_count}")
+    for id in report.duplicates:
+        print(f"  {id}")
+    print(f"non-monotonic ids: {report.non_monotonic_count}")
+    for path, previous, id in report.non_monotonic:
+        print(f"  {path}: {id} after {previous}")
+
+    ok = not report.duplicate_count and not report.non_monotonic_count
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
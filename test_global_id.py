@@ -1,6 +1,11 @@
 import pytest
+import asyncio
+import threading
+import multiprocessing
 from datetime import datetime, timedelta, timezone
 from global_id import Node, GlobalIdError, OutOfIds, OutOfSeconds, ClockError
+from global_id import ThreadSafeNode, SharedNode, SharedState, StateFile
+from global_id import ClockWatchdog, MonotonicClock, Histogram
 
 
 def as_seconds(*args, **kwargs):
@@ -23,6 +28,9 @@ class FakeTimeMixin:
     def time(self):
         return self.now
 
+    def sleep(self, seconds):
+        self.now += seconds
+
     def get_all(self, get_id=lambda n: n._get_id()):
         """Return all the possible ids for the node as a list of lists,
         each inner list containing the ids for a different time_part.
@@ -52,7 +60,7 @@ class FakeTimeMixin:
 
         def all():
             while True:
-                self.now += 1
+                self.now += 1 / self.ticks_per_second
                 try:
                     yield list(sequence())
                 except OutOfSeconds:
@@ -96,6 +104,12 @@ TINY_NODE_TUPLE_IDS = {
 }
 
 
+class TinyMillisecondNode(TinyNode):
+    ticks_per_second = 1000
+    # in the middle of a tick, to avoid rounding issues
+    initial_now = -0.0005
+
+
 def format_tuple_ids(value):
     if isinstance(value, tuple):
         subnode_id, subnode_count = value
@@ -107,7 +121,8 @@ def format_tuple_ids(value):
     "args, expected_ids", list(TINY_NODE_TUPLE_IDS.items()), ids=format_tuple_ids,
 )
 @pytest.mark.parametrize("node_id", list(range(2 ** 3)))
-def test_tiny_node_tuple_ids(node_id, args, expected_ids):
+@pytest.mark.parametrize("TinyNode", [TinyNode, TinyMillisecondNode])
+def test_tiny_node_tuple_ids(TinyNode, node_id, args, expected_ids):
     node = TinyNode(node_id, *args)
     actual = node.get_all()
     expected = [[id + (node_id,) for id in id_list] for id_list in expected_ids]
@@ -122,10 +137,63 @@ def test_tiny_node_int_ids():
     ]
 
 
+def test_tiny_node_unpack_id():
+    node = TinyNode(2, 0, 1)
+    for id_list in node.get_all():
+        for id in id_list:
+            assert node.unpack_id(node._pack_id(*id)) == id
+
+
 def test_default_subnode_args():
     assert TinyNode(7).get_all() == TinyNode(7, 0, 1).get_all()
 
 
+@pytest.mark.parametrize(
+    "args, expected_ids", list(TINY_NODE_TUPLE_IDS.items()), ids=format_tuple_ids,
+)
+@pytest.mark.parametrize("n", [1, 2, 3, 5])
+@pytest.mark.parametrize("TinyNode", [TinyNode, TinyMillisecondNode])
+def test_tiny_node_reserve(TinyNode, n, args, expected_ids):
+    node = TinyNode(5, *args)
+    batches = node.get_all(lambda node: node._reserve(n))
+
+    actual = [
+        [
+            (time_part, sequence)
+            for time_part, sequences, node_id in batch_list
+            for sequence in sequences
+        ]
+        for batch_list in batches
+    ]
+    assert actual == expected_ids
+
+    for batch_list in batches:
+        # all batches but the last one for a second must be full
+        assert [len(s) for _, s, _ in batch_list[:-1]] == [n] * (len(batch_list) - 1)
+        assert all(node_id == 5 for _, _, node_id in batch_list)
+
+
+@pytest.mark.parametrize("args", list(TINY_NODE_TUPLE_IDS), ids=format_tuple_ids)
+@pytest.mark.parametrize("TinyNode", [TinyNode, TinyMillisecondNode])
+def test_tiny_node_reserve_int_ids(TinyNode, args):
+    expected = TinyNode(2, *args).get_all(lambda n: n.get_id())
+    actual = TinyNode(2, *args).get_all(lambda n: n.reserve(3))
+    assert [[id for ids in l for id in ids] for l in actual] == expected
+
+    actual = TinyNode(2, *args).get_all(lambda n: n.get_ids(2))
+    assert [[id for ids in l for id in ids] for l in actual] == expected
+
+
+def test_reserve_errors():
+    node = TinyNode(0)
+    node.now = 1
+    with pytest.raises(ValueError):
+        node.reserve(0)
+    with pytest.raises(ValueError):
+        node.get_ids(-1)
+    assert node.reserve(1) == range(0b100000, 0b101000, 0b1000)
+
+
 @pytest.mark.parametrize("Node, max_node_id", [(Node, 1023), (TinyNode, 7)])
 def test_init_errors(Node, max_node_id):
     """Passing the wrong values to Node() must raise ValueError."""
@@ -204,6 +272,42 @@ def test_clock_moved_backwards():
         node.get_id()
 
 
+def test_clock_moved_backwards_same_second():
+    class FakeTimeNode(FakeTimeMixin, Node):
+        time_part_epoch = 1000
+
+    node = FakeTimeNode(0)
+
+    node.now = 1010.5
+    node.get_id()
+    node.now = 1010.6
+    node.get_id()
+
+    node.now = 1010.4
+    with pytest.raises(ClockError):
+        node.get_id()
+    with pytest.raises(ClockError):
+        node._get_id()
+
+    node.now = 1010.6
+    assert node._get_id() == (10, 2, 0)
+
+
+def test_get_id_mixed_with_other_methods():
+    node = TinyNode(1, 0, 1)
+    node.now = 0
+    assert node.get_id() == node._pack_id(0, 0, 1)
+    assert node._get_id() == (0, 1, 1)
+    assert node.reserve(1) == range(node._pack_id(0, 2, 1), node._pack_id(0, 3, 1), 8)
+    assert node.get_id() == node._pack_id(0, 3, 1)
+    with pytest.raises(OutOfIds):
+        node.get_id()
+
+    node.now = 1.5
+    assert node._get_id() == (1, 0, 1)
+    assert node.get_id() == node._pack_id(1, 1, 1)
+
+
 def test_no_ids_the_first_second():
     class FakeTimeNode(FakeTimeMixin, Node):
         time_part_epoch = 1000
@@ -242,6 +346,50 @@ def to_id(time_part, sequence, node_id):
     return int(f"{time_part:037b}{sequence:017b}{node_id:010b}", 2)
 
 
+def test_get_id_milliseconds():
+    class FakeTimeNode(FakeTimeMixin, Node):
+        time_part_bits = 41
+        sequence_bits = 12
+        node_id_bits = 10
+        ticks_per_second = 1000
+        initial_now = as_seconds(2020, 1, 10, second=11, microsecond=987654)
+
+    node = FakeTimeNode(123)
+    time_part = (9 * 24 * 3600 + 11) * 1000 + 987
+
+    def to_id(time_part, sequence, node_id):
+        return int(f"{time_part:041b}{sequence:012b}{node_id:010b}", 2)
+
+    with pytest.raises(OutOfIds):
+        node.get_id()
+    node.now = as_seconds(2020, 1, 10, second=11, microsecond=987999)
+    with pytest.raises(OutOfIds):
+        node.get_id()
+
+    # only the first millisecond is refused
+    node.now = as_seconds(2020, 1, 10, second=11, microsecond=988000)
+    assert node.get_id() == to_id(time_part + 1, 0, 123)
+    assert len(node.reserve(2 ** 12)) == 2 ** 12 - 1
+    with pytest.raises(OutOfIds):
+        node.get_id()
+
+    node.now = as_seconds(2020, 1, 10, second=11, microsecond=989500)
+    assert node.get_id() == to_id(time_part + 2, 0, 123)
+    assert node._get_id() == (time_part + 2, 1, 123)
+
+    node.now = as_seconds(2020, 1, 10, second=12, microsecond=1)
+    assert node.get_id() == to_id(time_part + 13, 0, 123)
+
+    node.now = as_seconds(2020, 1, 10, second=11, microsecond=999999)
+    with pytest.raises(ClockError):
+        node.get_id()
+
+
+def test_unpack_id():
+    id = to_id(2 ** 37 - 1, 12345, 678)
+    assert Node.unpack_id(id) == (2 ** 37 - 1, 12345, 678)
+
+
 def test_get_id():
     class FakeTimeNode(FakeTimeMixin, Node):
         initial_now = as_seconds(2020, 1, 10, second=11, microsecond=987654)
@@ -311,3 +459,854 @@ def test_get_id_subnodes():
     assert nodes[1].get_id() == to_id(9 * 24 * 3600 + 12, 2 ** 17 - 1, 321)
     with pytest.raises(OutOfIds):
         assert nodes[2].get_id()
+
+
+def test_reserve():
+    class FakeTimeNode(FakeTimeMixin, Node):
+        initial_now = as_seconds(2020, 1, 10, second=11, microsecond=987654)
+
+    node = FakeTimeNode(123, 1, 2)
+
+    with pytest.raises(OutOfIds):
+        node.reserve(10)
+
+    node.now = as_seconds(2020, 1, 10, second=12)
+    ids = node.reserve(3)
+    assert list(ids) == [
+        to_id(9 * 24 * 3600 + 12, 1, 123),
+        to_id(9 * 24 * 3600 + 12, 3, 123),
+        to_id(9 * 24 * 3600 + 12, 5, 123),
+    ]
+    assert node.get_id() == to_id(9 * 24 * 3600 + 12, 7, 123)
+
+    ids = node.reserve(2 ** 16 - 6)
+    assert len(ids) == 2 ** 16 - 6
+    assert ids[-1] == to_id(9 * 24 * 3600 + 12, 2 ** 17 - 5, 123)
+
+    # a partial batch instead of an error
+    assert node.get_ids(10) == [
+        to_id(9 * 24 * 3600 + 12, 2 ** 17 - 3, 123),
+        to_id(9 * 24 * 3600 + 12, 2 ** 17 - 1, 123),
+    ]
+
+    with pytest.raises(OutOfIds):
+        node.reserve(1)
+
+    node.now = as_seconds(2020, 1, 10, second=13)
+    assert node.get_ids(1) == [to_id(9 * 24 * 3600 + 13, 1, 123)]
+
+
+@pytest.mark.parametrize("args", list(TINY_NODE_TUPLE_IDS), ids=format_tuple_ids)
+def test_tiny_thread_safe_node(args):
+    class TinyThreadSafeNode(FakeTimeMixin, ThreadSafeNode):
+        time_part_bits = 1
+        sequence_bits = 2
+        node_id_bits = 3
+        time_part_epoch = 0
+
+    assert TinyThreadSafeNode(2, *args).get_all() == TinyNode(2, *args).get_all()
+
+
+def test_thread_safe_node():
+    class FakeTimeNode(FakeTimeMixin, ThreadSafeNode):
+        sequence_bits = 14
+        time_part_epoch = 0
+        initial_now = 10
+
+    node = FakeTimeNode(0)
+    node.now = 11
+
+    def run(ids):
+        while True:
+            try:
+                ids.extend(node.get_ids(3))
+                ids.append(node.get_id())
+            except OutOfIds:
+                break
+
+    id_lists = [[] for _ in range(8)]
+    threads = [threading.Thread(target=run, args=(ids,)) for ids in id_lists]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_ids = sorted(id for ids in id_lists for id in ids)
+    assert all_ids == [node._pack_id(11, i, 0) for i in range(2 ** 14)]
+    for ids in id_lists:
+        assert ids == sorted(ids)
+
+
+class FakeTimeSharedNode(FakeTimeMixin, SharedNode):
+    sequence_bits = 10
+    time_part_epoch = 0
+    initial_now = 10
+
+
+def test_shared_node():
+    state = SharedState()
+    one = FakeTimeSharedNode(1, state)
+    two = FakeTimeSharedNode(1, state)
+
+    # first second
+    with pytest.raises(OutOfIds):
+        one.get_id()
+
+    one.now = two.now = 11
+    assert one._get_id() == (11, 0, 1)
+    assert two._get_id() == (11, 1, 1)
+    assert list(two._reserve(3)[1]) == [2, 3, 4]
+    assert list(one.reserve(2)) == [one._pack_id(11, i, 1) for i in (5, 6)]
+
+    # the clock went backwards for one of the processes
+    one.now = 10.9
+    with pytest.raises(ClockError):
+        one.get_id()
+
+    # all the ids for the second are usable from a single process
+    assert len(two.reserve(2 ** 10)) == 2 ** 10 - 7
+    with pytest.raises(OutOfIds):
+        one.now = 11
+        one.get_id()
+
+    # a node created later does not reset the state
+    three = FakeTimeSharedNode(1, state)
+    three.now = 11.5
+    with pytest.raises(OutOfIds):
+        three.get_id()
+    three.now = 12
+    assert three._get_id() == (12, 0, 1)
+
+    with pytest.raises(ValueError):
+        three.reserve(0)
+
+
+def test_shared_node_leases():
+    state = SharedState()
+    one = FakeTimeSharedNode(1, state, 4)
+    two = FakeTimeSharedNode(1, state, 4)
+    one.now = two.now = 11
+
+    assert [one._get_id()[1] for _ in range(2)] == [0, 1]
+    assert [two._get_id()[1] for _ in range(5)] == [4, 5, 6, 7, 8]
+    # more than the rest of the lease; the rest cannot be extended, so it's dropped
+    assert list(one._reserve(3)[1]) == [12, 13, 14]
+    # larger than a lease; the rest of the lease is extended
+    assert list(one._reserve(6)[1]) == [15, 16, 17, 18, 19, 20]
+    assert one._get_id()[1] == 21
+    assert two._get_id()[1] == 9
+
+    # a lease is only valid for the second it was made in
+    two.now = 12
+    assert two._get_id() == (12, 0, 1)
+    one.now = 12
+    assert one._get_id() == (12, 4, 1)
+
+    # the clock went backwards for one of the processes
+    one.now = 11.9
+    with pytest.raises(ClockError):
+        one.get_id()
+
+    # the rest of the lease, extended by a lease bounded by the available sequences
+    one.now = 12
+    assert one._reserve(2 ** 10)[1] == range(5, 2 ** 10)
+    with pytest.raises(OutOfIds):
+        one.get_id()
+    assert [two._get_id()[1] for _ in range(3)] == [1, 2, 3]
+    with pytest.raises(OutOfIds):
+        two.get_id()
+
+    with pytest.raises(ValueError):
+        FakeTimeSharedNode(1, state, 0)
+
+
+def test_shared_node_lease_short_batch():
+    state = SharedState()
+    node = FakeTimeSharedNode(1, state, 8)
+    node.now = 11
+
+    assert len(node.reserve(7)) == 7
+    # only 1 left in the lease, but the shared state has plenty
+    assert node._reserve(100)[1] == range(7, 107)
+    assert state.last_sequence.value == 107
+
+
+def generate_shared_ids(state, queue):
+    node = FakeTimeSharedNode(0, state, 3)
+    node.now = 11
+    ids = []
+    while True:
+        try:
+            ids.append(node.get_id())
+        except OutOfIds:
+            break
+    queue.put(ids)
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="needs fork"
+)
+def test_shared_node_processes():
+    context = multiprocessing.get_context("fork")
+    state = SharedState()
+    FakeTimeSharedNode(0, state)
+    queue = context.Queue()
+
+    processes = [
+        context.Process(target=generate_shared_ids, args=(state, queue))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    id_lists = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    all_ids = sorted(id for ids in id_lists for id in ids)
+    assert all_ids == [FakeTimeSharedNode._pack_id(11, i, 0) for i in range(2 ** 10)]
+
+
+def test_get_id_wait():
+    class FakeTimeNode(FakeTimeMixin, Node):
+        time_part_epoch = 0
+        sequence_bits = 2
+        initial_now = 10.25
+
+    node = FakeTimeNode(0)
+
+    # the first second
+    with pytest.raises(OutOfIds):
+        node.get_id_wait(0.5)
+    assert node.now == 10.25
+    assert node.unpack_id(node.get_id_wait(0.75)) == (11, 0, 0)
+    assert node.now == 11
+
+    assert list(node.reserve_wait(2, 0)) == [node._pack_id(11, i, 0) for i in (1, 2)]
+    assert node.unpack_id(node.get_id_wait(0)) == (11, 3, 0)
+
+    node.now = 11.5
+    with pytest.raises(OutOfIds):
+        node.reserve_wait(4, 0.25)
+    assert node.now == 11.5
+    ids = node.reserve_wait(4, 0.5)
+    assert node.now == 12
+    assert list(ids) == [node._pack_id(12, i, 0) for i in range(4)]
+
+
+def test_get_id_async():
+    class MillisecondNode(Node):
+        time_part_bits = 45
+        sequence_bits = 2
+        ticks_per_second = 1000
+
+    node = MillisecondNode(0)
+
+    async def get_ids():
+        ids = [await node.get_id_async(1) for _ in range(5)]
+        ids.extend(await node.reserve_async(10, 1))
+        ids.extend(await node.reserve_async(10, 1))
+        return ids
+
+    loop = asyncio.new_event_loop()
+    try:
+        ids = loop.run_until_complete(get_ids())
+    finally:
+        loop.close()
+
+    # batches may be partial
+    assert len(ids) >= 7
+    assert ids == sorted(set(ids))
+
+
+class FakeTimeLeadNode(FakeTimeMixin, Node):
+    time_part_epoch = 0
+    sequence_bits = 2
+    max_lead = 2
+    initial_now = 10.5
+
+
+@pytest.mark.parametrize(
+    "get_id", [lambda n: n._get_id(), lambda n: n.unpack_id(n.get_id())]
+)
+def test_max_lead(get_id):
+    node = FakeTimeLeadNode(0)
+
+    # a previous node may have generated ids for up to 10 + max_lead
+    with pytest.raises(OutOfIds):
+        get_id(node)
+    assert node.lead == 2
+
+    node.now = 11
+    assert node.lead == 1
+    assert [get_id(node) for _ in range(4)] == [(13, i, 0) for i in range(4)]
+    assert node.lead == 2
+    with pytest.raises(OutOfIds):
+        get_id(node)
+
+    node.now = 11.5
+    with pytest.raises(OutOfIds):
+        get_id(node)
+
+    # the clock caught up a bit
+    node.now = 12
+    assert [get_id(node) for _ in range(4)] == [(14, i, 0) for i in range(4)]
+    with pytest.raises(OutOfIds):
+        get_id(node)
+
+    # the node is still ahead, but its logical time never goes backwards
+    node.now = 13
+    assert node.lead == 1
+    assert get_id(node) == (15, 0, 0)
+
+    node.now = 13.5
+    with pytest.raises(ClockError):
+        node.now = 12.9
+        get_id(node)
+
+    # the clock is ahead of the node
+    node.now = 20
+    assert node.lead == 0
+    assert get_id(node) == (20, 0, 0)
+    assert node.lead == 0
+
+
+def test_max_lead_reserve():
+    node = FakeTimeLeadNode(0, 1, 2)
+    node.now = 11
+
+    assert node._reserve(3) == (13, range(1, 4, 2), 0)
+    with pytest.raises(OutOfIds):
+        node.reserve(1)
+    assert node.lead == 2
+
+    node.now = 12
+    assert node._reserve(1) == (14, range(1, 2, 2), 0)
+
+
+def test_max_lead_shared_node():
+    class FakeTimeLeadSharedNode(FakeTimeMixin, SharedNode):
+        time_part_epoch = 0
+        sequence_bits = 2
+        max_lead = 1
+        initial_now = 10.5
+
+    state = SharedState()
+    one = FakeTimeLeadSharedNode(0, state, 3)
+    two = FakeTimeLeadSharedNode(0, state, 3)
+    one.now = two.now = 11
+
+    # leases for time parts ahead of the clock stay valid
+    assert [one._get_id() for _ in range(3)] == [(12, i, 0) for i in range(3)]
+    assert two._get_id() == (12, 3, 0)
+    with pytest.raises(OutOfIds):
+        one.get_id()
+
+    two.now = 12
+    assert two._get_id() == (13, 0, 0)
+    one.now = 12
+    assert one._get_id() == (13, 3, 0)
+
+
+class FakeTimeStateFileNode(FakeTimeMixin, Node):
+    time_part_epoch = 0
+    sequence_bits = 4
+    initial_now = 10.5
+
+
+class CountingStateFile(StateFile):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = []
+
+    def write(self, time_part, sequence):
+        super().write(time_part, sequence)
+        self.writes.append((time_part, sequence))
+
+
+@pytest.mark.parametrize(
+    "get_id", [lambda n: n._get_id(), lambda n: n.unpack_id(n.get_id())]
+)
+def test_state_file(tmp_path, get_id):
+    path = str(tmp_path / "state")
+
+    state_file = CountingStateFile(path, batch_size=3)
+    assert state_file.read() is None
+    node = FakeTimeStateFileNode(0, state_file=state_file)
+
+    # no mark, the first second is refused
+    with pytest.raises(OutOfIds):
+        get_id(node)
+    assert state_file.writes == []
+
+    node.now = 11
+    assert [get_id(node) for _ in range(5)] == [(11, i, 0) for i in range(5)]
+    assert state_file.writes == [(11, 3), (11, 7)]
+    assert state_file.read() == (11, 7)
+    state_file.close()
+
+    # restart in the same second
+    state_file = CountingStateFile(path, batch_size=3)
+    node = FakeTimeStateFileNode(0, state_file=state_file)
+    node.now = 11.5
+    assert get_id(node) == (11, 8, 0)
+    assert state_file.writes == [(11, 11)]
+    assert list(node._reserve(10)[1]) == list(range(9, 16))
+    assert state_file.writes == [(11, 11), (11, 15)]
+    with pytest.raises(OutOfIds):
+        get_id(node)
+    state_file.close()
+
+    # restart in the same second, the mark is at the end of the sequence
+    state_file = CountingStateFile(path, batch_size=3)
+    node = FakeTimeStateFileNode(0, state_file=state_file)
+    node.now = 11.5
+    with pytest.raises(OutOfIds):
+        get_id(node)
+    node.now = 12
+    assert get_id(node) == (12, 0, 0)
+    assert state_file.writes == [(12, 3)]
+    state_file.close()
+
+    # restart on a machine whose clock is behind
+    state_file = CountingStateFile(path, batch_size=3)
+    node = FakeTimeStateFileNode(0, state_file=state_file)
+    node.now = 11.9
+    assert get_id(node) == (12, 4, 0)
+    state_file.close()
+
+
+def test_state_file_subnodes(tmp_path):
+    path = str(tmp_path / "state")
+
+    with pytest.raises(ValueError):
+        StateFile(path, batch_size=0)
+
+    state_file = StateFile(path, batch_size=2)
+    node = FakeTimeStateFileNode(0, 1, 3, state_file=state_file)
+    node.now = 11
+    assert node._get_id() == (11, 1, 0)
+    assert state_file.read() == (11, 7)
+    state_file.close()
+
+    state_file = StateFile(path, batch_size=2)
+    node = ThreadSafeNode(0, 1, 3, state_file=state_file)
+    assert node._last_time_part == 11
+    assert node._last_sequence == 7
+    state_file.close()
+
+
+class FakeTimeMillisecondNode(FakeTimeMixin, Node):
+    time_part_epoch = 0
+    ticks_per_second = 1000
+    sequence_bits = 4
+    initial_now = 10.5
+
+
+def test_state_file_window(tmp_path):
+    path = str(tmp_path / "state")
+
+    with pytest.raises(ValueError):
+        StateFile(path, window=-1)
+
+    # by default, a mark reserves 100 ms (time parts) ahead,
+    # so the file is written ~10 times per second, not 1000
+    state_file = CountingStateFile(path)
+    node = FakeTimeMillisecondNode(0, state_file=state_file)
+    node.now = 11
+    ids = []
+    for ms in range(1000):
+        node.now = 11 + ms / 1000
+        ids.extend(node._get_id() for _ in range(2))
+    assert len(set(ids)) == 2000
+    assert state_file.writes == [(11100 + i * 101, 15) for i in range(10)]
+    state_file.close()
+
+    # restart; the ids up to the end of the window are refused
+    state_file = CountingStateFile(path)
+    node = FakeTimeMillisecondNode(0, state_file=state_file)
+    node.now = 12.0095
+    with pytest.raises(OutOfIds):
+        node.get_id()
+    node.now = 12.0105
+    assert node._get_id() == (12010, 0, 0)
+    assert state_file.writes == [(12110, 15)]
+    state_file.close()
+
+    # without a window, the mark is written for every time part
+    state_file = CountingStateFile(path, batch_size=4, window=0)
+    node = FakeTimeMillisecondNode(0, state_file=state_file)
+    for ms in range(5):
+        node.now = 13 + ms / 1000
+        assert node._get_id() == (13000 + ms, 0, 0)
+    assert state_file.writes == [(13000 + ms, 4) for ms in range(5)]
+    state_file.close()
+
+
+class FakeTimeDriftNode(FakeTimeMixin, Node):
+    time_part_epoch = 0
+    initial_now = 10.5
+
+
+def test_max_drift_startup_delay():
+    with pytest.raises(ValueError):
+        FakeTimeDriftNode(0, max_drift=-1)
+
+    node = FakeTimeDriftNode(0, max_drift=1)
+
+    node.now = 11
+    with pytest.raises(ClockError):
+        node.get_id()
+    node.now = 12.4
+    with pytest.raises(ClockError):
+        node.reserve(1)
+
+    node.now = 12.5
+    assert node._get_id() == (12, 0, 0)
+
+
+@pytest.mark.parametrize(
+    "get_id",
+    [lambda n: n._get_id(), lambda n: n.unpack_id(n.get_id()), lambda n: n.reserve(1)],
+)
+def test_suspend(get_id):
+    node = FakeTimeDriftNode(0)
+    node.now = 11
+    get_id(node)
+    get_id(node)
+
+    node.suspend("reason")
+    with pytest.raises(ClockError) as excinfo:
+        get_id(node)
+    assert "reason" in str(excinfo.value)
+
+    node.resume()
+    assert node._get_id() == (11, 2, 0)
+
+
+def test_suspend_during_get_id():
+    node = FakeTimeDriftNode(0)
+    node.now = 11
+
+    persist = node._persist
+
+    def suspending_persist(*args):
+        # like suspend() being called by another thread
+        # between _check_clock() and _set_time_part()
+        node.suspend("reason")
+        persist(*args)
+
+    node._persist = suspending_persist
+    node.get_id()
+    node._persist = persist
+
+    with pytest.raises(ClockError):
+        node.get_id()
+    with pytest.raises(ClockError):
+        node.reserve(2)
+
+
+def test_thread_safe_node_suspend_takes_lock():
+    class FakeTimeThreadSafeNode(FakeTimeMixin, ThreadSafeNode):
+        pass
+
+    node = FakeTimeThreadSafeNode(0)
+    node.now = 11
+
+    done = threading.Event()
+    with node._lock:
+        thread = threading.Thread(target=lambda: (node.suspend("x"), done.set()))
+        thread.start()
+        assert not done.wait(0.05)
+    thread.join()
+    assert node.suspended == "x"
+
+    with pytest.raises(ClockError):
+        node.get_id()
+
+
+def test_clock_watchdog():
+    node = FakeTimeDriftNode(0, max_drift=0.5)
+    node.now = 12
+    reference = 12.5
+
+    def reference_time():
+        if isinstance(reference, Exception):
+            raise reference
+        return reference
+
+    watchdog = ClockWatchdog(node, reference_time)
+
+    assert watchdog.check()
+    assert node._get_id() == (12, 0, 0)
+
+    reference = 12.6
+    assert not watchdog.check()
+    with pytest.raises(ClockError):
+        node.get_id()
+
+    reference = 11.5
+    assert watchdog.check()
+    assert node._get_id() == (12, 1, 0)
+
+    reference = OSError("timed out")
+    assert not watchdog.check()
+    with pytest.raises(ClockError):
+        node.get_id()
+
+
+def test_clock_watchdog_shared_node():
+    state = SharedState()
+    node = FakeTimeSharedNode(0, state, max_drift=0.5)
+    assert node.max_drift == 0.5
+    node.now = 12
+
+    watchdog = ClockWatchdog(node, lambda: 12.2)
+    assert watchdog.check()
+    assert node._get_id() == (12, 0, 0)
+
+    watchdog = ClockWatchdog(node, lambda: 12.6)
+    assert not watchdog.check()
+    with pytest.raises(ClockError):
+        node.get_id()
+
+
+def test_shared_node_clock():
+    state = SharedState()
+    node = SharedNode(0, state, clock=lambda: 1000.5)
+    assert node.time() == 1000.5
+
+
+def test_clock_watchdog_thread():
+    node = FakeTimeDriftNode(0, max_drift=0.5)
+    node.now = 12
+    checks = []
+
+    def reference_time():
+        checks.append(None)
+        return 100 if len(checks) < 3 else 12
+
+    watchdog = ClockWatchdog(node, reference_time, interval=0.01)
+    watchdog.start()
+    try:
+        for _ in range(100):
+            if len(checks) >= 4:
+                break
+            watchdog._stop.wait(0.01)
+    finally:
+        watchdog.stop()
+
+    assert len(checks) >= 4
+    assert node._get_id() == (12, 0, 0)
+
+
+class FakeClocks:
+    def __init__(self, wall):
+        self.wall = wall
+        self.monotonic_ns = 0
+
+    def advance(self, seconds, wall_seconds=None):
+        self.monotonic_ns += int(seconds * 1e9)
+        self.wall += seconds if wall_seconds is None else wall_seconds
+
+    def make_clock(self, **kwargs):
+        return MonotonicClock(
+            wall=lambda: self.wall, monotonic_ns=lambda: self.monotonic_ns, **kwargs
+        )
+
+
+def test_monotonic_clock():
+    clocks = FakeClocks(1000)
+    clock = clocks.make_clock(resync_interval=1, max_slew=0.01)
+    assert clock() == 1000
+
+    clocks.advance(0.5)
+    assert clock() == pytest.approx(1000.5)
+
+    # the wall clock goes backwards; the clock doesn't
+    clocks.advance(0.5, -0.5)
+    assert clocks.wall == 1000
+    times = [clock()]
+    for _ in range(200):
+        clocks.advance(0.1)
+        times.append(clock())
+    assert times == sorted(times)
+
+    # ... but it slows down, by at most max_slew
+    assert times[10] - times[0] == pytest.approx(0.99, abs=1e-9)
+    assert clock.offset == pytest.approx(-1 + 20 * 0.01, abs=1e-6)
+
+    # and eventually catches up
+    for _ in range(1000):
+        clocks.advance(0.1)
+        clock()
+    assert clock.offset == pytest.approx(0, abs=1e-6)
+
+
+def test_monotonic_clock_step_forward():
+    clocks = FakeClocks(1000)
+    clock = clocks.make_clock(resync_interval=1, max_slew=0.01, max_step=1)
+
+    # small differences are slewed
+    clocks.advance(1, 1.5)
+    assert clock() == pytest.approx(1001)
+    clocks.advance(1)
+    assert clock.offset == pytest.approx(0.49, abs=1e-6)
+
+    # large ones are stepped, but only forward
+    clocks.advance(0, 10)
+    assert clock.offset == pytest.approx(10.49, abs=1e-6)
+    clocks.advance(1)
+    assert clock() == pytest.approx(clocks.wall)
+
+    clocks.advance(1, -10)
+    before = clock()
+    clocks.advance(1)
+    assert clock() == pytest.approx(before + 0.99)
+
+
+def test_monotonic_clock_bad_args():
+    with pytest.raises(ValueError):
+        MonotonicClock(max_slew=1)
+    with pytest.raises(ValueError):
+        MonotonicClock(max_slew=-0.1)
+
+
+def test_monotonic_clock_defaults(monkeypatch):
+    import time
+    import global_id
+
+    assert abs(MonotonicClock()() - time.time()) < 0.1
+
+    # Python 3.6 does not have time.monotonic_ns()
+    monkeypatch.delattr(time, "monotonic_ns")
+    assert MonotonicClock()._monotonic_ns is global_id._monotonic_ns
+    assert abs(MonotonicClock()() - time.time()) < 0.1
+
+
+def test_node_clock():
+    for cls in Node, ThreadSafeNode:
+        clocks = FakeClocks(as_seconds(2020, 1, 1))
+        node = cls(0, clock=clocks.make_clock())
+        with pytest.raises(OutOfIds):
+            node.get_id()
+        clocks.advance(1)
+        assert node.get_id() == to_id(1, 0, 0)
+
+        # the wall clock going backwards does not cause ClockError
+        clocks.advance(0.1, -0.5)
+        assert node.get_id() == to_id(1, 1, 0)
+        clocks.advance(1)
+        assert node.get_id() == to_id(2, 0, 0)
+
+
+def test_histogram():
+    histogram = Histogram([1, 2.5])
+    for value in [0, 1, 1.5, 2.5, 3, 100]:
+        histogram.observe(value)
+    assert histogram.counts == [2, 2, 2]
+    assert histogram.count == 6
+    assert histogram.sum == 108
+
+
+class FakeTimeStatsNode(FakeTimeMixin, Node):
+    sequence_bits = 4
+    time_part_epoch = 0
+    initial_now = 0
+
+
+class FakeTimeStatsThreadSafeNode(FakeTimeMixin, ThreadSafeNode):
+    sequence_bits = 4
+    time_part_epoch = 0
+    initial_now = 0
+
+
+@pytest.mark.parametrize("node_cls", [FakeTimeStatsNode, FakeTimeStatsThreadSafeNode])
+def test_node_stats(node_cls):
+    # 8 sequences per time part
+    node = node_cls(0, 0, 2)
+    buckets = node.sequence_utilization.buckets
+
+    with pytest.raises(OutOfIds):
+        node.get_id()
+    assert node.error_counts == {"OutOfIds": 1}
+    assert node.issued_ids == 0
+
+    node.now = 1
+    for _ in range(3):
+        node.get_id()
+    assert node.issued_ids == 3
+    assert len(node.reserve(2)) == 2
+    assert node.issued_ids == 5
+    assert node.sequence_utilization.count == 0
+
+    node.now = 2
+    node.get_id()
+    assert node.issued_ids == 6
+    assert node.sequence_utilization.count == 1
+    assert node.sequence_utilization.sum == 5 / 8
+    assert node.sequence_utilization.counts[buckets.index(0.75)] == 1
+
+    assert len(node.reserve(100)) == 7
+    with pytest.raises(OutOfIds):
+        node.get_id()
+    node.now = 1.5
+    with pytest.raises(ClockError):
+        node.get_id()
+    assert node.error_counts == {"OutOfIds": 2, "ClockError": 1}
+
+    # a time part with no ids is not observed
+    node.now = 4
+    node.get_id()
+    node.get_id()
+    node.now = 5
+    node.get_id()
+    assert node.issued_ids == 16
+    assert node.sequence_utilization.count == 3
+    assert node.sequence_utilization.counts[buckets.index(1)] == 1
+    assert node.sequence_utilization.counts[buckets.index(0.25)] == 1
+
+
+def test_shared_node_stats():
+    state = SharedState()
+    one = FakeTimeSharedNode(1, state, 4)
+    two = FakeTimeSharedNode(1, state, 4)
+
+    with pytest.raises(OutOfIds):
+        one.get_id()
+    assert one.error_counts == {"OutOfIds": 1}
+
+    one.now = two.now = 11
+    one.get_id()
+    one.get_id()
+    two.reserve(10)
+    assert one.issued_ids == 2
+    assert two.issued_ids == 10
+
+    one.now = 12
+    one.get_id()
+    assert one.issued_ids == 3
+    assert one.sequence_utilization.count == 1
+    assert one.sequence_utilization.sum == 2 / 2 ** 10
+
+
+def test_out_of_ids_retry_after():
+    node = FakeTimeLeadNode(0)
+    node.now = 11
+    node.reserve(4)
+
+    # the ids for 13 are used up, 14 can be borrowed once the clock reaches 12
+    with pytest.raises(OutOfIds) as excinfo:
+        node.get_id()
+    assert excinfo.value.retry_after == 1
+    node.now = 11.75
+    with pytest.raises(OutOfIds) as excinfo:
+        node.reserve(1)
+    assert excinfo.value.retry_after == 0.25
+
+    # the fast path
+    node = FakeTimeStatsNode(0)
+    node.now = 1.25
+    node.reserve(2 ** 4)
+    with pytest.raises(OutOfIds) as excinfo:
+        node.get_id()
+    assert excinfo.value.retry_after == 0.75
@@ -0,0 +1,222 @@
+import time
+import threading
+
+import pytest
+from global_id import OutOfIds, ClockError
+from global_id_client import PrefetchBuffer, MultiNodeClient, udp_fetch
+from global_id_udp import RequestHandler, RecentResponses, bind_socket, serve_blocking
+from test_global_id_udp import FakeTimeNode, get_free_addr
+
+
+class FakeTimeBuffer(PrefetchBuffer):
+
+    now = 0
+
+    def time(self):
+        return self.now
+
+
+def test_prefetch_buffer():
+    node = FakeTimeNode(0)
+    node.now = 11
+
+    buffer = FakeTimeBuffer(
+        node.reserve, batch_size=3, max_age=0.5, node_cls=FakeTimeNode
+    )
+    buffer.now = 11.1
+
+    with pytest.raises(OutOfIds):
+        buffer.next_id(timeout=0)
+
+    buffer.refill()
+    buffer.refill()
+    assert len(buffer) == 6
+    assert [buffer.next_id() for _ in range(4)] == [
+        node._pack_id(11, i, 0) for i in range(4)
+    ]
+    assert len(buffer) == 2
+
+    node.now = 12
+    buffer.refill()
+    assert len(buffer) == 5
+
+    # ids from second 11 are discarded
+    buffer.now = 12.5
+    assert buffer.next_id() == node._pack_id(12, 0, 0)
+    assert len(buffer) == 2
+
+    buffer.now = 13.5
+    with pytest.raises(OutOfIds):
+        buffer.next_id(timeout=0)
+    assert len(buffer) == 0
+
+
+def test_prefetch_buffer_background_refill():
+    node = FakeTimeNode(0)
+    node.now = 11
+    lock = threading.Lock()
+
+    def fetch(count):
+        with lock:
+            return node.reserve(count)
+
+    buffer = FakeTimeBuffer(fetch, batch_size=10, low_water=5, node_cls=FakeTimeNode)
+    buffer.now = 11
+
+    with buffer:
+        ids = [buffer.next_id(timeout=1) for _ in range(100)]
+
+    assert ids == [node._pack_id(11, i, 0) for i in range(100)]
+
+
+def test_prefetch_buffer_fetch_errors():
+    def fetch(count):
+        raise OutOfIds
+
+    with FakeTimeBuffer(fetch, retry_delay=0.01) as buffer:
+        with pytest.raises(OutOfIds):
+            buffer.next_id(timeout=0.05)
+
+
+def test_prefetch_buffer_retry_after():
+    calls = []
+
+    def fetch(count):
+        calls.append(time.monotonic())
+        raise OutOfIds("out of ids", 0.3)
+
+    with FakeTimeBuffer(fetch) as buffer:
+        # next_id() asking for a refill must not cut the back-off short
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:
+            with pytest.raises(OutOfIds):
+                buffer.next_id(timeout=0.005)
+
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.3
+
+
+def start_server(node, delay=0):
+    handler = RequestHandler(node, RecentResponses())
+    if delay:
+        inner = handler
+
+        def handler(request_data, addr):
+            time.sleep(delay)
+            return inner(request_data, addr)
+
+    addr = get_free_addr()
+    sock = bind_socket(addr)
+    threading.Thread(target=serve_blocking, args=(sock, handler), daemon=True).start()
+    return addr
+
+
+def make_node(node_id, now=11):
+    node = FakeTimeNode(node_id)
+    node.now = now
+    return node
+
+
+def test_udp_fetch_duplicate_responses():
+    node = make_node(0)
+    handler = RequestHandler(node, RecentResponses())
+    addr = get_free_addr()
+    sock = bind_socket(addr)
+
+    def serve():
+        while True:
+            request_data, client_addr = sock.recvfrom(1024)
+            response_data = handler(request_data, client_addr)
+            # the network duplicates every response
+            sock.sendto(response_data, client_addr)
+            sock.sendto(response_data, client_addr)
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    fetch = udp_fetch(addr)
+    ids = [id for _ in range(5) for id in fetch(3)]
+    assert len(set(ids)) == len(ids) == 15
+
+    node.now = 10
+    with pytest.raises(ClockError):
+        fetch(3)
+
+
+def test_multi_node_client():
+    nodes = [make_node(i) for i in range(3)]
+    addrs = [start_server(node) for node in nodes]
+
+    with MultiNodeClient(addrs, timeout=1) as client:
+        ids = [client.get_id() for _ in range(300)]
+        ids.extend(client.get_ids(10))
+
+    assert len(set(ids)) == len(ids) == 310
+    # all the nodes were used
+    assert {FakeTimeNode.unpack_id(id)[2] for id in ids} == {0, 1, 2}
+
+
+def test_multi_node_client_prefers_fast_nodes():
+    fast, slow = make_node(0), make_node(1)
+    addrs = [start_server(fast), start_server(slow, delay=0.02)]
+
+    with MultiNodeClient(addrs, timeout=1) as client:
+        for _ in range(50):
+            client.get_id()
+
+        assert slow.issued_ids <= 2
+        assert fast.issued_ids >= 48
+
+        # the slow node was not used for a while, so it is tried again
+        slow_endpoint = client.endpoints[1]
+        slow_endpoint.last_used -= 20
+        client.get_id()
+        assert slow_endpoint.last_used > client.time() - 1
+
+
+def test_multi_node_client_failover():
+    # one node is down, one has no ids, one has clock issues
+    addrs = [
+        get_free_addr(),
+        start_server(make_node(1, 10.5)),
+        start_server(make_node(2, 9)),
+        start_server(make_node(3)),
+    ]
+
+    with MultiNodeClient(addrs, timeout=0.2, attempts=4) as client:
+        ids = [client.get_id() for _ in range(20)]
+        assert {FakeTimeNode.unpack_id(id)[2] for id in ids} == {3}
+
+        # untried nodes look good, so all of them were tried
+        now = client.time()
+        down, out_of_ids, clock_error, ok = client.endpoints
+        for endpoint in down, clock_error:
+            assert endpoint.error_rate > 0
+            assert endpoint.unavailable_until > now + 0.5
+        assert out_of_ids.error_rate > 0
+        assert now < out_of_ids.unavailable_until <= now + 0.5
+        assert ok.error_rate == 0
+
+
+def test_multi_node_client_errors():
+    addrs = [start_server(make_node(0, 9)), start_server(make_node(1, 9))]
+    with MultiNodeClient(addrs, timeout=0.2) as client:
+        with pytest.raises(ClockError):
+            client.get_id()
+        # the nodes are down, but are still tried
+        with pytest.raises(ClockError):
+            client.get_id()
+
+    addrs = [start_server(make_node(0, 10.5))]
+    with MultiNodeClient(addrs, timeout=0.2) as client:
+        with pytest.raises(OutOfIds) as excinfo:
+            client.get_id()
+        assert excinfo.value.retry_after == 0.5
+
+    with MultiNodeClient([get_free_addr()], timeout=0.2) as client:
+        with pytest.raises(OSError):
+            client.get_id()
+
+    with pytest.raises(ValueError):
+        MultiNodeClient([])
+    with pytest.raises(ValueError):
+        MultiNodeClient([get_free_addr()], attempts=0)
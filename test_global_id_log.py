@@ -0,0 +1,139 @@
+import struct
+
+import pytest
+from global_id_log import IdLogWriter, IdLogReader, log_paths
+from global_id_udp import RequestHandler, RecentResponses, pack_request
+from test_global_id_udp import FakeTimeNode
+
+
+def test_writer_reader(tmp_path):
+    node = FakeTimeNode(0)
+    node.now = 11
+    ids = [node.get_id()] + list(node.reserve(4)) + list(node.reserve(2))
+
+    with IdLogWriter(tmp_path, node_cls=FakeTimeNode, buffer_size=3) as writer:
+        writer.write_id(ids[0])
+        writer.write_ids(range(ids[1], ids[4] + 1, 1024))
+        writer.write_ids([])
+        writer.write_ids(ids[5:])
+
+    (path,) = log_paths(tmp_path)
+    assert path == str(tmp_path.joinpath("ids-000000000000.ids"))
+
+    with IdLogReader(path) as reader:
+        assert len(reader) == len(ids)
+        assert list(reader) == ids
+        view = reader.view()
+        assert view.tolist() == ids
+        view.release()
+
+
+def test_writer_buffering(tmp_path):
+    writer = IdLogWriter(tmp_path, node_cls=FakeTimeNode, buffer_size=3)
+    writer.write_ids([1, 2])
+    (path,) = log_paths(tmp_path)
+    with IdLogReader(path) as reader:
+        assert len(reader) == 0
+
+    writer.write_id(3)
+    with IdLogReader(path) as reader:
+        assert list(reader) == [1, 2, 3]
+
+    writer.write_id(4)
+    writer.flush()
+    with IdLogReader(path) as reader:
+        assert list(reader) == [1, 2, 3, 4]
+
+    writer.close()
+
+
+def test_writer_rotation(tmp_path):
+    node = FakeTimeNode(0)
+    ids = []
+    for now in [11, 12, 13, 14, 20]:
+        node.now = now
+        ids.append(node.get_id())
+
+    with IdLogWriter(
+        tmp_path, prefix="one", rotate_every=2, node_cls=FakeTimeNode
+    ) as writer:
+        for id in ids:
+            writer.write_id(id)
+    with IdLogWriter(tmp_path, prefix="two", node_cls=FakeTimeNode) as writer:
+        writer.write_id(ids[0])
+
+    assert [p.rpartition("/")[2] for p in log_paths(tmp_path, "one")] == [
+        "one-000000000010.ids",
+        "one-000000000012.ids",
+        "one-000000000014.ids",
+        "one-000000000020.ids",
+    ]
+    assert [p.rpartition("/")[2] for p in log_paths(tmp_path)] == [
+        "two-000000000000.ids",
+        "one-000000000010.ids",
+        "one-000000000012.ids",
+        "one-000000000014.ids",
+        "one-000000000020.ids",
+    ]
+
+    logged = []
+    for path in log_paths(tmp_path, "one"):
+        with IdLogReader(path) as reader:
+            logged.extend(reader)
+    assert logged == ids
+
+
+def test_writer_append_after_partial_write(tmp_path):
+    path = tmp_path.joinpath("ids-000000000000.ids")
+    path.write_bytes(struct.pack("<QQ", 1, 2) + b"\1\2\3")
+
+    with IdLogReader(str(path)) as reader:
+        assert list(reader) == [1, 2]
+
+    with IdLogWriter(tmp_path, node_cls=FakeTimeNode) as writer:
+        writer.write_id(3)
+
+    with IdLogReader(str(path)) as reader:
+        assert list(reader) == [1, 2, 3]
+
+
+def test_reader_empty(tmp_path):
+    path = tmp_path.joinpath("ids-000000000000.ids")
+    path.write_bytes(b"\1\2")
+    with IdLogReader(str(path)) as reader:
+        assert len(reader) == 0
+        assert list(reader) == []
+        assert reader.view().tolist() == []
+
+
+def test_reader_array(tmp_path):
+    np = pytest.importorskip("numpy")
+
+    path = tmp_path.joinpath("ids-000000000000.ids")
+    path.write_bytes(struct.pack("<QQ", 1, 2 ** 64 - 1))
+    reader = IdLogReader(str(path))
+    array = reader.array()
+    assert array.dtype == np.uint64
+    assert array.tolist() == [1, 2 ** 64 - 1]
+    del array
+    reader.close()
+
+
+def test_handler_log(tmp_path):
+    node = FakeTimeNode(0)
+    node.now = 11
+    writer = IdLogWriter(tmp_path, node_cls=FakeTimeNode)
+    handle_request = RequestHandler(node, RecentResponses(), writer)
+
+    handle_request(pack_request())
+    handle_request(pack_request(2))
+    handle_request(pack_request(2, tag=1), "addr")
+    # retried, not logged again
+    handle_request(pack_request(2, tag=1), "addr")
+    # errors are not logged
+    handle_request(pack_request(0))
+    writer.close()
+
+    (path,) = log_paths(tmp_path)
+    with IdLogReader(path) as reader:
+        assert list(reader) == [node._pack_id(11, i, 0) for i in range(5)]
@@ -0,0 +1,84 @@
+import urllib.request
+import urllib.error
+
+import pytest
+from global_id_metrics import RequestMetrics, render_metrics, serve_metrics
+from global_id_udp import RequestHandler, pack_request
+from test_global_id_udp import FakeTimeNode, get_free_addr
+
+
+def test_request_metrics():
+    node = FakeTimeNode(1, 0, 2)
+    metrics = RequestMetrics(sample_every=2)
+    handle_request = RequestHandler(node, metrics=metrics)
+
+    # first second, no ids
+    handle_request(pack_request())
+    node.now = 11
+    handle_request(pack_request())
+    handle_request(pack_request(2))
+    handle_request(b"\xff")
+    handle_request(pack_request(0))
+
+    assert metrics.requests == 5
+    assert metrics.error_responses == 3
+    assert metrics.bad_requests == 2
+    assert metrics.latency.count == 2
+
+    assert node.issued_ids == 3
+    assert node.error_counts == {"OutOfIds": 1}
+
+
+def test_render_metrics():
+    node = FakeTimeNode(1, 0, 2)
+    metrics = RequestMetrics(sample_every=1, buckets=[0.5, 10])
+    handle_request = RequestHandler(node, metrics=metrics)
+    handle_request(pack_request())
+    node.now = 11
+    handle_request(pack_request(3))
+    node.now = 12
+    handle_request(pack_request())
+
+    text = render_metrics(node, metrics)
+    lines = text.splitlines()
+    assert text.endswith("\n")
+
+    labels = 'node_id="1",subnode_id="0"'
+    assert "# TYPE global_id_issued_ids_total counter" in lines
+    assert f"global_id_issued_ids_total{{{labels}}} 4" in lines
+    assert f'global_id_errors_total{{{labels},error="OutOfIds"}} 1' in lines
+    assert f'global_id_sequence_utilization_bucket{{{labels},le="0.01"}} 1' in lines
+    assert f'global_id_sequence_utilization_bucket{{{labels},le="+Inf"}} 1' in lines
+    assert f"global_id_sequence_utilization_count{{{labels}}} 1" in lines
+    assert f"global_id_lead{{{labels}}} 0" in lines
+    assert f"global_id_suspended{{{labels}}} 0" in lines
+
+    assert "global_id_requests_total 3" in lines
+    assert "global_id_error_responses_total 1" in lines
+    assert "global_id_bad_requests_total 0" in lines
+    assert 'global_id_request_duration_seconds_bucket{le="0.5"} 3' in lines
+    assert 'global_id_request_duration_seconds_bucket{le="+Inf"} 3' in lines
+    assert "global_id_request_duration_seconds_count 3" in lines
+
+    node.suspend("reason")
+    assert f"global_id_suspended{{{labels}}} 1" in render_metrics(node).splitlines()
+    assert "requests" not in render_metrics(node)
+    assert "node_id" not in render_metrics(request_metrics=metrics)
+
+
+def test_serve_metrics():
+    addr = get_free_addr()
+    server = serve_metrics(addr, lambda: "metric 1\n")
+    try:
+        url = f"http://{addr[0]}:{addr[1]}"
+        with urllib.request.urlopen(url + "/metrics") as response:
+            assert response.status == 200
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read() == b"metric 1\n"
+
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            urllib.request.urlopen(url + "/")
+        assert excinfo.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
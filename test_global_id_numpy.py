@@ -0,0 +1,104 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from global_id import Node
+from global_id_numpy import as_id_array, unpack_ids, time_parts_to_times
+from global_id_numpy import count_by_time_part, count_by_node
+from global_id_numpy import count_by_node_and_time_part, find_duplicates
+from test_global_id import TinyNode, to_id
+
+
+IDS = [
+    to_id(1, 0, 0),
+    to_id(1, 1, 0),
+    to_id(1, 0, 5),
+    to_id(2, 0, 5),
+    to_id(2 ** 37 - 1, 2 ** 17 - 1, 1023),
+]
+
+
+@pytest.mark.parametrize(
+    "ids",
+    [
+        IDS,
+        np.array(IDS, dtype=np.uint64),
+        np.array(IDS, dtype=np.uint64).reshape(1, -1),
+        np.array(IDS, dtype="<u8").tobytes(),
+        memoryview(np.array(IDS, dtype="<u8").tobytes()),
+    ],
+)
+def test_as_id_array(ids):
+    array = as_id_array(ids)
+    assert array.dtype == np.uint64
+    assert array.tolist() == IDS
+
+
+def test_as_id_array_no_copy():
+    data = bytearray(np.array(IDS, dtype="<u8").tobytes())
+    array = as_id_array(data)
+    data[:8] = b"\0" * 8
+    assert array[0] == 0
+
+
+def test_unpack_ids():
+    time_parts, sequences, node_ids = unpack_ids(IDS)
+    assert list(zip(time_parts.tolist(), sequences.tolist(), node_ids.tolist())) == [
+        Node.unpack_id(id) for id in IDS
+    ]
+
+
+def test_unpack_ids_tiny_node():
+    ids = [
+        TinyNode._pack_id(t, s, n) for t in range(2) for s in range(4) for n in [0, 7]
+    ]
+    time_parts, sequences, node_ids = unpack_ids(ids, TinyNode)
+    assert list(zip(time_parts.tolist(), sequences.tolist(), node_ids.tolist())) == [
+        TinyNode.unpack_id(id) for id in ids
+    ]
+
+
+def test_unpack_ids_too_many_bits():
+    class BigNode(Node):
+        time_part_bits = 40
+
+    with pytest.raises(ValueError):
+        unpack_ids(IDS, BigNode)
+
+
+def test_time_parts_to_times():
+    class MillisecondNode(Node):
+        ticks_per_second = 1000
+
+    times = time_parts_to_times([0, 1500], MillisecondNode)
+    assert times.tolist() == [Node.time_part_epoch, Node.time_part_epoch + 1.5]
+
+
+def test_count_by_time_part():
+    time_parts, counts = count_by_time_part(IDS)
+    assert time_parts.tolist() == [1, 2, 2 ** 37 - 1]
+    assert counts.tolist() == [3, 1, 1]
+
+
+def test_count_by_node():
+    counts = count_by_node(IDS)
+    assert len(counts) == 1024
+    assert counts[[0, 5, 1023]].tolist() == [2, 2, 1]
+    assert counts.sum() == len(IDS)
+
+
+def test_count_by_node_and_time_part():
+    node_ids, time_parts, counts = count_by_node_and_time_part(IDS)
+    assert list(zip(node_ids.tolist(), time_parts.tolist(), counts.tolist())) == [
+        (0, 1, 2),
+        (5, 1, 1),
+        (5, 2, 1),
+        (1023, 2 ** 37 - 1, 1),
+    ]
+
+
+def test_find_duplicates():
+    assert find_duplicates(IDS).tolist() == []
+    assert find_duplicates([]).tolist() == []
+    ids = IDS + [IDS[3], IDS[0], IDS[3]]
+    assert find_duplicates(ids).tolist() == [IDS[0], IDS[3]]
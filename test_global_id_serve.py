@@ -0,0 +1,178 @@
+import os
+import socket
+import signal
+import threading
+import time
+import multiprocessing
+
+import pytest
+from global_id import Node
+from global_id_log import IdLogReader
+from global_id_udp import get_id, pack_request, unpack_response
+from global_id_serve import parse_cpus, available_cpus, Supervisor, run_worker
+from test_global_id_udp import get_free_addr, wait_for_server
+
+
+@pytest.mark.parametrize(
+    "text, cpus",
+    [
+        ("0", [0]),
+        ("3,1", [1, 3]),
+        ("0,2,4-7", [0, 2, 4, 5, 6, 7]),
+        (" 1 , 0-2 ", [0, 1, 2]),
+    ],
+)
+def test_parse_cpus(text, cpus):
+    assert parse_cpus(text) == cpus
+
+
+@pytest.mark.parametrize("text", ["", "a", "1-", "1,,2"])
+def test_parse_cpus_error(text):
+    with pytest.raises(ValueError):
+        parse_cpus(text)
+
+
+def test_available_cpus():
+    cpus = available_cpus()
+    assert cpus
+    assert cpus == sorted(cpus)
+
+
+def test_supervisor_defaults():
+    supervisor = Supervisor(("127.0.0.1", 0), 0)
+    assert supervisor.cpus == available_cpus()
+    assert supervisor.worker_count == len(supervisor.cpus)
+
+    supervisor = Supervisor(("127.0.0.1", 0), 0, workers=3, cpus=[])
+    assert supervisor.worker_count == 3
+
+    with pytest.raises(ValueError):
+        Supervisor(("127.0.0.1", 0), 0, engine="nope")
+
+
+def test_restart_delay():
+    supervisor = Supervisor(
+        ("127.0.0.1", 0),
+        0,
+        workers=1,
+        restart_delay=1,
+        min_uptime=10,
+        max_restart_delay=5,
+    )
+    now = 100
+    supervisor.time = lambda: now
+
+    delays = []
+    for _ in range(5):
+        supervisor._started_at[0] = now
+        now += 1
+        delays.append(supervisor._restart_delay(0))
+    assert delays == [1, 2, 4, 5, 5]
+
+    # a worker that ran for long enough is restarted right away
+    supervisor._started_at[0] = now
+    now += 10
+    assert supervisor._restart_delay(0) == 0
+    supervisor._started_at[0] = now
+    now += 1
+    assert supervisor._restart_delay(0) == 1
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise RuntimeError("timed out")
+        time.sleep(0.01)
+
+
+def test_supervisor():
+    addr = get_free_addr()
+    cpus = available_cpus()[:1]
+    supervisor = Supervisor(addr, 7, workers=2, cpus=cpus, restart_delay=0.01)
+    thread = threading.Thread(target=supervisor.run)
+    thread.start()
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(0.1)
+            sock.connect(addr)
+            # ids for the first second are not available; we only check the format
+            assert wait_for_server(sock)[0] in (0, 3)
+
+        wait_for(lambda: all(p.is_alive() for p in supervisor.processes))
+        old_pid = supervisor.processes[0].pid
+        os.kill(old_pid, signal.SIGKILL)
+
+        wait_for(lambda: supervisor.restart_counts[0] == 1)
+        process = supervisor.processes[0]
+        assert process.pid != old_pid
+        wait_for(process.is_alive)
+        assert supervisor.restart_counts[1] == 0
+
+        # once the first second passes, both subnodes serve ids
+        time.sleep(1.1)
+        ids = set()
+        for _ in range(20):
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.settimeout(1)
+                sock.connect(addr)
+                status, id = get_id(sock)
+            assert status == 0
+            ids.add(id)
+        assert len(ids) == 20
+        assert {Node.unpack_id(id)[2] for id in ids} == {7}
+
+    finally:
+        processes = list(supervisor.processes)
+        supervisor.stop()
+        thread.join(10)
+
+    assert not thread.is_alive()
+    assert not any(p.is_alive() for p in processes)
+    assert [p.exitcode for p in processes] == [0, 0]
+
+
+@pytest.mark.parametrize("engine", ["blocking", "bulk", "asyncio"])
+def test_run_worker_sigterm(tmp_path, engine):
+    addr = get_free_addr()
+    process = multiprocessing.Process(
+        target=run_worker,
+        args=(0, 1, addr, 0, available_cpus()[0], engine),
+        kwargs=dict(log_dir=str(tmp_path)),
+    )
+    process.start()
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0.1)
+        sock.connect(addr)
+        # ids for the first second are not available
+        status, id = wait_for_server(sock)
+        served = [id] if status == 0 else []
+        time.sleep(1)
+        status, id = get_id(sock)
+        assert status == 0
+        served.append(id)
+
+        # queue requests while the worker is stopped, then terminate it
+        os.kill(process.pid, signal.SIGSTOP)
+        for _ in range(10):
+            sock.send(pack_request())
+        process.terminate()
+        os.kill(process.pid, signal.SIGCONT)
+
+        # the queued requests are answered
+        sock.settimeout(2)
+        responses = [unpack_response(sock.recv(1024)) for _ in range(10)]
+
+    process.join(5)
+    assert process.exitcode == 0
+
+    assert {status for status, _ in responses} == {0}
+    ids = served + [id for _, id in responses]
+    assert len(set(ids)) == len(ids)
+
+    # all the ids were logged, once
+    (path,) = tmp_path.iterdir()
+    with IdLogReader(str(path)) as reader:
+        assert sorted(reader) == sorted(ids)
@@ -0,0 +1,99 @@
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+from global_id_udp import new_event_loop, RequestHandler
+from global_id_tcp import serve_async, get_id, get_ids, get_many, ConnectionPool
+from global_id_tcp import pack_frame, recv_frame
+from test_global_id_udp import FakeTimeNode, get_free_addr
+
+
+@pytest.fixture
+def server():
+    addr = get_free_addr()
+    node = FakeTimeNode(0)
+    node.now = 11
+
+    loop = new_event_loop()
+    stop = None
+    started = threading.Event()
+
+    async def serve():
+        nonlocal stop
+        stop = asyncio.Event()
+        loop.call_soon(started.set)
+        await serve_async([addr], RequestHandler(node), stop)
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(serve(),))
+    thread.start()
+    started.wait()
+
+    # wait for the server to listen
+    for _ in range(100):
+        try:
+            socket.create_connection(addr).close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.01)
+    else:
+        raise RuntimeError("server did not start")
+
+    try:
+        yield addr, node
+    finally:
+        loop.call_soon_threadsafe(stop.set)
+        thread.join()
+        loop.close()
+
+
+def test_get_id(server):
+    addr, node = server
+
+    with socket.create_connection(addr, timeout=1) as sock:
+        assert get_id(sock) == (0, node._pack_id(11, 0, 0))
+        assert get_ids(sock, 2) == (
+            0,
+            range(node._pack_id(11, 1, 0), node._pack_id(11, 3, 0), 1024),
+        )
+
+        # bad request
+        sock.sendall(pack_frame(b"\x07"))
+        assert recv_frame(sock) == b"\x02\x00\x00"
+
+        assert get_id(sock) == (0, node._pack_id(11, 3, 0))
+
+
+def test_pipelining(server):
+    addr, node = server
+
+    with socket.create_connection(addr, timeout=1) as sock:
+        results = get_many(sock, [None, 3, None] * 100)
+
+    ids = []
+    for status, result in results:
+        assert status == 0
+        ids.extend(result if isinstance(result, range) else [result])
+
+    assert ids == [node._pack_id(11, i, 0) for i in range(500)]
+
+
+def test_connection_pool(server):
+    addr, node = server
+
+    pool = ConnectionPool(addr, size=1, timeout=1)
+    try:
+        assert pool.get_id() == (0, node._pack_id(11, 0, 0))
+        with pool.connection() as sock:
+            with pool.connection() as other_sock:
+                assert sock is not other_sock
+                assert get_id(other_sock) == (0, node._pack_id(11, 1, 0))
+        with pool.connection() as reused_sock:
+            assert reused_sock in (sock, other_sock)
+        assert pool.get_ids(1) == (
+            0,
+            range(node._pack_id(11, 2, 0), node._pack_id(11, 3, 0), 1024),
+        )
+    finally:
+        pool.close()
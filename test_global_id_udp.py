@@ -0,0 +1,426 @@
+import socket
+import asyncio
+import threading
+import time
+
+import pytest
+from global_id import Node, GlobalIdError, OutOfIds, ClockError, OutOfSeconds
+from global_id_udp import (
+    pack_request,
+    unpack_request,
+    pack_response_ok,
+    pack_response_ids,
+    pack_response_error,
+    unpack_response,
+    RequestHandler,
+    RecentResponses,
+    unpack_tagged_response,
+    get_ids_tagged,
+    run_server,
+    get_id,
+    get_ids,
+    REQUEST_ID,
+    REQUEST_IDS,
+    REQUEST_IDS_TAGGED,
+    MAX_COUNT,
+    ENGINES,
+    bind_socket,
+    serve_async,
+    new_event_loop,
+    STATUS_BAD_REQUEST,
+    STATUS_OUT_OF_IDS,
+    STATUS_CLOCK_ERROR,
+    get_ids_wait,
+    response_error,
+)
+from test_global_id import FakeTimeMixin
+
+
+class FakeTimeNode(FakeTimeMixin, Node):
+    time_part_epoch = 0
+    initial_now = 10.5
+
+
+def test_request_roundtrip():
+    assert pack_request() == b"\x00"
+    assert unpack_request(pack_request()) == (REQUEST_ID, None, None)
+    assert unpack_request(pack_request(1)) == (REQUEST_IDS, None, 1)
+    assert unpack_request(pack_request(MAX_COUNT)) == (REQUEST_IDS, None, MAX_COUNT)
+    assert unpack_request(pack_request(3, 2 ** 32 - 1)) == (
+        REQUEST_IDS_TAGGED,
+        2 ** 32 - 1,
+        3,
+    )
+    assert unpack_request(pack_request(tag=0)) == (REQUEST_IDS_TAGGED, 0, 1)
+    # count 0 is sent as-is (and rejected by the server), like for untagged requests
+    assert unpack_request(pack_request(0)) == (REQUEST_IDS, None, 0)
+    assert unpack_request(pack_request(0, 1)) == (REQUEST_IDS_TAGGED, 1, 0)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"\x03",
+        b"\x00\x00",
+        b"\x01",
+        b"\x01\x00\x00",
+        b"\x01\x00\x01\x00",
+        b"\x02\x00\x00\x00\x00\x00",
+    ],
+)
+def test_bad_request(data):
+    assert RequestHandler(FakeTimeNode(0))(data) == pack_response_error(
+        status=STATUS_BAD_REQUEST
+    )
+
+
+def test_bad_tagged_request():
+    data = pack_request(1, 123)[:-2] + b"\x00\x00"
+    assert RequestHandler(FakeTimeNode(0))(data) == pack_response_error(
+        123, STATUS_BAD_REQUEST
+    )
+
+
+def test_response_roundtrip():
+    assert unpack_response(pack_response_ok(2 ** 64 - 1)) == (0, 2 ** 64 - 1)
+    ids = range(10, 10 + 3 * 1024, 1024)
+    assert unpack_response(pack_response_ids(ids)) == (0, ids)
+    assert unpack_response(pack_response_error()) == (1, None)
+    assert unpack_response(pack_response_error(None, 3, 0.0101)) == (3, 0.011)
+    assert unpack_response(pack_response_error(None, 3, 0)) == (3, 0.001)
+    assert unpack_response(pack_response_error(None, 3, 100)) == (3, 65.535)
+
+    assert unpack_tagged_response(pack_response_ids(ids, 7)) == (7, (0, ids))
+    assert unpack_tagged_response(pack_response_error(7)) == (7, (1, None))
+    assert unpack_tagged_response(pack_response_error(7, 3, 0.5)) == (7, (3, 0.5))
+    assert unpack_tagged_response(pack_response_error()) == (None, (1, None))
+    assert unpack_tagged_response(pack_response_error(None, 2)) == (None, (2, None))
+
+
+def test_old_error_responses():
+    assert unpack_response(b"\x01") == (1, None)
+    assert unpack_tagged_response(b"\x01") == (None, (1, None))
+    assert unpack_tagged_response(b"\x01\x00\x00\x00\x07") == (7, (1, None))
+
+
+def test_handle_request():
+    node = FakeTimeNode(1, 0, 2)
+    handle_request = RequestHandler(node)
+
+    # first second, no ids
+    node.now = 10.75
+    assert unpack_response(handle_request(pack_request())) == (3, 0.25)
+    assert unpack_response(handle_request(pack_request(2))) == (3, 0.25)
+
+    node.now = 11
+    assert unpack_response(handle_request(pack_request())) == (
+        0,
+        node._pack_id(11, 0, 1),
+    )
+    _, ids = unpack_response(handle_request(pack_request(2)))
+    assert list(ids) == [node._pack_id(11, 2, 1), node._pack_id(11, 4, 1)]
+
+    # partial batch
+    _, ids = unpack_response(handle_request(pack_request(MAX_COUNT)))
+    assert len(ids) == 2 ** 16 - 3
+    assert ids[-1] == node._pack_id(11, 2 ** 17 - 2, 1)
+
+    node.now = 11.5
+    assert unpack_response(handle_request(pack_request(1))) == (3, 0.5)
+    assert unpack_response(handle_request(pack_request())) == (3, 0.5)
+
+    node.now = 10
+    assert unpack_response(handle_request(pack_request(1))) == (4, None)
+
+
+def get_free_addr():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()
+
+
+def wait_for_server(sock, retries=100):
+    for _ in range(retries):
+        try:
+            return get_id(sock)
+        except (ConnectionRefusedError, socket.timeout):
+            time.sleep(0.01)
+    raise RuntimeError("server did not start")
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_server(engine):
+    addr = get_free_addr()
+    threading.Thread(
+        target=run_server, args=(addr, 0), kwargs=dict(engine=engine), daemon=True
+    ).start()
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0.1)
+        sock.connect(addr)
+        # ids for the first second are not available; we only check the format
+        assert wait_for_server(sock)[0] in (0, 3)
+        assert get_ids(sock, 10)[0] in (0, 3)
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_server_stop(engine):
+    addr = get_free_addr()
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=run_server,
+        args=(addr, 0),
+        kwargs=dict(engine=engine, stop=stop),
+        daemon=True,
+    )
+    thread.start()
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(0.1)
+            sock.connect(addr)
+            # ids for the first second are not available; we only check the format
+            assert wait_for_server(sock)[0] in (0, 3)
+    finally:
+        stop.set()
+        thread.join(2)
+
+    assert not thread.is_alive()
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_server_stop_drains(engine):
+    addr = get_free_addr()
+    server_sock = bind_socket(addr)
+    node = FakeTimeNode(0)
+    node.now = 11
+    handler = RequestHandler(node)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(1)
+        sock.connect(addr)
+        for _ in range(10):
+            sock.send(pack_request())
+
+        # already set; the queued requests are still answered
+        stop = threading.Event()
+        stop.set()
+        ENGINES[engine](server_sock, handler, stop=stop)
+        server_sock.close()
+
+        responses = [unpack_response(sock.recv(1024)) for _ in range(10)]
+        assert responses == [(0, node._pack_id(11, i, 0)) for i in range(10)]
+
+
+def test_serve_async_multiple_endpoints():
+    addrs = [get_free_addr(), get_free_addr()]
+    socks = [bind_socket(addr) for addr in addrs]
+    node = FakeTimeNode(0)
+    node.now = 11
+
+    loop = new_event_loop()
+    stop = None
+    started = threading.Event()
+
+    async def serve():
+        nonlocal stop
+        stop = asyncio.Event()
+        started.set()
+        await serve_async(socks, RequestHandler(node), stop)
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(serve(),))
+    thread.start()
+    started.wait()
+
+    try:
+        seen = []
+        for addr in addrs:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.settimeout(1)
+                sock.connect(addr)
+                seen.append(get_id(sock))
+                seen.append(get_ids(sock, 2))
+
+        assert seen == [
+            (0, node._pack_id(11, 0, 0)),
+            (0, range(node._pack_id(11, 1, 0), node._pack_id(11, 3, 0), 1024)),
+            (0, node._pack_id(11, 3, 0)),
+            (0, range(node._pack_id(11, 4, 0), node._pack_id(11, 6, 0), 1024)),
+        ]
+
+    finally:
+        loop.call_soon_threadsafe(stop.set)
+        thread.join()
+        loop.close()
+
+    for sock in socks:
+        assert sock.fileno() == -1
+
+
+class FakeTimeRecentResponses(RecentResponses):
+
+    now = 0
+
+    def time(self):
+        return self.now
+
+
+def test_recent_responses():
+    cache = FakeTimeRecentResponses(size=2, max_age=1)
+
+    cache.put(1, b"one")
+    assert cache.get(1) == b"one"
+    assert cache.get(2) is None
+
+    cache.now = 0.5
+    cache.put(2, b"two")
+    cache.put(3, b"three")
+    # evicted because of size
+    assert cache.get(1) is None
+    assert cache.get(2) == b"two"
+    assert len(cache) == 2
+
+    # evicted because of age
+    cache.now = 1.5
+    assert cache.get(2) is None
+    assert cache.get(3) is None
+    assert len(cache) == 0
+
+
+def test_handle_tagged_request():
+    node = FakeTimeNode(0)
+    node.now = 11
+    handler = RequestHandler(node, FakeTimeRecentResponses())
+
+    def ids(start, stop):
+        return range(node._pack_id(11, start, 0), node._pack_id(11, stop, 0), 1024)
+
+    assert unpack_tagged_response(handler(pack_request(2, 1), "a")) == (
+        1,
+        (0, ids(0, 2)),
+    )
+    # same tag, different client
+    assert unpack_tagged_response(handler(pack_request(2, 1), "b")) == (
+        1,
+        (0, ids(2, 4)),
+    )
+    # retried request
+    assert unpack_tagged_response(handler(pack_request(2, 1), "a")) == (
+        1,
+        (0, ids(0, 2)),
+    )
+    assert unpack_tagged_response(handler(pack_request(2, 2), "a")) == (
+        2,
+        (0, ids(4, 6)),
+    )
+
+    # cache entry expired
+    handler.cache.now = 1
+    assert unpack_tagged_response(handler(pack_request(2, 1), "a")) == (
+        1,
+        (0, ids(6, 8)),
+    )
+
+    # no cache
+    handler = RequestHandler(node)
+    assert unpack_tagged_response(handler(pack_request(1, 1), "a")) == (
+        1,
+        (0, ids(8, 9)),
+    )
+    assert unpack_tagged_response(handler(pack_request(1, 1), "a")) == (
+        1,
+        (0, ids(9, 10)),
+    )
+
+
+def test_get_ids_tagged():
+    node = FakeTimeNode(0)
+    node.now = 11
+    handler = RequestHandler(node, RecentResponses())
+
+    client, server = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    with client, server:
+        client.settimeout(0.01)
+
+        # the first request gets lost
+        with pytest.raises(socket.timeout):
+            get_ids_tagged(client, 2, retries=0, tag=1)
+        server.recv(1024)
+
+        # a stale response, and a retried request
+        server.send(pack_response_ids(range(2), 0))
+        server.send(handler(pack_request(2, 1), "client"))
+        server.send(handler(pack_request(2, 1), "client"))
+        assert get_ids_tagged(client, 2, retries=0, tag=1) == (
+            0,
+            range(node._pack_id(11, 0, 0), node._pack_id(11, 2, 0), 1024),
+        )
+        # the duplicate response is ignored
+        server.send(handler(pack_request(2, 2), "client"))
+        assert get_ids_tagged(client, 2, retries=0, tag=2) == (
+            0,
+            range(node._pack_id(11, 2, 0), node._pack_id(11, 4, 0), 1024),
+        )
+
+
+class FakeSocket:
+
+    """A connected socket that handles requests with a RequestHandler."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.responses = []
+
+    def send(self, data):
+        self.responses.append(self.handler(data, "addr"))
+
+    def recv(self, size):
+        return self.responses.pop(0)
+
+
+def test_get_ids_wait(monkeypatch):
+    node = FakeTimeNode(0)
+    sock = FakeSocket(RequestHandler(node, RecentResponses()))
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        node.now += seconds
+
+    sleeps = []
+    monkeypatch.setattr("time.sleep", sleep)
+
+    # first second
+    status, ids = get_ids_wait(sock, 2, 1)
+    assert status == 0
+    assert ids == range(node._pack_id(11, 0, 0), node._pack_id(11, 2, 0), 1024)
+    assert sleeps == [0.5]
+
+    # longer than the timeout
+    node.now = 11.25
+    assert len(get_ids_wait(sock, MAX_COUNT, 1)[1]) == MAX_COUNT
+    assert len(get_ids_wait(sock, MAX_COUNT, 1)[1]) == 2 ** 17 - MAX_COUNT - 2
+    assert get_ids_wait(sock, 1, 0.5) == (STATUS_OUT_OF_IDS, 0.75)
+    assert sleeps == [0.5]
+
+    # other errors are not retried
+    node.now = 11
+    assert get_ids_wait(sock, 1, 1) == (STATUS_CLOCK_ERROR, None)
+    assert sleeps == [0.5]
+
+
+@pytest.mark.parametrize(
+    "status, cls",
+    [
+        (1, GlobalIdError),
+        (2, ValueError),
+        (3, OutOfIds),
+        (4, ClockError),
+        (5, OutOfSeconds),
+    ],
+)
+def test_response_error(status, cls):
+    error = response_error(status, 0.5)
+    assert type(error) is cls
+    if cls is OutOfIds:
+        assert error.retry_after == 0.5
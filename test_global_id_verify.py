@@ -0,0 +1,155 @@
+import os
+import struct
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+import pytest
+import global_id_verify
+from global_id import ClockError, OutOfIds
+from global_id_log import IdLogWriter, log_paths
+from global_id_verify import verify, main
+from test_global_id_udp import FakeTimeNode
+
+
+def write_ids(path, ids):
+    path.write_bytes(struct.pack(f"<{len(ids)}Q", *ids))
+    return str(path)
+
+
+class RestartedNode(FakeTimeNode):
+    initial_now = 15
+
+
+def generate_logs(tmp_path):
+    """Simulate multiple nodes, restarts, and clock jumps,
+    logging the ids with IdLogWriter."""
+    for node_id in range(3):
+        writer = IdLogWriter(
+            tmp_path, prefix=f"node{node_id}", rotate_every=2, node_cls=FakeTimeNode
+        )
+        node = FakeTimeNode(node_id)
+        for now in [11, 11.5, 12, 13.5, 14, 15]:
+            node.now = now
+            writer.write_ids(node.reserve(100))
+
+        # the clock goes backwards
+        node.now = 12
+        with pytest.raises(ClockError):
+            node.get_id()
+
+        # restart, on the same second, in a new process
+        writer.close()
+        writer = IdLogWriter(
+            tmp_path, prefix=f"node{node_id}-2", node_cls=FakeTimeNode
+        )
+        node = RestartedNode(node_id)
+        with pytest.raises(OutOfIds):
+            node.get_id()
+        for now in [16, 16.5, 30]:
+            node.now = now
+            writer.write_id(node.get_id())
+            writer.write_ids(node.reserve(1000))
+        writer.close()
+
+    return log_paths(tmp_path)
+
+
+@pytest.mark.parametrize("workers, shards, chunk_size", [(1, 1, 1 << 20), (1, 3, 7)])
+def test_verify_ok(tmp_path, workers, shards, chunk_size):
+    paths = generate_logs(tmp_path)
+    report = verify(paths, FakeTimeNode, workers, shards, chunk_size)
+    assert report.count == 3 * (6 * 100 + 3 * 1001)
+    assert report.duplicate_count == 0
+    assert report.duplicates == []
+    assert report.non_monotonic_count == 0
+    assert report.non_monotonic == []
+    assert report.seconds > 0
+
+
+def test_verify_process_pool(tmp_path):
+    paths = generate_logs(tmp_path)
+    report = verify(paths, FakeTimeNode, workers=2, shards=3, chunk_size=100)
+    assert report.count == 3 * (6 * 100 + 3 * 1001)
+    assert report.duplicate_count == 0
+    assert report.non_monotonic_count == 0
+
+
+def test_verify_duplicates(tmp_path):
+    one = write_ids(tmp_path / "one.ids", [1, 2, 3, 1024 + 2, 5 << 27])
+    two = write_ids(tmp_path / "two.ids", [3, 5 << 27, 6 << 27])
+    three = write_ids(tmp_path / "three.ids", [5 << 27])
+
+    report = verify(
+        [one, two, three], workers=1, shards=2, chunk_size=2, max_examples=1
+    )
+    assert report.count == 9
+    assert report.duplicate_count == 2
+    assert report.duplicates == [3]
+    assert report.non_monotonic_count == 0
+
+
+def test_verify_non_monotonic(tmp_path):
+    # node 0: 1024, 2048, 2048, 1024; node 1: 1025, 1
+    path = write_ids(tmp_path / "one.ids", [1024, 1025, 2048, 2048, 1, 1024])
+
+    report = verify([path], workers=1)
+    assert report.non_monotonic_count == 3
+    assert report.non_monotonic == [
+        (path, 2048, 2048),
+        (path, 1025, 1),
+        (path, 2048, 1024),
+    ]
+    assert report.duplicate_count == 2
+
+
+@pytest.mark.parametrize("fan_in", [2, 3, 64])
+def test_verify_merge_passes(tmp_path, monkeypatch, fan_in):
+    monkeypatch.setattr(global_id_verify, "MERGE_FAN_IN", fan_in)
+    ids = list(range(1, 1001))
+    one = write_ids(tmp_path / "one.ids", ids)
+    two = write_ids(tmp_path / "two.ids", ids[::100])
+
+    # 1010 ids, 101 runs of 10 ids
+    report = verify([one, two], workers=1, shards=1, chunk_size=10, tmp_dir=tmp_path)
+    assert report.count == 1010
+    assert report.duplicate_count == 10
+    assert report.duplicates == ids[::100]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["one.ids", "two.ids"]
+
+
+@pytest.mark.skipif(
+    resource is None or not os.path.isdir("/proc/self/fd"), reason="needs /proc"
+)
+def test_verify_open_files_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(global_id_verify, "MERGE_FAN_IN", 8)
+    path = write_ids(tmp_path / "one.ids", list(range(20000)))
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    # 200 runs; merging them all at once would need 200 files
+    limit = len(os.listdir("/proc/self/fd")) + 32
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+    try:
+        report = verify([path], workers=1, shards=1, chunk_size=100)
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    assert report.count == 20000
+    assert report.duplicate_count == 0
+
+
+def test_main(tmp_path, capsys):
+    path = write_ids(tmp_path / "one.ids", [1, 2, 3])
+    assert main(["--workers", "1", "--chunk-size", "2", path]) == 0
+    out = capsys.readouterr().out
+    assert "checked 3 ids from 1 files" in out
+    assert out.endswith("OK\n")
+
+    path = write_ids(tmp_path / "one.ids", [1, 2, 2])
+    assert main(["--workers", "1", "--tmp-dir", str(tmp_path), path]) == 1
+    out = capsys.readouterr().out
+    assert "duplicate ids: 1\n  2\n" in out
+    assert f"non-monotonic ids: 1\n  {path}: 2 after 2\n" in out
+    assert out.endswith("FAILED\n")